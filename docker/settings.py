@@ -279,9 +279,20 @@ SEND_PUBLISH_EMAIL = True
 RABBIT_BROKER = 'amqp://' + os.getenv('RABBITMQ_DEFAULT_USER', 'guest') + ':' + os.getenv('RABBITMQ_DEFAULT_PASS', 'guest') + '@layersrabbit:5672/'
 RABBIT_BACKEND = 'rpc://layersrabbit/'
 
-# Used for fetching repo
+# Number of parallel jobs used for fetching repositories and updating layers
 PARALLEL_JOBS = "4"
 
+# Number of layers a parse worker (see update.py --parse-workers) will handle
+# before restarting itself in order to free up leaked memory
+PARSE_WORKER_MAX_JOBS = 20
+
+# Additional processing to run on each recipe as it is parsed by the update
+# script (see RecipeParseStage in layerindex/recipeparse.py). If you are using
+# the Recipe Reporting System, add 'rrs.parsestage.RRSRecipeStage' here so that
+# its tools can use the data collected during the update instead of parsing
+# every recipe again.
+RECIPE_PARSE_STAGES = []
+
 # Install flite & sox and set these to enable audio for CAPTCHA challenges (for accessibility)
 #CAPTCHA_FLITE_PATH = "/usr/bin/flite"
 #CAPTCHA_SOX_PATH = "/usr/bin/sox"
@@ -305,6 +316,11 @@ TASK_LOG_DIR = "/opt/layerindex-task-logs"
 # Full path to directory where rrs tools stores logs
 TOOLS_LOG_DIR = ""
 
+# Number of hours for which the result of an upstream version check is reused
+# for recipes whose SRC_URI / UPSTREAM_CHECK_* values haven't changed (set to 0
+# to check every recipe on every run)
+RRS_UPSTREAM_CHECK_CACHE_HOURS = 72
+
 USE_X_FORWARDED_HOST = True
 ALLOWED_HOSTS = [os.getenv('HOSTNAME', 'layers.test')]
 CSRF_TRUSTED_ORIGINS = ['https://' + os.getenv('HOSTNAME', 'layers.test')]
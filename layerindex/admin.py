@@ -62,7 +62,7 @@ class LayerItemAdmin(CompareVersionAdmin):
 class LayerBranchAdmin(CompareVersionAdmin):
     list_filter = ['layer__name']
     search_fields = ['layer__name', 'layer__vcs_url']
-    readonly_fields = ('vcs_last_fetch', 'vcs_last_rev', 'vcs_last_commit')
+    readonly_fields = ('vcs_last_fetch', 'vcs_last_rev', 'vcs_last_commit', 'layerconf_hash', 'layerconf_values')
     inlines = [
         LayerDependencyInline,
         LayerMaintainerInline,
@@ -115,6 +115,10 @@ class DynamicBuildDepAdmin(admin.ModelAdmin):
     search_fields = ['name']
     filter_horizontal = ('package_configs',)
 
+class InheritedClassAdmin(admin.ModelAdmin):
+    search_fields = ['name']
+    filter_horizontal = ('recipes',)
+
 class SourceAdmin(admin.ModelAdmin):
     pass
 
@@ -220,6 +224,7 @@ admin.site.register(PackageConfig, PackageConfigAdmin)
 admin.site.register(StaticBuildDep, StaticBuildDepAdmin)
 admin.site.register(DynamicBuildDep, DynamicBuildDepAdmin)
 admin.site.register(ExtendedProvide)
+admin.site.register(InheritedClass, InheritedClassAdmin)
 admin.site.register(Source, SourceAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(RecipeFileDependency)
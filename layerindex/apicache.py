@@ -0,0 +1,89 @@
+# layerindex-web - REST API response caching
+#
+# The data served through the REST API only changes when layers are updated
+# or edited, but clients (e.g. build systems) poll it constantly. We derive
+# a "data version" from a handful of cheap aggregate queries and use it to
+# key cached responses and to generate ETags, so that unchanged data can be
+# returned from the cache or answered with 304 Not Modified.
+#
+# The aggregates are what make this work when the cache isn't shared between
+# processes (as with the default LocMemCache, where update.py can't clear the
+# web server's cache); additionally a generation number kept in the cache is
+# bumped by invalidate() to catch changes the aggregates don't reflect.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+import functools
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+
+GENERATION_CACHE_KEY = 'layerindex:api:generation'
+CACHE_KEY = 'layerindex:api:%s'
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _get_generation():
+    generation = cache.get(GENERATION_CACHE_KEY)
+    if generation is None:
+        cache.add(GENERATION_CACHE_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_CACHE_KEY)
+    return generation
+
+
+def invalidate():
+    """Invalidate all cached API responses"""
+    cache.set(GENERATION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def get_data_version():
+    """
+    Get a string that changes whenever any of the data served through the
+    API may have changed
+    """
+    from layerindex.models import Branch, LayerItem, LayerBranch, Update
+    from django.db.models import Count, Max, Sum
+
+    signature = [_get_generation()]
+    signature.append(Update.objects.aggregate(Max('id'), Max('finished')))
+    signature.append(LayerItem.objects.aggregate(Max('updated'), Count('id')))
+    signature.append(LayerBranch.objects.aggregate(Max('updated'), Count('id')))
+    signature.append(Branch.objects.aggregate(Sum('layerdeps_version'), Count('id')))
+    return hashlib.sha256(str(signature).encode('utf-8')).hexdigest()
+
+
+def cached_response(func):
+    """
+    Decorator for REST API viewset methods handling GET requests, which
+    caches the response data and handles conditional requests
+    """
+    @functools.wraps(func)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return func(self, request, *args, **kwargs)
+
+        url = request.build_absolute_uri()
+        key = hashlib.sha256(('%s %s' % (get_data_version(), url)).encode('utf-8')).hexdigest()
+        # The ETag needs to differ between representations of the same data
+        etag = '"%s-%s"' % (key[:32], request.accepted_renderer.format)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            data = cache.get(CACHE_KEY % key)
+            if data is None:
+                response = func(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(CACHE_KEY % key, response.data, CACHE_TIMEOUT)
+            else:
+                from rest_framework.response import Response
+                response = Response(data)
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        return response
+    return wrapper
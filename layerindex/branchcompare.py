@@ -0,0 +1,135 @@
+# layerindex-web - branch comparison
+#
+# Compares the recipes (and their versions) in a set of layers between two
+# branches. The results are cached, keyed on the layer branches involved and
+# when they were last updated, so repeated comparisons of the same branches
+# (which are common during release preparation) don't redo all the work.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Max
+from packaging_legacy.version import parse as parse_version
+
+
+CACHE_KEY = 'layerindex:branchcompare:%s'
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+class BranchComparisonVersionResult:
+    def __init__(self, id, pv, srcrev, layer):
+        self.id = id
+        self.pv = pv
+        self.srcrev = srcrev
+        self.layer = layer
+
+    def version_expr(self):
+        return (self.pv, self.srcrev)
+
+    def to_dict(self):
+        return {'id': self.id, 'pv': self.pv, 'srcrev': self.srcrev, 'layer': self.layer}
+
+
+class BranchComparisonResult:
+    def __init__(self, pn, short_desc):
+        self.pn = pn
+        self.short_desc = short_desc
+        self.from_versions = []
+        self.to_versions = []
+        self.id = None
+
+    def pv_changed(self):
+        from_pvs = sorted([x.pv for x in self.from_versions])
+        to_pvs = sorted([x.pv for x in self.to_versions])
+        return (from_pvs != to_pvs)
+
+    def to_dict(self):
+        return {'pn': self.pn,
+                'short_desc': self.short_desc,
+                'from_versions': [x.to_dict() for x in self.from_versions],
+                'to_versions': [x.to_dict() for x in self.to_versions]}
+
+
+def map_name(pn, pv):
+    if pn.startswith('gcc-source-'):
+        pn = pn.replace('-%s' % pv, '')
+    elif pn.endswith(('-i586', '-i686')):
+        pn = pn[:-5]
+    elif pn.endswith('-x86_64-oesdk-linux'):
+        pn = pn[:-19]
+    return pn
+
+
+def get_cache_key(from_branch, to_branch, layer_ids):
+    """
+    Get a cache key for comparing the specified branches, which changes
+    whenever any of the layer branches involved is added, removed or updated
+    """
+    from layerindex.models import LayerBranch, LayerUpdate
+
+    layerbranches = LayerBranch.objects.filter(branch__in=[from_branch, to_branch])
+    layerupdates = LayerUpdate.objects.filter(branch__in=[from_branch, to_branch])
+    if layer_ids:
+        layerbranches = layerbranches.filter(layer__in=layer_ids)
+        layerupdates = layerupdates.filter(layer__in=layer_ids)
+    signature = [from_branch.id, to_branch.id, sorted(layer_ids or [])]
+    signature.append(list(layerbranches.order_by('id').values_list('id', 'updated')))
+    signature.append(layerupdates.aggregate(Max('id'))['id__max'])
+    return CACHE_KEY % hashlib.sha256(str(signature).encode('utf-8')).hexdigest()
+
+
+def compute_comparison(from_branch, to_branch, layer_ids):
+    """
+    Compare recipes between two branches, returning lists of recipes
+    that have been added, changed and removed (BranchComparisonResult
+    objects, sorted by name)
+    """
+    from layerindex.models import Recipe
+
+    fields = ('id', 'pn', 'pv', 'srcrev', 'summary', 'description', 'layerbranch__layer__name')
+    recipes = {}
+    for branch, attr in [(from_branch, 'from_versions'), (to_branch, 'to_versions')]:
+        qs = Recipe.objects.filter(layerbranch__branch=branch)
+        if layer_ids:
+            qs = qs.filter(layerbranch__layer__in=layer_ids)
+        for recipe_id, pn, pv, srcrev, summary, description, layer in qs.order_by().values_list(*fields):
+            pn = map_name(pn, pv)
+            res = recipes.get(pn, None)
+            if not res:
+                res = BranchComparisonResult(pn, summary or description)
+                recipes[pn] = res
+            getattr(res, attr).append(BranchComparisonVersionResult(recipe_id, pv, srcrev, layer))
+
+    added = []
+    changed = []
+    removed = []
+    for _, recipe in sorted(recipes.items(), key=lambda item: item[0]):
+        recipe.from_versions = sorted(recipe.from_versions, key=lambda item: parse_version(item.pv))
+        from_version_exprs = [x.version_expr() for x in recipe.from_versions]
+        recipe.to_versions = sorted(recipe.to_versions, key=lambda item: parse_version(item.pv))
+        to_version_exprs = [x.version_expr() for x in recipe.to_versions]
+        if not from_version_exprs:
+            added.append(recipe)
+        elif not to_version_exprs:
+            recipe.id = recipe.from_versions[-1].id
+            removed.append(recipe)
+        elif from_version_exprs != to_version_exprs:
+            changed.append(recipe)
+    return added, changed, removed
+
+
+def compare_branches(from_branch, to_branch, layer_ids):
+    """
+    Get the comparison between two branches (as returned by
+    compute_comparison()), from the cache if possible
+    """
+    key = get_cache_key(from_branch, to_branch, layer_ids)
+    result = cache.get(key)
+    if result is None:
+        result = compute_comparison(from_branch, to_branch, layer_ids)
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
@@ -0,0 +1,166 @@
+# layerindex-web - layer dependency graph
+#
+# Walking layer dependencies through the LayerDependency model takes a query
+# per dependency; instead we load the whole graph for a branch at once and
+# cache it, keyed on a version number stored against the branch which is
+# bumped whenever a LayerDependency or LayerBranch on it is added or removed,
+# or a layer is renamed or changes status (see models.py). Since a version
+# bumped within a transaction that gets rolled back will be reused, graphs
+# only go into the cache once the transaction they were loaded in commits.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+CACHE_KEY = 'layerindex:layerdeps:%d:%d'
+
+# Layer branch on the branch (the graph nodes)
+LayerNode = namedtuple('LayerNode', 'layerbranch_id layer_id name status')
+
+# Dependency of a layer branch, on a layer which may or may not have a
+# layer branch on the same branch (if not, layerbranch_id is None)
+LayerEdge = namedtuple('LayerEdge', 'layer_id name required layerbranch_id')
+
+
+class LayerDependencyGraph:
+    """
+    Dependencies between all of the layers on a branch. Use
+    LayerDependencyGraph.get() rather than constructing directly.
+    """
+    def __init__(self, branch_id, version, nodes, edges):
+        self.branch_id = branch_id
+        self.version = version
+        self.nodes = nodes
+        self.edges = edges
+        self._dependents = None
+
+    @classmethod
+    def load(cls, branch_id, version):
+        from layerindex.models import LayerBranch, LayerDependency
+
+        nodes = {}
+        layer_nodes = {}
+        for layerbranch_id, layer_id, name, status in LayerBranch.objects.filter(branch_id=branch_id).order_by('layer__name').values_list('id', 'layer_id', 'layer__name', 'layer__status'):
+            nodes[layerbranch_id] = LayerNode(layerbranch_id, layer_id, name, status)
+            layer_nodes[layer_id] = layerbranch_id
+        edges = {layerbranch_id: [] for layerbranch_id in nodes}
+        for layerbranch_id, layer_id, name, required in LayerDependency.objects.filter(layerbranch__branch_id=branch_id).order_by('id').values_list('layerbranch_id', 'dependency_id', 'dependency__name', 'required'):
+            edges[layerbranch_id].append(LayerEdge(layer_id, name, required, layer_nodes.get(layer_id)))
+        return cls(branch_id, version, nodes, edges)
+
+    @classmethod
+    def get(cls, branch_id):
+        """Get the dependency graph for the specified branch (by id)"""
+        from layerindex.models import Branch
+
+        # Always check the current version rather than trusting a Branch
+        # object that may have been loaded before the dependencies changed
+        version = Branch.objects.filter(id=branch_id).values_list('layerdeps_version', flat=True).first()
+        if version is None:
+            return cls(branch_id, None, {}, {})
+        key = CACHE_KEY % (branch_id, version)
+        graph = cache.get(key)
+        if graph is None:
+            graph = cls.load(branch_id, version)
+            # Runs immediately outside of a transaction
+            transaction.on_commit(lambda: cache.set(key, graph, None))
+        return graph
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_dependents'] = None
+        return state
+
+    def dependencies(self, layerbranch_id, required=None):
+        """
+        Get the direct dependencies (LayerEdge tuples) of a layer branch;
+        required=True/False restricts to dependencies/recommends only
+        """
+        return [edge for edge in self.edges.get(layerbranch_id, [])
+                if required is None or edge.required == required]
+
+    def _follow(self, layerbranch_id, required):
+        for edge in self.edges.get(layerbranch_id, []):
+            if edge.layerbranch_id and (edge.required or not required):
+                yield edge.layerbranch_id
+
+    def recursive_dependencies(self, layerbranch_id, required=True, include_self=False):
+        """
+        Get the ids of the layer branches that a layer branch depends upon,
+        directly or indirectly, in depth-first order. If required is True
+        only required dependencies are followed, otherwise recommends are
+        as well.
+        """
+        deplist = []
+        seen = set()
+        def recurse_deps(current):
+            deplist.append(current)
+            seen.add(current)
+            for dep in self._follow(current, required):
+                if dep not in seen:
+                    recurse_deps(dep)
+        recurse_deps(layerbranch_id)
+        if include_self:
+            return deplist
+        else:
+            return deplist[1:]
+
+    def dependents(self, layerbranch_id, required=True, recursive=False):
+        """
+        Get the ids of the layer branches that depend upon a layer branch
+        (sorted by layer name)
+        """
+        if self._dependents is None:
+            self._dependents = ({}, {})
+            for source, edges in self.edges.items():
+                for edge in edges:
+                    if edge.layerbranch_id:
+                        if edge.required:
+                            self._dependents[0].setdefault(edge.layerbranch_id, set()).add(source)
+                        self._dependents[1].setdefault(edge.layerbranch_id, set()).add(source)
+        reverse = self._dependents[0 if required else 1]
+        result = set(reverse.get(layerbranch_id, []))
+        if recursive:
+            pending = list(result)
+            while pending:
+                for dependent in reverse.get(pending.pop(), []):
+                    if dependent not in result:
+                        result.add(dependent)
+                        pending.append(dependent)
+            result.discard(layerbranch_id)
+        return sorted(result, key=lambda dependent: self.nodes[dependent].name)
+
+    def topological_order(self, layerbranch_ids=None, required=True):
+        """
+        Sort layer branches (all of those on the branch by default) such
+        that each comes after the layer branches it depends upon. Layers
+        caught in a dependency loop come last, sorted by name.
+        """
+        if layerbranch_ids is None:
+            layerbranch_ids = self.nodes.keys()
+        remaining = set(layerbranch_ids)
+        pending = {layerbranch_id: set(self._follow(layerbranch_id, required)) & remaining
+                   for layerbranch_id in remaining}
+        key = lambda layerbranch_id: self.nodes[layerbranch_id].name
+        result = []
+        ready = sorted([layerbranch_id for layerbranch_id, deps in pending.items() if not deps], key=key)
+        while ready:
+            current = ready.pop(0)
+            result.append(current)
+            remaining.discard(current)
+            newly_ready = []
+            for layerbranch_id in remaining:
+                deps = pending[layerbranch_id]
+                if current in deps:
+                    deps.discard(current)
+                    if not deps:
+                        newly_ready.append(layerbranch_id)
+            ready = sorted(ready + newly_ready, key=key)
+        result.extend(sorted(remaining, key=key))
+        return result
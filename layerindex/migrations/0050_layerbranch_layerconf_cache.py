@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0049_alter_layerbranch_vcs_subdir'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='layerbranch',
+            name='layerconf_hash',
+            field=models.CharField(blank=True, help_text='Hash of conf/layer.conf as of the last update (used to determine if cached layer.conf values are still valid)', max_length=64, verbose_name='layer.conf hash'),
+        ),
+        migrations.AddField(
+            model_name='layerbranch',
+            name='layerconf_values',
+            field=models.TextField(blank=True, help_text='Values read from conf/layer.conf as of the last update', verbose_name='Cached layer.conf values'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0050_layerbranch_layerconf_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='parse_inputs',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='parse_inputs_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
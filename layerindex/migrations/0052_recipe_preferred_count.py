@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:42
+
+from django.db import migrations, models
+
+
+def populate_preferred_count(apps, schema_editor):
+    Branch = apps.get_model('layerindex', 'Branch')
+    Recipe = apps.get_model('layerindex', 'Recipe')
+
+    for branch in Branch.objects.all():
+        recipes = {}
+        for row in Recipe.objects.filter(layerbranch__branch=branch).values_list('id', 'pn', 'layerbranch_id', 'layerbranch__layer__index_preference', 'layerbranch__layer__layer_type'):
+            recipes.setdefault(row[1], []).append(row)
+        counts = {}
+        for rows in recipes.values():
+            for recipe_id, _, layerbranch_id, preference, _ in rows:
+                count = len([row for row in rows
+                             if row[2] != layerbranch_id and row[4] in ('S', 'A') and row[3] > preference])
+                if count:
+                    counts.setdefault(count, []).append(recipe_id)
+        for count, ids in counts.items():
+            for i in range(0, len(ids), 500):
+                Recipe.objects.filter(id__in=ids[i:i+500]).update(preferred_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0051_recipe_parse_inputs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='preferred_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(populate_preferred_count, reverse_code=migrations.RunPython.noop),
+    ]
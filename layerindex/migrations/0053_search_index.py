@@ -0,0 +1,87 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import re
+
+
+# A frozen copy of the search configuration at the time of this migration
+# (table, fields in order of weight); the vector expression must match the
+# one layerindex.search.PostgreSQLSearchBackend builds for queries, or the
+# indexes won't be used
+SEARCH_TABLES = [
+    ('recipe', 'Recipe', 'layerindex_recipe', ['pn', 'summary', 'description']),
+    ('machine', 'Machine', 'layerindex_machine', ['name', 'description']),
+    ('distro', 'Distro', 'layerindex_distro', ['name', 'description']),
+    ('bbclass', 'BBClass', 'layerindex_bbclass', ['name']),
+]
+
+FIELD_WEIGHTS = [3, 2, 1]
+
+
+def tsvector(table, fields):
+    return ' || '.join("setweight(to_tsvector('simple', coalesce(%s.%s, '')), '%s')" % (table, field, 'ABC'[i])
+                       for i, field in enumerate(fields))
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for _, _, table, fields in SEARCH_TABLES:
+        index_name = '%s_search' % table
+        if vendor == 'postgresql':
+            schema_editor.execute('CREATE INDEX %s ON %s USING GIN ((%s))' % (index_name, table, tsvector(table, fields)))
+        elif vendor == 'mysql':
+            schema_editor.execute('CREATE FULLTEXT INDEX %s ON %s (%s)' % (index_name, table, ', '.join(fields)))
+    if vendor not in ['postgresql', 'mysql']:
+        # Fill in the inverted index used instead
+        LayerBranch = apps.get_model('layerindex', 'LayerBranch')
+        SearchIndexEntry = apps.get_model('layerindex', 'SearchIndexEntry')
+        max_length = SearchIndexEntry._meta.get_field('term').max_length
+        for layerbranch_id in LayerBranch.objects.values_list('id', flat=True):
+            entries = []
+            for model_name, class_name, _, fields in SEARCH_TABLES:
+                model = apps.get_model('layerindex', class_name)
+                for row in model.objects.filter(layerbranch_id=layerbranch_id).values_list('id', *fields):
+                    weights = {}
+                    for value, weight in zip(row[1:], FIELD_WEIGHTS):
+                        for token in re.findall(r'[^\W_]+', (value or '').lower()):
+                            token = token[:max_length]
+                            weights[token] = max(weights.get(token, 0), weight)
+                    for token, weight in weights.items():
+                        entries.append(SearchIndexEntry(layerbranch_id=layerbranch_id, model=model_name,
+                                                        object_id=row[0], term=token, weight=weight))
+            SearchIndexEntry.objects.bulk_create(entries, batch_size=1000)
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for _, _, table, _ in SEARCH_TABLES:
+        index_name = '%s_search' % table
+        if vendor == 'postgresql':
+            schema_editor.execute('DROP INDEX %s' % index_name)
+        elif vendor == 'mysql':
+            schema_editor.execute('DROP INDEX %s ON %s' % (index_name, table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0052_recipe_preferred_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('term', models.CharField(max_length=50)),
+                ('weight', models.SmallIntegerField(default=1)),
+                ('layerbranch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='layerindex.layerbranch')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model', 'term'], name='layerindex__model_060a99_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_indexes, reverse_code=drop_search_indexes),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:48
+
+from django.db import migrations, models
+
+
+def populate_inherited_classes(apps, schema_editor):
+    Recipe = apps.get_model('layerindex', 'Recipe')
+    InheritedClass = apps.get_model('layerindex', 'InheritedClass')
+    through = InheritedClass.recipes.through
+
+    links = []
+    for recipe_id, inherits in Recipe.objects.exclude(inherits='').values_list('id', 'inherits'):
+        for name in set(inherits.split()):
+            links.append((recipe_id, name[:100]))
+    names = set(name for _, name in links)
+    InheritedClass.objects.bulk_create([InheritedClass(name=name) for name in names])
+    class_ids = dict(InheritedClass.objects.values_list('name', 'id'))
+    through.objects.bulk_create([through(recipe_id=recipe_id, inheritedclass_id=class_ids[name]) for recipe_id, name in links],
+                                batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0053_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InheritedClass',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('recipes', models.ManyToManyField(to='layerindex.recipe')),
+            ],
+            options={
+                'verbose_name_plural': 'Inherited classes',
+            },
+        ),
+        migrations.RunPython(populate_inherited_classes, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0054_inheritedclass'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='layerdeps_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+
+
+def merge_duplicates(model, m2m_fields):
+    keep = {}
+    duplicates = {}
+    for pk, name in model.objects.order_by('id').values_list('id', 'name'):
+        if name in keep:
+            duplicates[pk] = keep[name]
+        else:
+            keep[name] = pk
+    if not duplicates:
+        return
+    for fieldname in m2m_fields:
+        field = model._meta.get_field(fieldname)
+        through = field.remote_field.through
+        source_attr = '%s_id' % field.m2m_field_name()
+        target_attr = '%s_id' % field.m2m_reverse_field_name()
+        existing = set(through.objects.filter(**{'%s__in' % source_attr: set(duplicates.values())}).values_list(source_attr, target_attr))
+        links = []
+        for source_id, target_id in through.objects.filter(**{'%s__in' % source_attr: duplicates.keys()}).values_list(source_attr, target_attr):
+            link = (duplicates[source_id], target_id)
+            if link not in existing:
+                existing.add(link)
+                links.append(through(**{source_attr: link[0], target_attr: link[1]}))
+        through.objects.bulk_create(links, batch_size=1000)
+    model.objects.filter(id__in=duplicates.keys()).delete()
+
+
+def merge_duplicate_names(apps, schema_editor):
+    merge_duplicates(apps.get_model('layerindex', 'StaticBuildDep'), ['recipes'])
+    merge_duplicates(apps.get_model('layerindex', 'DynamicBuildDep'), ['recipes', 'package_configs'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0055_branch_layerdeps_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dynamicbuilddep',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='staticbuilddep',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
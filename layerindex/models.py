@@ -11,7 +11,7 @@ from datetime import datetime
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.core.validators import URLValidator
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
 from collections import namedtuple
 import os.path
@@ -19,7 +19,8 @@ import re
 import posixpath
 import codecs
 
-from . import utils
+from . import apicache, utils
+from .layerdeps import LayerDependencyGraph
 
 
 logger = utils.logger_create('LayerIndexModels')
@@ -78,6 +79,9 @@ class Branch(models.Model):
     comparison = models.BooleanField('Comparison', default=False, help_text='If enabled, branch is for comparison purposes only and will appear separately')
     update_environment = models.ForeignKey(PythonEnvironment, blank=True, null=True, on_delete=models.SET_NULL)
     hidden = models.BooleanField('Hidden', default=False, help_text='Hide from normal selections')
+    # Incremented whenever layer dependencies on the branch change, so that
+    # the cached dependency graph can be invalidated (see layerdeps.py)
+    layerdeps_version = models.PositiveIntegerField(default=0, editable=False)
 
     updated = models.DateTimeField(auto_now=True, blank=True, null=True)
 
@@ -93,6 +97,16 @@ class Branch(models.Model):
         else:
             return self.name
 
+    def get_layer_dependency_graph(self):
+        return LayerDependencyGraph.get(self.id)
+
+    @staticmethod
+    def invalidate_layer_dependencies(branch_ids=None):
+        qs = Branch.objects.all()
+        if branch_ids is not None:
+            qs = qs.filter(id__in=branch_ids)
+        qs.update(layerdeps_version=models.F('layerdeps_version') + 1)
+
 
 class Update(models.Model):
     started = models.DateTimeField()
@@ -153,6 +167,21 @@ class LayerItem(models.Model):
     def change_status(self, newstatus, username):
         self.status = newstatus
 
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk:
+            old = LayerItem.objects.filter(pk=self.pk).values('name', 'status', 'index_preference', 'layer_type').first()
+        super(LayerItem, self).save(*args, **kwargs)
+        if old and (old['name'] != self.name or old['status'] != self.status):
+            # Layer names and status are held in the cached dependency graphs
+            Branch.invalidate_layer_dependencies(self.layerbranch_set.values('branch_id'))
+        if old and (old['index_preference'] != self.index_preference or old['layer_type'] != self.layer_type):
+            # Recipes in this layer may now shadow (or be shadowed by)
+            # recipes of the same name in other layers
+            for layerbranch in self.layerbranch_set.all():
+                Recipe.update_preferred_counts(layerbranch.branch_id,
+                                               layerbranch.recipe_set.values_list('pn', flat=True))
+
     def get_layerbranch(self, branchname):
         if branchname:
             res = list(self.layerbranch_set.filter(branch__name=branchname)[:1])
@@ -242,6 +271,8 @@ class LayerBranch(models.Model):
     yp_compatible_version = models.ForeignKey(YPCompatibleVersion, verbose_name='Yocto Project Compatible version', null=True, blank=True, on_delete=models.SET_NULL, help_text='Which version of the Yocto Project Compatible program has this layer been approved for for?')
     local_path = models.CharField(max_length=255, blank=True, help_text='Local subdirectory where layer data can be found')
     updates_enabled = models.BooleanField('Enable updates', default=True, help_text='Enable automatically updating layer metadata for this layer:branch via the update script')
+    layerconf_hash = models.CharField('layer.conf hash', max_length=64, blank=True, help_text='Hash of conf/layer.conf as of the last update (used to determine if cached layer.conf values are still valid)')
+    layerconf_values = models.TextField('Cached layer.conf values', blank=True, help_text='Values read from conf/layer.conf as of the last update')
     updated = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -353,23 +384,37 @@ class LayerBranch(models.Model):
     def get_recommends(self):
         return self.dependencies_set.filter(required=False)
 
+    def _get_layerbranches(self, ids):
+        layerbranches = LayerBranch.objects.select_related('layer', 'branch').in_bulk(ids)
+        return [layerbranches[layerbranch_id] for layerbranch_id in ids if layerbranch_id in layerbranches]
+
     def get_recursive_dependencies(self, required=True, include_self=False):
-        deplist = []
-        def recurse_deps(layerbranch):
-            deplist.append(layerbranch)
-            if required:
-                dep_set = layerbranch.dependencies_set.filter(required=True)
-            else:
-                dep_set = layerbranch.dependencies_set.all()
-            for dep in dep_set:
-                deplayerbranch = dep.dependency.get_layerbranch(layerbranch.branch.name)
-                if deplayerbranch and deplayerbranch not in deplist:
-                    recurse_deps(deplayerbranch)
-        recurse_deps(self)
-        if include_self:
-            return deplist
-        else:
-            return deplist[1:]
+        graph = LayerDependencyGraph.get(self.branch_id)
+        return self._get_layerbranches(graph.recursive_dependencies(self.id, required, include_self))
+
+    def get_dependents(self, required=True, recursive=False):
+        """Get the layer branches on the same branch that depend on this one"""
+        graph = LayerDependencyGraph.get(self.branch_id)
+        return self._get_layerbranches(graph.dependents(self.id, required, recursive))
+
+@receiver(post_save, sender=LayerBranch)
+def layerbranch_post_save(sender, instance, created, *args, **kwargs):
+    if created:
+        Branch.invalidate_layer_dependencies([instance.branch_id])
+
+@receiver(pre_delete, sender=LayerBranch)
+def layerbranch_pre_delete(sender, instance, *args, **kwargs):
+    # Remember which recipe names need their preferred_count updating once
+    # the recipes in this layer branch have gone
+    instance._recipe_pns = list(instance.recipe_set.values_list('pn', flat=True))
+
+@receiver(post_delete, sender=LayerBranch)
+def layerbranch_post_delete(sender, instance, *args, **kwargs):
+    pns = getattr(instance, '_recipe_pns', None)
+    if pns:
+        Recipe.update_preferred_counts(instance.branch_id, pns)
+    Branch.invalidate_layer_dependencies([instance.branch_id])
+
 
 class LayerMaintainer(models.Model):
     MAINTAINER_STATUS_CHOICES = (
@@ -400,6 +445,11 @@ class LayerDependency(models.Model):
     def __str__(self):
         return "%s depends on %s" % (self.layerbranch.layer.name, self.dependency.name)
 
+@receiver(post_save, sender=LayerDependency)
+@receiver(post_delete, sender=LayerDependency)
+def layerdependency_changed(sender, instance, *args, **kwargs):
+    Branch.invalidate_layer_dependencies(LayerBranch.objects.filter(id=instance.layerbranch_id).values('branch_id'))
+
 
 class LayerNote(models.Model):
     layer = models.ForeignKey(LayerItem, on_delete=models.CASCADE)
@@ -408,6 +458,19 @@ class LayerNote(models.Model):
     def __str__(self):
         return "%s: %s" % (self.layer.name, self.text)
 
+# Changes to these aren't reflected in the version used to key cached REST
+# API responses (see apicache.py), so invalidate explicitly
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+@receiver(post_save, sender=YPCompatibleVersion)
+@receiver(post_delete, sender=YPCompatibleVersion)
+@receiver(post_save, sender=LayerMaintainer)
+@receiver(post_delete, sender=LayerMaintainer)
+@receiver(post_save, sender=LayerNote)
+@receiver(post_delete, sender=LayerNote)
+def api_data_changed(sender, instance, *args, **kwargs):
+    apicache.invalidate()
+
 
 class LayerUpdate(models.Model):
     layer = models.ForeignKey(LayerItem, on_delete=models.CASCADE)
@@ -477,6 +540,43 @@ class Recipe(models.Model):
     blacklisted = models.CharField(max_length=255, blank=True)
     configopts = models.CharField(max_length=4096, blank=True)
     srcrev = models.CharField(max_length=64, blank=True)
+    parse_inputs = models.TextField(blank=True)
+    parse_inputs_hash = models.CharField(max_length=64, blank=True)
+    # Number of recipes with the same name in layers with a higher
+    # index_preference on the same branch (see update_preferred_counts())
+    preferred_count = models.IntegerField(default=0, db_index=True)
+
+    @staticmethod
+    def update_preferred_counts(branch_id, pns=None):
+        """
+        Recalculate preferred_count for recipes on the specified branch,
+        optionally only those with one of the specified names
+        """
+        if pns is not None:
+            pns = list(set(pns))
+            if not pns:
+                return
+            chunks = [pns[i:i+500] for i in range(0, len(pns), 500)]
+        else:
+            chunks = [None]
+        for chunk in chunks:
+            qs = Recipe.objects.filter(layerbranch__branch_id=branch_id)
+            if chunk is not None:
+                qs = qs.filter(pn__in=chunk)
+            recipes = {}
+            for row in qs.values_list('id', 'pn', 'layerbranch_id', 'layerbranch__layer__index_preference',
+                                      'layerbranch__layer__layer_type', 'preferred_count'):
+                recipes.setdefault(row[1], []).append(row)
+            changed = {}
+            for rows in recipes.values():
+                for recipe_id, _, layerbranch_id, preference, _, old_count in rows:
+                    count = len([row for row in rows
+                                 if row[2] != layerbranch_id and row[4] in ('S', 'A') and row[3] > preference])
+                    if count != old_count:
+                        changed.setdefault(count, []).append(recipe_id)
+            for count, ids in changed.items():
+                for i in range(0, len(ids), 500):
+                    Recipe.objects.filter(id__in=ids[i:i+500]).update(preferred_count=count)
 
     def vcs_web_url(self):
         url = self.layerbranch.file_url(os.path.join(self.filepath, self.filename))
@@ -626,7 +726,7 @@ class PackageConfig(models.Model):
 
 class StaticBuildDep(models.Model):
     recipes = models.ManyToManyField(Recipe)
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
 
     def __str__(self):
         return self.name
@@ -634,7 +734,18 @@ class StaticBuildDep(models.Model):
 class DynamicBuildDep(models.Model):
     package_configs = models.ManyToManyField(PackageConfig)
     recipes = models.ManyToManyField(Recipe)
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+class InheritedClass(models.Model):
+    """Name of a class inherited by recipes (the class itself may be in any layer)"""
+    recipes = models.ManyToManyField(Recipe)
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        verbose_name_plural = "Inherited classes"
 
     def __str__(self):
         return self.name
@@ -970,3 +1081,23 @@ class ExtendedProvide(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class SearchIndexEntry(models.Model):
+    """
+    Full-text search index entry, used where the database doesn't provide
+    full-text search itself (see search.py)
+    """
+    layerbranch = models.ForeignKey(LayerBranch, on_delete=models.CASCADE)
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    term = models.CharField(max_length=50)
+    weight = models.SmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'term']),
+        ]
+
+    def __str__(self):
+        return '%s: %s #%d' % (self.term, self.model, self.object_id)
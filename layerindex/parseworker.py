@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+# Persistent recipe parsing worker for the layer index update script
+#
+# Starting up tinfoil and parsing the base configuration takes several
+# seconds, which update_layer.py would otherwise pay for every layer. This
+# worker does that once per branch and then serves parsing requests from
+# update_layer.py over a Unix socket. To contain the memory leaks that led
+# to update_layer.py being run as a separate process in the first place,
+# the worker restarts itself after serving a configurable number of jobs.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+
+import sys
+import os
+import optparse
+import logging
+import json
+import time
+import signal
+import subprocess
+from multiprocessing.connection import Listener, Client
+import utils
+import recipeparse
+
+import warnings
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+logger = utils.logger_create('LayerIndexParseWorker')
+
+# Variables (along with their per-collection variants) that we need from layer.conf
+LAYERCONF_VARS = ['LAYERVERSION', 'LAYERDEPENDS', 'LAYERRECOMMENDS']
+
+
+class ParseWorkerError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class LayerConfValues(dict):
+    """
+    Values read from a layer's conf/layer.conf by the worker, accessible
+    via getVar() like the datastore they came from
+    """
+    def getVar(self, var, expand=True):
+        return self.get(var)
+
+
+class ParseWorkerClient:
+    """
+    Client for the parse worker, used by update_layer.py in place of
+    recipeparse.TinfoilRecipeParser
+    """
+    def __init__(self, sockpath, timeout=600):
+        self.conn = None
+        # The worker may be (re)starting, in which case the socket won't be
+        # accepting connections until it has finished initialising
+        start = time.time()
+        while True:
+            try:
+                self.conn = Client(sockpath, family='AF_UNIX')
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.time() - start > timeout:
+                    raise ParseWorkerError('Timed out connecting to parse worker at %s' % sockpath)
+                time.sleep(0.5)
+        info = self._request('hello')
+        self.skip_patches = info['skip_patches']
+
+    def _request(self, cmd, **kwargs):
+        kwargs['cmd'] = cmd
+        try:
+            self.conn.send_bytes(json.dumps(kwargs).encode('utf-8'))
+            response = json.loads(self.conn.recv_bytes().decode('utf-8'))
+        except (EOFError, OSError) as e:
+            raise ParseWorkerError('Lost connection to parse worker: %s' % str(e))
+        if 'error' in response:
+            raise recipeparse.RecipeParseError(response['error'])
+        return response
+
+    def parse_layer_conf(self, layerdir, layername, core=False):
+        values = self._request('layerconf', layerdir=layerdir, layername=layername, core=core)['values']
+        if values is None:
+            return None
+        return LayerConfValues(values)
+
+    def setup_layer(self, layerdir, deplayerdirs):
+        self._request('setup_layer', layerdir=layerdir, deplayerdirs=deplayerdirs)
+
+    def get_recipe_values(self, fn, layerdir_start, repodir, skip_patches=False):
+        return self._request('parse', fn=fn, layerdir_start=layerdir_start, repodir=repodir, skip_patches=skip_patches)['values']
+
+    def get_distro_name(self, path):
+        return self._request('distro_name', path=path)['value']
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+class ParseWorker:
+    """
+    Handle used by update.py to start and stop a parse worker process for a
+    branch. The worker restarts itself (in place) as needed, so this only
+    needs to start it again if it has exited for some other reason.
+    """
+    def __init__(self, branch, sockpath, max_jobs, nocheckout=False, loglevel=logging.INFO, shared_checkout=False):
+        self.branch = branch
+        self.sockpath = sockpath
+        self.max_jobs = max_jobs
+        self.nocheckout = nocheckout
+        self.shared_checkout = shared_checkout
+        self.loglevel = loglevel
+        self.process = None
+
+    def get_command(self):
+        if self.branch.update_environment:
+            cmdprefix = self.branch.update_environment.get_command()
+        else:
+            cmdprefix = 'python3'
+        cmd = '%s parseworker.py -b %s -s %s -m %d' % (cmdprefix, self.branch.name, self.sockpath, self.max_jobs)
+        if self.nocheckout:
+            cmd += ' --nocheckout'
+        if self.shared_checkout:
+            cmd += ' --shared-checkout'
+        if self.loglevel == logging.DEBUG:
+            cmd += ' -d'
+        elif self.loglevel == logging.ERROR:
+            cmd += ' -q'
+        return cmd
+
+    def ensure_running(self):
+        if self.process is None or self.process.poll() is not None:
+            cmd = self.get_command()
+            logger.debug('Starting parse worker: %s' % cmd)
+            # Put the worker in its own process group so that we can reliably
+            # terminate it (and anything it has started) later on
+            self.process = subprocess.Popen(cmd, shell=True, cwd=os.path.dirname(os.path.abspath(__file__)), start_new_session=True)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+        self.process = None
+
+
+class ParseWorkerServer:
+    def __init__(self, tinfoil, skip_patches):
+        self.tinfoil = tinfoil
+        self.skip_patches = skip_patches
+        self.config_data = None
+        self.stages = recipeparse.get_recipe_parse_stages()
+
+    def handle(self, request):
+        cmd = request['cmd']
+        if cmd == 'hello':
+            return {'skip_patches': self.skip_patches}
+        elif cmd == 'layerconf':
+            return {'values': self.read_layer_conf(request['layerdir'], request['layername'], request['core'])}
+        elif cmd == 'setup_layer':
+            self.config_data = recipeparse.setup_layer_dirs(self.tinfoil.config_data, request['layerdir'], request['deplayerdirs'])
+            return {}
+        elif cmd == 'parse':
+            if self.config_data is None:
+                raise recipeparse.RecipeParseError('setup_layer must be called before parse')
+            values = recipeparse.get_recipe_values(self.tinfoil, self.config_data, request['fn'],
+                                                   request['layerdir_start'], request['repodir'],
+                                                   request['skip_patches'] or self.skip_patches,
+                                                   self.stages)
+            return {'values': values}
+        elif cmd == 'distro_name':
+            d = utils.parse_conf(request['path'], self.config_data)
+            return {'value': d.getVar('DISTRO_NAME', True)}
+        else:
+            raise recipeparse.RecipeParseError('Unknown command "%s"' % cmd)
+
+    def read_layer_conf(self, layerdir, layername, core):
+        config_data = bb.data.createCopy(self.tinfoil.config_data)
+        if not core:
+            # (the core layer has already been parsed via BBLAYERS)
+            if not utils.is_layer_valid(layerdir):
+                return None
+            utils.parse_layer_conf(layerdir, config_data, logger=logger)
+        collections = (config_data.getVar('BBFILE_COLLECTIONS', True) or '').split()
+        names = ['BBFILE_COLLECTIONS', 'LAYERDIR']
+        for var in LAYERCONF_VARS:
+            names.append(var)
+            names.extend(['%s_%s' % (var, suffix) for suffix in collections + [layername]])
+        return {name: config_data.getVar(name, True) for name in names}
+
+    def serve(self, conn):
+        self.config_data = None
+        while True:
+            try:
+                request = json.loads(conn.recv_bytes().decode('utf-8'))
+            except EOFError:
+                break
+            try:
+                response = self.handle(request)
+            except KeyboardInterrupt:
+                raise
+            except BaseException as e:
+                # Pass the error back to the client to deal with
+                response = {'error': str(e)}
+            conn.send_bytes(json.dumps(response, default=str).encode('utf-8'))
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage = """
+    %prog [options]""")
+
+    parser.add_option("-b", "--branch",
+            help = "Specify branch to parse recipes for",
+            action="store", dest="branch", default='master')
+    parser.add_option("-s", "--socket",
+            help = "Path of the Unix socket to listen on",
+            action="store", dest="socket")
+    parser.add_option("-m", "--max-jobs",
+            help = "Restart after serving this many jobs (0 for no limit)",
+            type="int", action="store", dest="max_jobs", default=0)
+    parser.add_option("", "--nocheckout",
+            help = "Don't check out branches",
+            action="store_true", dest="nocheckout")
+    parser.add_option("", "--shared-checkout",
+            help = "Repositories are shared with other concurrent updates; leave them alone if already at the right revision",
+            action="store_true", dest="shared_checkout")
+    parser.add_option("-d", "--debug",
+            help = "Enable debug output",
+            action="store_const", const=logging.DEBUG, dest="loglevel", default=logging.INFO)
+    parser.add_option("-q", "--quiet",
+            help = "Hide all output except error messages",
+            action="store_const", const=logging.ERROR, dest="loglevel")
+
+    options, args = parser.parse_args(sys.argv)
+    if len(args) > 1:
+        logger.error('unexpected argument "%s"' % args[1])
+        parser.print_help()
+        sys.exit(1)
+
+    if not options.socket:
+        logger.error('Please specify a socket path with -s')
+        sys.exit(1)
+
+    utils.setup_django()
+    import settings
+    from layerindex.models import LayerItem
+
+    logger.setLevel(options.loglevel)
+
+    branch = utils.get_branch(options.branch)
+    if not branch:
+        logger.error("Specified branch %s is not valid" % options.branch)
+        sys.exit(1)
+
+    bitbakeitem = LayerItem()
+    bitbakeitem.vcs_url = settings.BITBAKE_REPO_URL
+    bitbakepath = os.path.join(settings.LAYER_FETCH_DIR, bitbakeitem.get_fetch_dir())
+    if getattr(settings, 'BITBAKE_PATH', ''):
+        bitbakepath = os.path.join(bitbakepath, settings.BITBAKE_PATH)
+
+    try:
+        (tinfoil, tempdir) = recipeparse.init_parser(settings, branch, bitbakepath, nocheckout=options.nocheckout, logger=logger, shared_checkout=options.shared_checkout)
+    except recipeparse.RecipeParseError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    # Same adjustments as update_layer.py makes (see there for details)
+    tinfoil.config_data.setVar('SUMMARY', '')
+    tinfoil.config_data.setVar('DESCRIPTION', '')
+    tinfoil.config_data.setVar('HOMEPAGE', '')
+    tinfoil.config_data.setVar('LICENSE', '')
+
+    utils.setup_core_layer_sys_path(settings, branch.name)
+    skip_patches = False
+    try:
+        import oe.recipeutils
+    except ImportError:
+        skip_patches = True
+
+    if os.path.exists(options.socket):
+        # Left over from a previous instance
+        os.unlink(options.socket)
+    listener = Listener(options.socket, family='AF_UNIX')
+    os.chmod(options.socket, 0o600)
+    logger.debug('Parse worker for branch %s listening on %s' % (branch.name, options.socket))
+
+    server = ParseWorkerServer(tinfoil, skip_patches)
+    jobs = 0
+    try:
+        while not options.max_jobs or jobs < options.max_jobs:
+            conn = listener.accept()
+            try:
+                server.serve(conn)
+            finally:
+                conn.close()
+            jobs += 1
+    except KeyboardInterrupt:
+        sys.exit(254)
+    finally:
+        listener.close()
+        tinfoil.shutdown()
+        utils.rmtree_force(tempdir)
+
+    # Start afresh in place of this process so that any memory leaked
+    # during parsing is released; the socket will come back once the new
+    # instance has initialised (clients wait for it)
+    logger.debug('Parse worker served %d jobs, restarting' % jobs)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -89,14 +89,21 @@ def _validate_input(input, model):
 # uses search_allowed_fields in orm/models.py to create a search query
 # for these fields with the supplied input text
 def _get_search_results(search_term, queryset, model):
+    from layerindex import search
+    _, search_config = search.get_search_config(model)
     search_objects = []
     for st in search_term.split(" "):
         if hasattr(model, 'search_allowed_fields'):
             fieldlist = model.search_allowed_fields
         else:
             fieldlist = [f.name for f in model._meta.get_fields() if isinstance(f, CharField)]
-        q_map = map(lambda x: Q(**{x+'__icontains': st}),
-                fieldlist)
+        if search_config:
+            # Use the full-text index for the fields it covers
+            fieldlist = [x for x in fieldlist if x not in search_config.text_fields]
+        q_map = list(map(lambda x: Q(**{x+'__icontains': st}),
+                fieldlist))
+        if search_config:
+            q_map.append(search.filter_text_fields(queryset, st))
 
         search_objects.append(functools.reduce(operator.or_, q_map))
     search_object = functools.reduce(operator.and_, search_objects)
@@ -131,10 +138,11 @@ def params_to_queryset(model, queryset, filter_string, search_term, ordering_str
     if search_term:
         queryset = _get_search_results(search_term, queryset, model)
 
-    if ordering_string and queryset:
+    if ordering_string:
         column, order = ordering_string.split(':')
         if order.lower() == DESCENDING:
             column = '-' + column
+        queryset = queryset.order_by(column)
 
     # insure only distinct records (e.g. from multiple search hits) are returned
     return queryset.distinct()
@@ -0,0 +1,126 @@
+# layerindex-web - recipe export
+#
+# Iterates over recipe data for export without loading everything into
+# memory at once, so that the results can be streamed to the client.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+# Fields holding values from related records (exported as lists, or as
+# space-separated strings in CSV): related name, value field, ordering
+RELATED_FIELDS = {
+    'sources': ('source', 'url', 'id'),
+    'patches': ('patch', 'path', 'id'),
+    'depends': ('staticbuilddep', 'name', 'name'),
+    'extended_provides': ('extendedprovide', 'name', 'name'),
+    'inherited_classes': ('inheritedclass', 'name', 'name'),
+}
+
+# Fields that aren't on the recipe itself
+EXTRA_FIELDS = {
+    'layer': 'layerbranch__layer__name',
+    'branch': 'layerbranch__branch__name',
+}
+
+CHUNK_SIZE = 2000
+
+
+def get_export_fields():
+    from layerindex.models import Recipe
+    fields = [f.name for f in Recipe._meta.get_fields() if not (f.auto_created and f.is_relation)]
+    return fields + list(EXTRA_FIELDS.keys()) + list(RELATED_FIELDS.keys())
+
+
+def validate_fields(fieldlist):
+    """Returns the first invalid field name in fieldlist, or None"""
+    valid = get_export_fields()
+    for field in fieldlist:
+        if field not in valid:
+            return field
+    return None
+
+
+def _get_related(model_name, value_field, order_field, recipe_ids):
+    from layerindex.models import Recipe
+    values = {}
+    lookup = '%s__%s' % (model_name, value_field)
+    for recipe_id, value in Recipe.objects.filter(id__in=recipe_ids, **{'%s__isnull' % lookup: False}).order_by('%s__%s' % (model_name, order_field)).values_list('id', lookup):
+        values.setdefault(recipe_id, []).append(value)
+    return values
+
+
+def iter_recipes(queryset, fieldlist):
+    """
+    Yield a dict for each recipe in queryset with the specified fields,
+    fetching recipes and related values a chunk at a time
+    """
+    columns = []
+    for field in fieldlist:
+        if field in RELATED_FIELDS:
+            continue
+        elif field in EXTRA_FIELDS:
+            columns.append(EXTRA_FIELDS[field])
+        elif field == 'layerbranch':
+            # For compatibility this is shown as it was when we used
+            # str() on the LayerBranch object
+            columns.extend(['layerbranch__layer__name', 'layerbranch__branch__name'])
+        else:
+            columns.append(field)
+    related = [field for field in fieldlist if field in RELATED_FIELDS]
+
+    def make_row(values, related_values):
+        row = {}
+        data = dict(zip(['id'] + columns, values))
+        for field in fieldlist:
+            if field in RELATED_FIELDS:
+                row[field] = related_values[field].get(data['id'], [])
+            elif field in EXTRA_FIELDS:
+                row[field] = data[EXTRA_FIELDS[field]]
+            elif field == 'layerbranch':
+                row[field] = '%s: %s' % (data['layerbranch__layer__name'], data['layerbranch__branch__name'])
+            else:
+                row[field] = data[field]
+        return row
+
+    chunk = []
+    def flush():
+        related_values = {}
+        ids = [values[0] for values in chunk]
+        for field in related:
+            related_values[field] = _get_related(*RELATED_FIELDS[field], ids)
+        rows = [make_row(values, related_values) for values in chunk]
+        chunk.clear()
+        return rows
+
+    for values in queryset.values_list('id', *columns).iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(values)
+        if len(chunk) >= CHUNK_SIZE:
+            yield from flush()
+    if chunk:
+        yield from flush()
+
+
+class _Echo:
+    """File-like object that just returns what is written, for csv.writer"""
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, fieldlist, header=True):
+    writer = csv.writer(_Echo())
+    if header:
+        yield writer.writerow(fieldlist)
+    for row in rows:
+        yield writer.writerow([' '.join(row[field]) if field in RELATED_FIELDS else row[field] for field in fieldlist])
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
@@ -14,6 +14,12 @@ import utils
 import tempfile
 import re
 import fnmatch
+import hashlib
+from abc import ABC, abstractmethod
+
+# Bump this when changing what gets extracted from recipes, so that recipes
+# parsed by an older version aren't skipped as being unchanged
+RECIPE_INPUTS_VERSION = 1
 
 class RecipeParseError(Exception):
     def __init__(self, msg):
@@ -24,16 +30,10 @@ class RecipeParseError(Exception):
 
 
 
-def init_parser(settings, branch, bitbakepath, enable_tracking=False, nocheckout=False, classic=False, logger=None):
+def init_parser(settings, branch, bitbakepath, enable_tracking=False, nocheckout=False, classic=False, logger=None, shared_checkout=False):
     if not (nocheckout or classic):
         # Check out the branch of BitBake appropriate for this branch and clean out any stale files (e.g. *.pyc)
-        if re.match('[0-9a-f]{40}', branch.bitbake_branch):
-            # SHA1 hash
-            bitbake_ref = branch.bitbake_branch
-        else:
-            # Branch name
-            bitbake_ref = 'origin/%s' % branch.bitbake_branch
-        utils.checkout_repo(bitbakepath, bitbake_ref, logger=logger)
+        utils.checkout_repo(bitbakepath, utils.get_bitbake_ref(branch), logger=logger, shared=shared_checkout)
 
     # Commit "bitbake: Rename environment filtering variables"
     bb_var_rename_commit = "87104b6a167188921da157c7dba45938849fb22a"
@@ -63,7 +63,7 @@ def init_parser(settings, branch, bitbakepath, enable_tracking=False, nocheckout
         core_repodir = os.path.join(fetchdir, core_urldir)
         core_layerdir = os.path.join(core_repodir, core_subdir)
         if not nocheckout:
-            utils.checkout_repo(core_repodir, "origin/%s" % core_branchname, logger=logger)
+            utils.checkout_repo(core_repodir, "origin/%s" % core_branchname, logger=logger, shared=shared_checkout)
         if not os.path.exists(os.path.join(core_layerdir, 'conf/bitbake.conf')):
             raise RecipeParseError("conf/bitbake.conf not found in core layer %s - is subdirectory set correctly?" % core_layer.name)
         # The directory above where this script exists should contain our conf/layer.conf,
@@ -105,14 +105,9 @@ def init_parser(settings, branch, bitbakepath, enable_tracking=False, nocheckout
 
     return (tinfoil, tempdir)
 
-def setup_layer(config_data, fetchdir, layerdir, layer, layerbranch, logger):
-    # Parse layer.conf files for this layer and its dependencies
-    # This is necessary not just because BBPATH needs to be set in order
-    # for include/require/inherit to work outside of the current directory
-    # or across layers, but also because custom variable values might be
-    # set in layer.conf.
-    config_data_copy = bb.data.createCopy(config_data)
-    utils.parse_layer_conf(layerdir, config_data_copy)
+def get_dependency_layerdirs(fetchdir, layer, layerbranch, logger):
+    """Get the directories of the layers that a layer depends upon"""
+    deplayerdirs = []
     for dep in layerbranch.dependencies_set.all():
         depurldir = dep.dependency.get_fetch_dir()
         deprepodir = os.path.join(fetchdir, depurldir)
@@ -123,11 +118,187 @@ def setup_layer(config_data, fetchdir, layerdir, layer, layerbranch, logger):
             else:
                 logger.warning('Recommends %s of layer %s does not have branch record for branch %s - ignoring' % (dep.dependency.name, layer.name, layerbranch.branch.name))
                 continue
-        deplayerdir = os.path.join(deprepodir, deplayerbranch.vcs_subdir)
+        deplayerdirs.append(os.path.join(deprepodir, deplayerbranch.vcs_subdir))
+    return deplayerdirs
+
+def setup_layer_dirs(config_data, layerdir, deplayerdirs):
+    # Parse layer.conf files for this layer and its dependencies
+    # This is necessary not just because BBPATH needs to be set in order
+    # for include/require/inherit to work outside of the current directory
+    # or across layers, but also because custom variable values might be
+    # set in layer.conf.
+    config_data_copy = bb.data.createCopy(config_data)
+    utils.parse_layer_conf(layerdir, config_data_copy)
+    for deplayerdir in deplayerdirs:
         utils.parse_layer_conf(deplayerdir, config_data_copy)
     config_data_copy.delVar('LAYERDIR')
     return config_data_copy
 
+def setup_layer(config_data, fetchdir, layerdir, layer, layerbranch, logger):
+    deplayerdirs = get_dependency_layerdirs(fetchdir, layer, layerbranch, logger)
+    return setup_layer_dirs(config_data, layerdir, deplayerdirs)
+
+class RecipeParseStage(ABC):
+    """
+    Base class for additional processing hooked into the layer update (see
+    RECIPE_PARSE_STAGES in settings.py), allowing other applications to
+    collect what they need from each recipe while it is parsed instead of
+    having to parse it again later.
+
+    collect() is called with the recipe's datastore, possibly within a parse
+    worker process, and so must return only basic types. Its result is later
+    passed to store() along with the saved recipe, for a batch of recipes at
+    a time.
+    """
+    # Key under which the collected data is passed back; changing the set of
+    # stages also changes the recipe inputs hash so that recipes get parsed
+    # again and the new stage sees all of them
+    name = None
+
+    @abstractmethod
+    def collect(self, envdata):
+        """
+        Collect data from the recipe datastore envdata
+        """
+
+    @abstractmethod
+    def store(self, items):
+        """
+        Store the collected data; items is a list of (recipe, data) tuples
+        """
+
+    def discard(self, recipes):
+        """
+        Remove any data stored previously for the specified recipes, which
+        could not be parsed this time around (so it may be out of date)
+        """
+        pass
+
+def get_recipe_parse_stages():
+    """
+    Get instances of the stages configured in RECIPE_PARSE_STAGES
+    """
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+    return [import_string(path)() for path in getattr(settings, 'RECIPE_PARSE_STAGES', [])]
+
+def get_recipe_values(tinfoil, config_data, fn, layerdir_start, repodir, skip_patches=False, stages=None):
+    """
+    Parse a recipe and extract the values we store for it. The result only
+    contains basic types so that it can be passed between processes.
+    """
+    if hasattr(tinfoil, 'parse_recipe_file'):
+        envdata = tinfoil.parse_recipe_file(fn, appends=False, config_data=config_data)
+    else:
+        envdata = bb.cache.Cache.loadDataFull(fn, [], config_data)
+    envdata.setVar('SRCPV', 'X')
+    values = {}
+    values['pn'] = envdata.getVar("PN", True)
+    values['pv'] = envdata.getVar("PV", True)
+    values['pr'] = envdata.getVar("PR", True) or ""
+    values['pe'] = envdata.getVar("PE", True) or ""
+    values['srcrev'] = envdata.getVar('SRCREV', True) or ''
+    if values['srcrev'] == 'INVALID':
+        # INVALID is the default from bitbake.conf, but we don't want to see it
+        values['srcrev'] = ''
+    values['summary'] = envdata.getVar("SUMMARY", True)
+    values['description'] = envdata.getVar("DESCRIPTION", True)
+    values['section'] = envdata.getVar("SECTION", True)
+    values['license'] = envdata.getVar("LICENSE", True)
+    values['homepage'] = envdata.getVar("HOMEPAGE", True)
+    values['bugtracker'] = envdata.getVar("BUGTRACKER", True) or ""
+    values['provides'] = envdata.getVar("PROVIDES", True) or ""
+    values['bbclassextend'] = envdata.getVar("BBCLASSEXTEND", True) or ""
+    # Handle recipe inherits for this recipe
+    gr = set(config_data.getVar("__inherit_cache", True) or [])
+    lr = set(envdata.getVar("__inherit_cache", True) or [])
+    values['inherits'] = ' '.join(sorted({os.path.splitext(os.path.basename(r))[0] for r in lr if r not in gr}))
+    values['blacklisted'] = envdata.getVarFlag('PNBLACKLIST', values['pn'], True) or ""
+    for confvar in ['EXTRA_OEMESON', 'EXTRA_OECMAKE', 'EXTRA_OESCONS', 'EXTRA_OECONF']:
+        values['configopts'] = envdata.getVar(confvar, True) or ""
+        if values['configopts']:
+            break
+    else:
+        values['configopts'] = ''
+    values['src_uri'] = envdata.getVar('SRC_URI', True) or ''
+    values['depends'] = envdata.getVar('DEPENDS', True) or ''
+    values['packageconfig'] = dict(envdata.getVarFlags('PACKAGECONFIG') or {})
+
+    if skip_patches:
+        values['patches'] = None
+    else:
+        import oe.recipeutils
+        values['patches'] = list(oe.recipeutils.get_recipe_patches(envdata))
+
+    # Get file dependencies within this layer
+    filedeps = []
+    for depstr, date in envdata.getVar('__depends', True):
+        if depstr.startswith(layerdir_start) and not depstr.endswith('/conf/layer.conf'):
+            filedeps.append(os.path.relpath(depstr, repodir))
+    values['filedeps'] = filedeps
+
+    # All files in the fetch directory that went into parsing the recipe,
+    # so that we can tell later on if it needs to be parsed again
+    fetchdir = os.path.dirname(os.path.normpath(repodir)) + os.sep
+    inputs = [fn] + [depstr for depstr, date in envdata.getVar('__depends', True)] + (values['patches'] or [])
+    values['inputs'] = sorted(set([os.path.relpath(path, fetchdir) for path in inputs if path.startswith(fetchdir)]))
+
+    values['stages'] = {}
+    for stage in stages or []:
+        values['stages'][stage.name] = stage.collect(envdata)
+    return values
+
+
+class RecipeInputsHasher:
+    """
+    Computes a hash of the files a recipe was parsed from, along with the
+    layer setup it was parsed with, so that recipes whose inputs have not
+    changed can be skipped instead of being parsed again
+    """
+    def __init__(self, fetchdir, layerdirs, skip_patches, stages=None):
+        self.fetchdir = fetchdir
+        self.signature = '%d %s %s' % (RECIPE_INPUTS_VERSION, skip_patches, ' '.join([os.path.relpath(layerdir, fetchdir) for layerdir in layerdirs]))
+        # Each layer's conf/layer.conf is parsed before any recipe, but
+        # doesn't necessarily show up in a recipe's __depends
+        self.signature += ' %s' % ' '.join([utils.git_blob_hash(os.path.join(layerdir, 'conf', 'layer.conf')) for layerdir in layerdirs])
+        if stages:
+            self.signature += ' %s' % ' '.join([stage.name for stage in stages])
+        self.blob_hashes = {}
+
+    def get_hash(self, inputs):
+        shash = hashlib.sha256(self.signature.encode('utf-8'))
+        for path in inputs:
+            blob_hash = self.blob_hashes.get(path)
+            if blob_hash is None:
+                blob_hash = utils.git_blob_hash(os.path.join(self.fetchdir, path))
+                self.blob_hashes[path] = blob_hash
+            shash.update(('\0%s\0%s' % (path, blob_hash)).encode('utf-8'))
+        return shash.hexdigest()
+
+    def is_unchanged(self, recipe):
+        if not recipe.parse_inputs_hash:
+            return False
+        return self.get_hash(recipe.parse_inputs.splitlines()) == recipe.parse_inputs_hash
+
+
+class TinfoilRecipeParser:
+    """
+    Extracts recipe data in this process using an already initialised
+    tinfoil instance (see parseworker.ParseWorkerClient for the equivalent
+    that hands the work off to a persistent worker process)
+    """
+    def __init__(self, tinfoil, config_data, stages=None):
+        self.tinfoil = tinfoil
+        self.config_data = config_data
+        self.stages = stages
+
+    def get_recipe_values(self, fn, layerdir_start, repodir, skip_patches=False):
+        return get_recipe_values(self.tinfoil, self.config_data, fn, layerdir_start, repodir, skip_patches, self.stages)
+
+    def get_distro_name(self, path):
+        d = utils.parse_conf(path, self.config_data)
+        return d.getVar('DISTRO_NAME', True)
+
 machine_conf_re = re.compile(r'conf/machine/([^/.]*).conf$')
 distro_conf_re = re.compile(r'conf/distro/([^/.]*).conf$')
 bbclass_re = re.compile(r'classes(?P<subtype>-global|-recipe)?/(?P<name>[^/.]*).bbclass$')
@@ -165,69 +336,295 @@ def detect_file_type(path, subdir_start):
     return (None, None, None)
 
 
-def handle_recipe_depends(recipe, depends, packageconfig_opts, logger):
-    from layerindex.models import StaticBuildDep, PackageConfig, DynamicBuildDep
-
-    # Handle static build dependencies for this recipe
-    staticdeps = list(recipe.staticbuilddep_set.values_list('name', flat=True))
-    for dep in depends.split():
-        static_build_dependency, created = StaticBuildDep.objects.get_or_create(name=dep)
-        if created:
-            static_build_dependency.save()
-        static_build_dependency.recipes.add(recipe)
-        if dep in staticdeps:
-            staticdeps.remove(dep)
-    for dep in staticdeps:
-        StaticBuildDep.objects.get(name=dep).recipes.remove(recipe)
-
-    # Handle the PACKAGECONFIG variables for this recipe
-    dynamicdeps = list(recipe.dynamicbuilddep_set.values_list('name', flat=True))
-    PackageConfig.objects.filter(recipe=recipe).delete()
-    for key, value in packageconfig_opts.items():
-        if key == "doc":
-            continue
-        package_config = PackageConfig()
-        package_config.feature = key
-        package_config.recipe = recipe
-        package_config_vals = value.split(",")
-        try:
-            package_config.build_deps = package_config_vals[2]
-        except IndexError:
-            pass
-        try:
-            package_config.with_option = package_config_vals[0]
-        except IndexError:
-            pass
-        try:
-            package_config.without_option = package_config_vals[1]
-        except IndexError:
-            pass
-        package_config.save()
-        # Handle the dynamic dependencies for the PACKAGECONFIG variable
-        if package_config.build_deps:
-            for dep in package_config.build_deps.split():
-                dynamic_build_dependency, created = DynamicBuildDep.objects.get_or_create(name=dep)
-                if created:
-                    dynamic_build_dependency.save()
-                dynamic_build_dependency.package_configs.add(package_config)
-                dynamic_build_dependency.recipes.add(recipe)
-                if dep in dynamicdeps:
-                    dynamicdeps.remove(dep)
-    for dep in dynamicdeps:
-        DynamicBuildDep.objects.get(name=dep).recipes.remove(recipe)
-
-def handle_recipe_provides(recipe):
-    from layerindex.models import ExtendedProvide
-
-    recipe.extendedprovide_set.clear()
+def get_extended_provides(recipe):
     provides = recipe.provides.split()
     for extend in recipe.bbclassextend.split():
         if extend == 'native':
             provides.append('%s-native' % recipe.pn)
         elif extend == 'nativesdk':
             provides.append('nativesdk-%s' % recipe.pn)
-    for provide in provides:
-        provides, created = ExtendedProvide.objects.get_or_create(name=provide)
-        if created:
-            provides.save()
-        provides.recipes.add(recipe)
+    return provides
+
+
+class NameIdCache:
+    """
+    Cache mapping names to ids for one of the models that are little more
+    than a name linked to recipes (StaticBuildDep, DynamicBuildDep,
+    ExtendedProvide and InheritedClass). All existing names are loaded with
+    a single query on first use, and any names not yet in the database are
+    created in bulk.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.max_length = model._meta.get_field('name').max_length
+        self.ids = None
+
+    def _load(self, queryset):
+        for pk, name in queryset.order_by('id').values_list('id', 'name'):
+            self.ids.setdefault(name, pk)
+
+    def get_ids(self, names):
+        """
+        Return a dict mapping each of the specified names to an id
+        """
+        if self.ids is None:
+            self.ids = {}
+            self._load(self.model.objects.all())
+        # Names longer than the field would be truncated on save
+        keys = {name: name[:self.max_length] for name in names}
+        missing = sorted(set([key for key in keys.values() if key not in self.ids]))
+        if missing:
+            # Another update may be adding the same names concurrently (the
+            # names are unique, and inserting them in a consistent order
+            # avoids deadlocks between concurrent updates)
+            self.model.objects.bulk_create([self.model(name=name) for name in missing], ignore_conflicts=True)
+            self._load(self.model.objects.filter(name__in=missing))
+        return {name: self.ids[key] for name, key in keys.items()}
+
+
+class RecipeWriteBuffer:
+    """
+    Collects the records hanging off recipes being updated (sources, build
+    dependencies, PACKAGECONFIG options, provides, inherited classes, patches
+    and file dependencies) and writes them out for a batch of recipes at a time
+    using bulk queries, instead of one or more queries per record.
+
+    Recipes must have been saved before being added; call flush() before
+    deleting any recipes and once all recipes have been added.
+
+    Data collected by any recipe parse stages is handed to the stages to
+    store at the same time.
+    """
+    def __init__(self, logger, batch_size=1, stages=None):
+        self.logger = logger
+        self.batch_size = batch_size
+        self.stages = stages or []
+        self.pending = {}
+        # Rough count of queries the per-record approach would have needed
+        # vs. the number actually executed, for reporting purposes
+        self.row_queries = 0
+        self.queries = 0
+        self.name_caches = {}
+
+    def add(self, recipe, sources, depends, inherits, packageconfig_opts, patches, filedeps, stage_data=None):
+        """
+        Queue the child records for a recipe. patches should be a list of
+        unsaved Patch objects, or None to leave existing patches alone.
+        stage_data should be the data collected by the recipe parse stages,
+        by stage name.
+        """
+        self.pending[recipe.id] = {
+            'recipe': recipe,
+            'sources': sources,
+            'depends': depends.split(),
+            'packageconfig': packageconfig_opts,
+            'provides': get_extended_provides(recipe),
+            'inherits': inherits.split(),
+            'patches': patches,
+            'filedeps': filedeps,
+            'stages': stage_data or {},
+        }
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def discard(self, recipe):
+        """
+        Have the recipe parse stages discard their data for a (saved) recipe
+        that failed to parse
+        """
+        self.pending.pop(recipe.id, None)
+        for stage in self.stages:
+            stage.discard([recipe])
+
+    def flush(self):
+        from django.db import connection
+
+        if not self.pending:
+            return
+
+        def count_query(execute, sql, params, many, context):
+            self.queries += 1
+            return execute(sql, params, many, context)
+
+        pending = self.pending
+        self.pending = {}
+        with connection.execute_wrapper(count_query):
+            self._write(pending)
+
+    def sync_recipe_links(self, recipes):
+        """
+        Update just the links that can be derived from the recipe records
+        themselves (provides and inherited classes), for recipes whose other
+        child records are written some other way (e.g. by import_layers.py)
+        """
+        from layerindex.models import ExtendedProvide, InheritedClass
+
+        recipes = list(recipes)
+        for i in range(0, len(recipes), self.batch_size):
+            batch = recipes[i:i + self.batch_size]
+            self._sync_links(ExtendedProvide, 'recipes', {recipe.id: set(get_extended_provides(recipe)) for recipe in batch})
+            self._sync_links(InheritedClass, 'recipes', {recipe.id: set(recipe.inherits.split()) for recipe in batch})
+
+    @property
+    def queries_saved(self):
+        return max(self.row_queries - self.queries, 0)
+
+    def _bulk_create(self, model, objs):
+        from layerindex.models import truncate_charfield_values
+        if objs:
+            # bulk_create() doesn't send pre_save, so do the truncation here
+            for obj in objs:
+                truncate_charfield_values(model, obj)
+            model.objects.bulk_create(objs)
+
+    def _sync_rows(self, model, field, desired, **extra):
+        # Existing rows that match a desired value are left alone (so that any
+        # additional data on them is preserved); the rest are deleted
+        existing = {}
+        for pk, recipe_id, value in model.objects.filter(recipe_id__in=desired.keys()).values_list('id', 'recipe_id', field):
+            existing.setdefault(recipe_id, []).append((pk, value))
+        to_delete = []
+        to_create = []
+        for recipe_id, values in desired.items():
+            self.row_queries += 1
+            remaining = list(values)
+            for pk, value in existing.get(recipe_id, []):
+                if value in remaining:
+                    remaining.remove(value)
+                else:
+                    to_delete.append(pk)
+            for value in remaining:
+                kwargs = {field: value}
+                for key, valuefn in extra.items():
+                    kwargs[key] = valuefn(recipe_id)
+                to_create.append(model(recipe_id=recipe_id, **kwargs))
+        if to_delete:
+            model.objects.filter(id__in=to_delete).delete()
+        self._bulk_create(model, to_create)
+        self.row_queries += len(to_delete) + len(to_create)
+
+    def _sync_links(self, model, fieldname, desired):
+        # desired maps recipe id -> set of names that should be linked to
+        # the recipe via the specified many-to-many field
+        field = model._meta.get_field(fieldname)
+        through = field.remote_field.through
+        source_attr = '%s_id' % field.m2m_field_name()
+        recipe_attr = '%s_id' % field.m2m_reverse_field_name()
+
+        names = set()
+        for values in desired.values():
+            names.update(values)
+            self.row_queries += len(values)
+        if model not in self.name_caches:
+            self.name_caches[model] = NameIdCache(model)
+        name_ids = self.name_caches[model].get_ids(names)
+
+        existing = {}
+        for pk, recipe_id, source_id in through.objects.filter(**{'%s__in' % recipe_attr: desired.keys()}).values_list('id', recipe_attr, source_attr):
+            existing.setdefault(recipe_id, {})[source_id] = pk
+        to_delete = []
+        to_create = []
+        for recipe_id, values in desired.items():
+            self.row_queries += 1
+            wanted = set([name_ids[name] for name in values])
+            current = existing.get(recipe_id, {})
+            for source_id, pk in current.items():
+                if source_id not in wanted:
+                    to_delete.append(pk)
+            for source_id in wanted - set(current.keys()):
+                to_create.append(through(**{source_attr: source_id, recipe_attr: recipe_id}))
+        if to_delete:
+            through.objects.filter(id__in=to_delete).delete()
+        if to_create:
+            through.objects.bulk_create(to_create)
+        self.row_queries += len(to_delete) + len(to_create)
+        return name_ids
+
+    def _write(self, pending):
+        from layerindex.models import Source, Patch, PackageConfig, StaticBuildDep, DynamicBuildDep, ExtendedProvide, InheritedClass, RecipeFileDependency
+
+        recipes = {recipe_id: item['recipe'] for recipe_id, item in pending.items()}
+
+        # Sources
+        self._sync_rows(Source, 'url', {recipe_id: item['sources'] for recipe_id, item in pending.items()})
+
+        # Static build dependencies
+        self._sync_links(StaticBuildDep, 'recipes', {recipe_id: set(item['depends']) for recipe_id, item in pending.items()})
+
+        # PACKAGECONFIG options are always replaced (along with their links to
+        # dynamic build dependencies)
+        PackageConfig.objects.filter(recipe_id__in=pending.keys()).delete()
+        package_configs = []
+        dynamicdeps = {}
+        for recipe_id, item in pending.items():
+            dynamicdeps[recipe_id] = set()
+            for key, value in item['packageconfig'].items():
+                if key == "doc":
+                    continue
+                package_config = PackageConfig()
+                package_config.feature = key
+                package_config.recipe_id = recipe_id
+                package_config_vals = value.split(",")
+                try:
+                    package_config.build_deps = package_config_vals[2]
+                except IndexError:
+                    pass
+                try:
+                    package_config.with_option = package_config_vals[0]
+                except IndexError:
+                    pass
+                try:
+                    package_config.without_option = package_config_vals[1]
+                except IndexError:
+                    pass
+                package_configs.append(package_config)
+                dynamicdeps[recipe_id].update(package_config.build_deps.split())
+        self._bulk_create(PackageConfig, package_configs)
+        self.row_queries += len(package_configs) + 1
+        if any(pc.pk is None for pc in package_configs):
+            # The database backend can't tell us the ids of the rows just
+            # inserted, so look them up
+            pc_ids = {}
+            for pk, recipe_id, feature in PackageConfig.objects.filter(recipe_id__in=pending.keys()).values_list('id', 'recipe_id', 'feature'):
+                pc_ids[(recipe_id, feature)] = pk
+            for package_config in package_configs:
+                package_config.pk = pc_ids.get((package_config.recipe_id, package_config.feature))
+
+        # Dynamic build dependencies
+        dynamic_ids = self._sync_links(DynamicBuildDep, 'recipes', dynamicdeps)
+        pc_links = []
+        through = DynamicBuildDep.package_configs.through
+        for package_config in package_configs:
+            if package_config.pk is None:
+                continue
+            for dep in set(package_config.build_deps.split()):
+                pc_links.append(through(dynamicbuilddep_id=dynamic_ids[dep], packageconfig_id=package_config.pk))
+        if pc_links:
+            through.objects.bulk_create(pc_links)
+        self.row_queries += len(pc_links)
+
+        # Provides
+        self._sync_links(ExtendedProvide, 'recipes', {recipe_id: set(item['provides']) for recipe_id, item in pending.items()})
+
+        # Inherited classes
+        self._sync_links(InheritedClass, 'recipes', {recipe_id: set(item['inherits']) for recipe_id, item in pending.items()})
+
+        # Patches are always replaced, if we have them
+        patches = {recipe_id: item['patches'] for recipe_id, item in pending.items() if item['patches'] is not None}
+        if patches:
+            Patch.objects.filter(recipe_id__in=patches.keys()).delete()
+            patchrecs = []
+            for recipe_patches in patches.values():
+                patchrecs.extend(recipe_patches)
+            self._bulk_create(Patch, patchrecs)
+            self.row_queries += len(patches) + len(patchrecs)
+
+        # File dependencies within the layer
+        self._sync_rows(RecipeFileDependency, 'path', {recipe_id: item['filedeps'] for recipe_id, item in pending.items()},
+                        layerbranch_id=lambda recipe_id: recipes[recipe_id].layerbranch_id)
+
+        # Anything collected by the recipe parse stages
+        for stage in self.stages:
+            items = [(item['recipe'], item['stages'][stage.name]) for item in pending.values() if stage.name in item['stages']]
+            if items:
+                stage.store(items)
@@ -8,11 +8,56 @@
 
 from layerindex.models import Branch, LayerItem, LayerMaintainer, YPCompatibleVersion, LayerNote, LayerBranch, LayerDependency, Recipe, Machine, Distro, BBClass, Source, Patch, PackageConfig, StaticBuildDep, DynamicBuildDep, RecipeFileDependency, BBAppend, IncFile
 from rest_framework import viewsets, serializers, pagination
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from layerindex.querysethelper import params_to_queryset, get_search_tuple
+from layerindex.apicache import cached_response
+
+class LayerIndexCursorPagination(pagination.CursorPagination):
+    """
+    Pagination by id, which unlike page numbers doesn't need to count the
+    results or skip over all of the preceding records for each page. Start
+    by specifying an empty cursor (i.e. "?cursor=") and follow "next".
+    """
+    page_size = 200
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = 'id'
+
+    def decode_cursor(self, request):
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+        return super().decode_cursor(request)
+
+class OptionalCursorPagination(LayerIndexCursorPagination):
+    """
+    Cursor pagination only if requested, so that clients expecting the full
+    list of results aren't affected
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
 
 class LayerIndexPagination(pagination.PageNumberPagination):
+    """
+    Pagination by page number, or by cursor if requested (see
+    LayerIndexCursorPagination)
+    """
     page_size = 200
 
+    def paginate_queryset(self, queryset, request, view=None):
+        if LayerIndexCursorPagination.cursor_query_param in request.query_params:
+            self.cursor_pagination = LayerIndexCursorPagination()
+            return self.cursor_pagination.paginate_queryset(queryset, request, view)
+        self.cursor_pagination = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     """
     A ModelSerializer that takes an additional "fields" argument that
@@ -35,11 +80,49 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
                 self.fields.pop(field_name)
 
 class ParametricSearchableModelViewSet(viewsets.ReadOnlyModelViewSet):
+    pagination_class = OptionalCursorPagination
+    # Related objects to fetch up-front when the specified serializer
+    # fields are included in the output
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def get_requested_fields(self):
+        """Get the list of fields specified with "fields=", if any"""
+        fields = self.request.query_params.get('fields', '')
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(',') if field.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
     def get_queryset(self):
         model = self.__class__.serializer_class.Meta.model
         qs = self.queryset
         (filter_string, search_term, ordering_string) = get_search_tuple(self.request, model)
-        return params_to_queryset(model, qs, filter_string, search_term, ordering_string)
+        qs = params_to_queryset(model, qs, filter_string, search_term, ordering_string)
+        fields = self.get_requested_fields()
+        for field, lookups in self.select_related_fields.items():
+            if fields is None or field in fields:
+                qs = qs.select_related(*lookups)
+        for field, lookups in self.prefetch_related_fields.items():
+            if fields is None or field in fields:
+                qs = qs.prefetch_related(*lookups)
+        if fields is not None:
+            # Don't fetch columns we aren't going to output
+            qs = qs.only(*[f.name for f in model._meta.concrete_fields if f.primary_key or f.name in fields])
+        return qs
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 class BranchSerializer(DynamicFieldsModelSerializer):
     class Meta:
@@ -50,7 +133,29 @@ class BranchViewSet(ParametricSearchableModelViewSet):
     queryset = Branch.objects.all()
     serializer_class = BranchSerializer
 
-class LayerItemSerializer(serializers.ModelSerializer):
+    @action(detail=True, url_path='layerDependencies')
+    @cached_response
+    def layer_dependencies(self, request, pk=None):
+        """
+        Dependencies of all published layers on the branch, sorted such that
+        each layer comes after those it requires
+        """
+        branch = self.get_object()
+        graph = branch.get_layer_dependency_graph()
+        published = [node.layerbranch_id for node in graph.nodes.values() if node.status in ['P', 'X']]
+        data = []
+        for layerbranch_id in graph.topological_order(published):
+            node = graph.nodes[layerbranch_id]
+            data.append({
+                'layerbranch': node.layerbranch_id,
+                'layer': node.layer_id,
+                'name': node.name,
+                'dependencies': [edge.name for edge in graph.dependencies(layerbranch_id, required=True)],
+                'recommends': [edge.name for edge in graph.dependencies(layerbranch_id, required=False)],
+            })
+        return Response(data)
+
+class LayerItemSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = LayerItem
         fields = '__all__'
@@ -59,16 +164,43 @@ class LayerItemViewSet(ParametricSearchableModelViewSet):
     queryset = LayerItem.objects.filter(status__in=['P', 'X'])
     serializer_class = LayerItemSerializer
 
-class LayerBranchSerializer(serializers.ModelSerializer):
+class LayerBranchSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = LayerBranch
-        fields = '__all__'
+        exclude = ('layerconf_hash', 'layerconf_values')
 
 class LayerBranchViewSet(ParametricSearchableModelViewSet):
-    queryset = LayerBranch.objects.filter(layer__status__in=['P', 'X'])
+    queryset = LayerBranch.objects.filter(layer__status__in=['P', 'X']).defer('layerconf_hash', 'layerconf_values')
     serializer_class = LayerBranchSerializer
 
-class LayerDependencySerializer(serializers.ModelSerializer):
+    @action(detail=True)
+    @cached_response
+    def dependencies(self, request, pk=None):
+        """
+        Layer branches that this layer branch depends upon (recursively,
+        unless recursive=0 is specified). Specify recommends=1 to follow
+        recommends as well, and reverse=1 to get the layer branches that
+        depend upon this one instead.
+        """
+        layerbranch = self.get_object()
+        graph = layerbranch.branch.get_layer_dependency_graph()
+        required = request.GET.get('recommends', '') != '1'
+        recursive = request.GET.get('recursive', '') != '0'
+        if request.GET.get('reverse', '') == '1':
+            ids = graph.dependents(layerbranch.id, required, recursive)
+        elif recursive:
+            ids = graph.recursive_dependencies(layerbranch.id, required)
+        else:
+            ids = [edge.layerbranch_id for edge in graph.dependencies(layerbranch.id, True if required else None)
+                   if edge.layerbranch_id]
+        data = []
+        for layerbranch_id in ids:
+            node = graph.nodes[layerbranch_id]
+            if node.status in ['P', 'X']:
+                data.append({'layerbranch': node.layerbranch_id, 'layer': node.layer_id, 'name': node.name})
+        return Response(data)
+
+class LayerDependencySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = LayerDependency
         fields = '__all__'
@@ -86,7 +218,7 @@ class LayerMaintainerViewSet(ParametricSearchableModelViewSet):
     queryset = LayerMaintainer.objects.filter(layerbranch__layer__status__in=['P', 'X'])
     serializer_class = LayerMaintainerSerializer
 
-class LayerNoteSerializer(serializers.ModelSerializer):
+class LayerNoteSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = LayerNote
         fields = '__all__'
@@ -113,26 +245,26 @@ class PackageConfigSerializer(DynamicFieldsModelSerializer):
     builddeps = serializers.SerializerMethodField()
 
     def get_builddeps(self, package_config):
-        return package_config.dynamicbuilddep_set.values_list('name', flat=True)
+        return sorted([dep.name for dep in package_config.dynamicbuilddep_set.all()])
 
 class RecipeFileDependencySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = RecipeFileDependency
         fields = '__all__'
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('parse_inputs', 'parse_inputs_hash')
 
 class RecipeViewSet(ParametricSearchableModelViewSet):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('parse_inputs', 'parse_inputs_hash')
     serializer_class = RecipeSerializer
 
-class RecipeExtendedSerializer(serializers.ModelSerializer):
+class RecipeExtendedSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('parse_inputs', 'parse_inputs_hash')
 
     sources = serializers.SerializerMethodField()
     patches = serializers.SerializerMethodField()
@@ -156,7 +288,7 @@ class RecipeExtendedSerializer(serializers.ModelSerializer):
         return serializer.data
 
     def get_staticbuilddeps(self, recipe):
-        return recipe.staticbuilddep_set.values_list('name', flat=True)
+        return sorted([dep.name for dep in recipe.staticbuilddep_set.all()])
 
     def get_filedeps(self, recipe):
         qs = recipe.recipefiledependency_set.all()
@@ -164,11 +296,18 @@ class RecipeExtendedSerializer(serializers.ModelSerializer):
         return serializer.data
 
 class RecipeExtendedViewSet(ParametricSearchableModelViewSet):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('parse_inputs', 'parse_inputs_hash')
     serializer_class = RecipeExtendedSerializer
     pagination_class = LayerIndexPagination
-
-class MachineSerializer(serializers.ModelSerializer):
+    prefetch_related_fields = {
+        'sources': ['source_set'],
+        'patches': ['patch_set'],
+        'package_configs': ['packageconfig_set__dynamicbuilddep_set'],
+        'staticbuilddeps': ['staticbuilddep_set'],
+        'filedeps': ['recipefiledependency_set'],
+    }
+
+class MachineSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Machine
         fields = '__all__'
@@ -177,7 +316,7 @@ class MachineViewSet(ParametricSearchableModelViewSet):
     queryset = Machine.objects.all()
     serializer_class = MachineSerializer
 
-class DistroSerializer(serializers.ModelSerializer):
+class DistroSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Distro
         fields = '__all__'
@@ -186,7 +325,7 @@ class DistroViewSet(ParametricSearchableModelViewSet):
     queryset = Distro.objects.all()
     serializer_class = DistroSerializer
 
-class ClassSerializer(serializers.ModelSerializer):
+class ClassSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = BBClass
         fields = '__all__'
@@ -195,12 +334,12 @@ class ClassViewSet(ParametricSearchableModelViewSet):
     queryset = BBClass.objects.all()
     serializer_class = ClassSerializer
 
-class YPCompatibleVersionSerializer(serializers.ModelSerializer):
+class YPCompatibleVersionSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = YPCompatibleVersion
         fields = '__all__'
 
-class LayerSerializer(serializers.ModelSerializer):
+class LayerSerializer(DynamicFieldsModelSerializer):
     """
     A more fleshed-out LayerBranch serializer for external applications
     """
@@ -214,7 +353,7 @@ class LayerSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def get_maintainers(self, layerbranch):
-        qs = layerbranch.layermaintainer_set.filter(status='A')
+        qs = [maintainer for maintainer in layerbranch.layermaintainer_set.all() if maintainer.status == 'A']
         serializer = LayerMaintainerSerializer(instance=qs, many=True, read_only=True, fields=('name', 'email', 'responsibility'))
         return serializer.data
 
@@ -224,8 +363,16 @@ class LayerViewSet(ParametricSearchableModelViewSet):
     """
     queryset = LayerBranch.objects.filter(layer__status__in=['P', 'X'])
     serializer_class = LayerSerializer
-
-class AppendSerializer(serializers.ModelSerializer):
+    select_related_fields = {
+        'branch': ['branch'],
+        'layer': ['layer'],
+        'yp_compatible_version': ['yp_compatible_version'],
+    }
+    prefetch_related_fields = {
+        'maintainers': ['layermaintainer_set'],
+    }
+
+class AppendSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = BBAppend
         fields = '__all__'
@@ -234,7 +381,7 @@ class AppendViewSet(ParametricSearchableModelViewSet):
     queryset = BBAppend.objects.all()
     serializer_class = AppendSerializer
 
-class IncFileSerializer(serializers.ModelSerializer):
+class IncFileSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = IncFile
         fields = '__all__'
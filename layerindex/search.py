@@ -0,0 +1,303 @@
+# layerindex-web - full-text search
+#
+# Searching summaries and descriptions with icontains means scanning every
+# row, so instead we use a full-text index: the database's own where it has
+# one (PostgreSQL, MySQL/MariaDB), otherwise an inverted index held in the
+# SearchIndexEntry table which update_layer.py keeps up-to-date.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Q, F, BooleanField, FloatField, Lookup
+from django.db.models.expressions import Expression
+
+
+SearchConfig = namedtuple('SearchConfig', 'name_field text_fields')
+
+# Indexed models (by the model name of the concrete model, so subclasses
+# such as ClassicRecipe share their parent's index); the name field is
+# still matched as a substring since searching for part of a name is
+# common and names are short
+SEARCH_CONFIGS = {
+    'recipe': SearchConfig('pn', ['summary', 'description']),
+    'machine': SearchConfig('name', ['description']),
+    'distro': SearchConfig('name', ['description']),
+    'bbclass': SearchConfig('name', []),
+}
+
+# Relative weight of matches in the name and each of the text fields
+FIELD_WEIGHTS = [3, 2, 1]
+
+# Don't rank more full-text matches than this (all name matches are still
+# returned)
+MAX_TEXT_RESULTS = 1000
+
+
+def get_search_config(model):
+    for parent in [model] + model._meta.get_parent_list():
+        config = SEARCH_CONFIGS.get(parent._meta.model_name)
+        if config:
+            return parent._meta.model_name, config
+    return None, None
+
+def tokenize(text):
+    return re.findall(r'[^\W_]+', (text or '').lower())
+
+def get_query_keywords(querystr):
+    # Same splitting as utils.string_to_query()
+    return [item for item in re.split(r"\s|\"(.*)?\"|'.*?'", querystr) if item]
+
+
+class SearchBackend:
+    def update_layerbranch(self, layerbranch):
+        """Update the index for the content of a layer branch"""
+        pass
+
+    def condition(self, model, tokens):
+        """
+        Get a condition (usable within a Q object) matching objects of the
+        model that match all of the tokens
+        """
+        raise NotImplementedError
+
+    def filter(self, queryset, tokens):
+        """Filter the queryset to objects matching all of the tokens"""
+        return queryset.filter(self.condition(queryset.model, tokens))
+
+    def rank(self, queryset, tokens, limit):
+        """Return (id, score) for the best matches in the queryset"""
+        raise NotImplementedError
+
+
+class SearchSQL(Expression):
+    """
+    SQL built by a search backend around the columns of a model's indexed
+    fields. The columns are resolved by the query rather than written out,
+    so they carry whatever alias the table ends up with (e.g. U0 within a
+    subquery).
+    """
+    def __init__(self, fields, build_sql, output_field):
+        super().__init__(output_field=output_field)
+        self.columns = [F(field) for field in fields]
+        self.build_sql = build_sql
+
+    def get_source_expressions(self):
+        return self.columns
+
+    def set_source_expressions(self, exprs):
+        self.columns = exprs
+
+    def as_sql(self, compiler, connection):
+        return self.build_sql([compiler.compile(column)[0] for column in self.columns])
+
+
+class SearchMatch(Lookup):
+    """
+    Condition wrapping a SearchSQL expression. Being a lookup it goes into
+    the WHERE clause as-is, rather than compared against true (which on
+    MySQL would test the relevance returned by MATCH() for equality with 1)
+    """
+    lookup_name = 'search_match'
+    prepare_rhs = False
+
+    def __init__(self, expression):
+        super().__init__(expression, None)
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(self.lhs)
+
+
+class FullTextSearchBackend(SearchBackend):
+    """Common parts of the backends using the database's own full-text index"""
+    def match_sql(self, columns, tokens):
+        raise NotImplementedError
+
+    def rank_sql(self, columns, tokens):
+        raise NotImplementedError
+
+    def _expression(self, model, build_sql, output_field):
+        _, config = get_search_config(model)
+        return SearchSQL([config.name_field] + config.text_fields, build_sql, output_field)
+
+    def condition(self, model, tokens):
+        return SearchMatch(self._expression(model, lambda columns: self.match_sql(columns, tokens), BooleanField()))
+
+    def filter(self, queryset, tokens):
+        return queryset.filter(self.condition(queryset.model, tokens))
+
+    def rank(self, queryset, tokens, limit):
+        rank = self._expression(queryset.model, lambda columns: self.rank_sql(columns, tokens), FloatField())
+        qs = self.filter(queryset, tokens).annotate(search_rank=rank).order_by('-search_rank')
+        return list(qs.values_list('id', 'search_rank')[:limit])
+
+
+class PostgreSQLSearchBackend(FullTextSearchBackend):
+    """
+    Uses expression GIN indexes on to_tsvector() (see migration 0053, whose
+    index expressions the vector here must match)
+    """
+    @staticmethod
+    def vector(columns):
+        weighted = ["setweight(to_tsvector('simple', coalesce(%s, '')), '%s')" % (column, 'ABC'[i])
+                    for i, column in enumerate(columns)]
+        return ' || '.join(weighted)
+
+    @staticmethod
+    def tsquery(tokens):
+        return ' & '.join('%s:*' % token for token in tokens)
+
+    def match_sql(self, columns, tokens):
+        return "(%s) @@ to_tsquery('simple', %%s)" % self.vector(columns), [self.tsquery(tokens)]
+
+    def rank_sql(self, columns, tokens):
+        return "ts_rank(%s, to_tsquery('simple', %%s))" % self.vector(columns), [self.tsquery(tokens)]
+
+
+class MySQLSearchBackend(FullTextSearchBackend):
+    """Uses FULLTEXT indexes (see migration 0053)"""
+    def match_sql(self, columns, tokens):
+        against = ' '.join('+%s*' % token for token in tokens)
+        return 'MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % ', '.join(columns), [against]
+
+    def rank_sql(self, columns, tokens):
+        return self.match_sql(columns, tokens)
+
+
+def rebuild_index_entries(entry_model, models, layerbranch_id):
+    """Rebuild SearchIndexEntry records for a layer branch"""
+    entry_model.objects.filter(layerbranch_id=layerbranch_id).delete()
+    max_length = entry_model._meta.get_field('term').max_length
+    entries = []
+    for model in models:
+        model_name, config = get_search_config(model)
+        fields = [config.name_field] + config.text_fields
+        for row in model.objects.filter(layerbranch_id=layerbranch_id).values_list('id', *fields):
+            weights = {}
+            for value, weight in zip(row[1:], FIELD_WEIGHTS):
+                for token in tokenize(value):
+                    token = token[:max_length]
+                    weights[token] = max(weights.get(token, 0), weight)
+            for token, weight in weights.items():
+                entries.append(entry_model(layerbranch_id=layerbranch_id, model=model_name,
+                                           object_id=row[0], term=token, weight=weight))
+    entry_model.objects.bulk_create(entries, batch_size=1000)
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    Fallback for databases without full-text search support (i.e. SQLite),
+    matching tokens by prefix against the SearchIndexEntry table
+    """
+    @staticmethod
+    def prefix_lookup(token):
+        # Terms are all lowercase, so a range lookup (which can always use
+        # the index, unlike LIKE) does the job
+        return {'term__gte': token, 'term__lt': token + '\uffff'}
+
+    def update_layerbranch(self, layerbranch):
+        from layerindex.models import SearchIndexEntry, Recipe, Machine, Distro, BBClass
+        rebuild_index_entries(SearchIndexEntry, [Recipe, Machine, Distro, BBClass], layerbranch.id)
+
+    def _scores(self, queryset, tokens):
+        from layerindex.models import SearchIndexEntry
+        model_name, _ = get_search_config(queryset.model)
+        entries = SearchIndexEntry.objects.filter(model=model_name,
+                                                  layerbranch__in=queryset.values('layerbranch'))
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for object_id, weight in entries.filter(**self.prefix_lookup(token)).values_list('object_id', 'weight'):
+                token_scores[object_id] = max(token_scores.get(object_id, 0), weight)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {object_id: score + token_scores[object_id]
+                          for object_id, score in scores.items() if object_id in token_scores}
+            if not scores:
+                break
+        return scores or {}
+
+    def condition(self, model, tokens):
+        from layerindex.models import SearchIndexEntry
+        model_name, _ = get_search_config(model)
+        q = Q()
+        for token in tokens:
+            q &= Q(pk__in=SearchIndexEntry.objects.filter(model=model_name, **self.prefix_lookup(token)).values('object_id'))
+        return q
+
+    def rank(self, queryset, tokens, limit):
+        scores = self._scores(queryset, tokens)
+        ids = sorted(scores, key=lambda object_id: -scores[object_id])
+        # Discard any entries for objects outside of the queryset
+        results = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            found = set(queryset.filter(id__in=chunk).values_list('id', flat=True))
+            results.extend((object_id, scores[object_id]) for object_id in chunk if object_id in found)
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if connection.vendor == 'postgresql':
+            _backend = PostgreSQLSearchBackend()
+        elif connection.vendor == 'mysql':
+            _backend = MySQLSearchBackend()
+        else:
+            _backend = InvertedIndexSearchBackend()
+    return _backend
+
+
+def search(init_qs, query_string, order_by):
+    """
+    Do a ranked search of init_qs (which must be of an indexed model):
+    first objects whose name matches exactly, then those whose name contains
+    the keywords, then the rest of the full-text matches by relevance.
+    Returns a list of objects.
+    """
+    from layerindex import utils
+
+    _, config = get_search_config(init_qs.model)
+    results = list(init_qs.filter(**{config.name_field: query_string}).order_by(*order_by))
+    seen = set(obj.id for obj in results)
+
+    for obj in init_qs.filter(utils.string_to_query(query_string, [config.name_field])).order_by(*order_by):
+        if obj.id not in seen:
+            seen.add(obj.id)
+            results.append(obj)
+
+    tokens = []
+    for keyword in get_query_keywords(query_string):
+        tokens.extend(tokenize(keyword))
+    if tokens:
+        ranked = [(object_id, score) for object_id, score in get_backend().rank(init_qs, tokens, MAX_TEXT_RESULTS)
+                  if object_id not in seen]
+        objs = {}
+        ids = [object_id for object_id, _ in ranked]
+        for i in range(0, len(ids), 500):
+            for obj in init_qs.filter(id__in=ids[i:i+500]):
+                objs[obj.id] = obj
+        results.extend(objs[object_id] for object_id, _ in ranked if object_id in objs)
+    return results
+
+
+def filter_text_fields(queryset, term):
+    """
+    Get a Q object matching objects in queryset whose indexed text fields
+    contain the specified term, for use in place of icontains lookups on
+    those fields
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return Q(pk__in=[])
+    return Q(get_backend().condition(queryset.model, tokens))
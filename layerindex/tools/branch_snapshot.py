@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+
+# Export/import a snapshot of all layer data on a branch
+#
+# Mirroring another layer index instance with import_layers.py takes many
+# paged REST API requests and saves records one at a time. This instead
+# writes all of the data for a branch to a single compressed file (JSON
+# Lines, with records keyed on names/paths rather than database ids) which
+# can be loaded on the mirror using bulk queries. A snapshot can optionally
+# contain only the content of layers updated since a specific update, for
+# incremental mirroring.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+
+import sys
+import os
+import argparse
+import logging
+import gzip
+import json
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils
+
+class DryRunRollbackException(Exception):
+    pass
+
+class SnapshotError(Exception):
+    pass
+
+logger = utils.logger_create('LayerIndexSnapshot')
+
+
+SNAPSHOT_FORMAT = 1
+CHUNK_SIZE = 2000
+
+# Fields never written to the snapshot (as well as ids and foreign keys)
+EXCLUDE_FIELDS = ['updated', 'parse_inputs', 'parse_inputs_hash', 'preferred_count']
+
+
+def get_fields(model):
+    return [f for f in model._meta.concrete_fields
+            if not (f.primary_key or f.is_relation or f.name in EXCLUDE_FIELDS)]
+
+
+def get_content_models():
+    """
+    Models (other than Recipe) holding the content of a layer branch,
+    with the snapshot record type and the field(s) used as a key
+    """
+    from layerindex.models import Machine, Distro, BBClass, BBAppend, IncFile
+    return [
+        ('machine', Machine, ('name',)),
+        ('distro', Distro, ('name',)),
+        ('bbclass', BBClass, ('name',)),
+        ('bbappend', BBAppend, ('filename',)),
+        ('incfile', IncFile, ('path',)),
+    ]
+
+
+RECIPE_KEY = ('filepath', 'filename')
+
+
+### Export
+
+def export_recipes(layerbranch):
+    from layerindex.models import Recipe, Source, Patch, PackageConfig, RecipeFileDependency
+
+    fields = [f.name for f in get_fields(Recipe)]
+    patch_fields = [f.name for f in get_fields(Patch)]
+
+    def related(qs, *values):
+        result = {}
+        for row in qs.values_list('recipe_id', *values):
+            result.setdefault(row[0], []).append(row[1] if len(row) == 2 else list(row[1:]))
+        return result
+
+    def links(lookup, ids):
+        result = {}
+        for recipe_id, name in Recipe.objects.filter(id__in=ids, **{'%s__isnull' % lookup: False}).order_by(lookup).values_list('id', lookup):
+            result.setdefault(recipe_id, []).append(name)
+        return result
+
+    def write_chunk(chunk):
+        ids = [item['id'] for item in chunk]
+        sources = related(Source.objects.filter(recipe_id__in=ids).order_by('id'), 'url')
+        patches = {}
+        for values in Patch.objects.filter(recipe_id__in=ids).order_by('id').values('recipe_id', *patch_fields):
+            patches.setdefault(values.pop('recipe_id'), []).append(values)
+        package_configs = related(PackageConfig.objects.filter(recipe_id__in=ids).order_by('feature'), 'feature', 'with_option', 'without_option', 'build_deps')
+        depends = links('staticbuilddep__name', ids)
+        inherits = links('inheritedclass__name', ids)
+        filedeps = related(RecipeFileDependency.objects.filter(recipe_id__in=ids).order_by('path'), 'path')
+        for item in chunk:
+            recipe_id = item.pop('id')
+            item['type'] = 'recipe'
+            item['sources'] = sources.get(recipe_id, [])
+            item['patches'] = patches.get(recipe_id, [])
+            item['package_configs'] = package_configs.get(recipe_id, [])
+            item['depends'] = depends.get(recipe_id, [])
+            item['inherited_classes'] = inherits.get(recipe_id, [])
+            item['filedeps'] = filedeps.get(recipe_id, [])
+            yield item
+
+    chunk = []
+    for item in Recipe.objects.filter(layerbranch=layerbranch).order_by(*RECIPE_KEY).values('id', *fields).iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(item)
+        if len(chunk) >= CHUNK_SIZE:
+            yield from write_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from write_chunk(chunk)
+
+
+def export_snapshot(branch, since=None):
+    """
+    Yield the records making up a snapshot of the specified branch. If since
+    is specified (an Update id), only the content of layers that have been
+    updated since then is included.
+    """
+    from layerindex.models import LayerItem, LayerBranch, LayerDependency, LayerMaintainer, LayerNote, LayerUpdate, Update
+    from django.db.models import Max
+
+    if branch.comparison:
+        raise SnapshotError('Comparison branches are not supported')
+
+    layerbranches = list(LayerBranch.objects.filter(branch=branch).select_related('layer').order_by('layer__name'))
+    if since is None:
+        changed = set(lb.layer_id for lb in layerbranches)
+    else:
+        changed = set(LayerUpdate.objects.filter(branch=branch, update_id__gt=since).values_list('layer_id', flat=True))
+
+    yield {
+        'type': 'snapshot',
+        'format': SNAPSHOT_FORMAT,
+        'branch': branch.name,
+        'update': Update.objects.aggregate(Max('id'))['id__max'],
+        'since': since,
+        'layerbranches': [lb.layer.name for lb in layerbranches],
+    }
+
+    # Layers, including those only referred to as dependencies
+    deps = {}
+    for layerbranch_id, name, required in LayerDependency.objects.filter(layerbranch__branch=branch).order_by('dependency__name').values_list('layerbranch_id', 'dependency__name', 'required'):
+        deps.setdefault(layerbranch_id, []).append([name, required])
+    layer_fields = [f.name for f in get_fields(LayerItem)]
+    layer_names = set([lb.layer.name for lb in layerbranches])
+    for layerdeps in deps.values():
+        layer_names.update([name for name, _ in layerdeps])
+    for item in LayerItem.objects.filter(name__in=layer_names).order_by('name').values(*layer_fields):
+        item['type'] = 'layer'
+        yield item
+    for name, text in LayerNote.objects.filter(layer__name__in=layer_names).order_by('layer__name', 'id').values_list('layer__name', 'text'):
+        yield {'type': 'layernote', 'layer': name, 'text': text}
+
+    maintainer_fields = [f.name for f in get_fields(LayerMaintainer)]
+    maintainers = {}
+    for item in LayerMaintainer.objects.filter(layerbranch__branch=branch).order_by('id').values('layerbranch_id', *maintainer_fields):
+        maintainers.setdefault(item.pop('layerbranch_id'), []).append(item)
+    layerbranch_fields = [f.name for f in get_fields(LayerBranch)]
+    for layerbranch in layerbranches:
+        item = {field: getattr(layerbranch, field) for field in layerbranch_fields}
+        item['type'] = 'layerbranch'
+        item['layer'] = layerbranch.layer.name
+        item['dependencies'] = deps.get(layerbranch.id, [])
+        item['maintainers'] = maintainers.get(layerbranch.id, [])
+        yield item
+
+    # Layer content
+    for layerbranch in layerbranches:
+        if layerbranch.layer_id not in changed:
+            continue
+        yield {'type': 'content', 'layer': layerbranch.layer.name}
+        yield from export_recipes(layerbranch)
+        for recordtype, model, _ in get_content_models():
+            fields = [f.name for f in get_fields(model)]
+            for item in model.objects.filter(layerbranch=layerbranch).order_by('id').values(*fields):
+                item['type'] = recordtype
+                yield item
+        yield {'type': 'end', 'layer': layerbranch.layer.name}
+
+
+def write_snapshot(branch, outfile, since=None):
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    count = 0
+    with gzip.open(outfile, 'wt', encoding='utf-8') as f:
+        for item in export_snapshot(branch, since):
+            f.write(json.dumps(item, cls=DjangoJSONEncoder) + '\n')
+            count += 1
+    return count
+
+
+### Import
+
+def read_snapshot(infile):
+    with gzip.open(infile, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def set_fields(obj, fields, item):
+    """Set fields on obj from a snapshot record, returning True if anything changed"""
+    changed = False
+    for field in fields:
+        if field.name not in item:
+            continue
+        value = field.to_python(item[field.name])
+        if getattr(obj, field.attname) != value:
+            setattr(obj, field.attname, value)
+            changed = True
+    return changed
+
+
+def sync_objects(model, fields, keyfields, layerbranch, items):
+    """
+    Make the records of model for the specified layer branch match the
+    snapshot records in items, matching them up on keyfields. Returns a
+    list of saved objects (in the same order as items) and the number of
+    objects deleted.
+    """
+    from layerindex.models import truncate_charfield_values
+
+    existing = {}
+    for obj in model.objects.filter(layerbranch=layerbranch):
+        key = tuple(getattr(obj, field) for field in keyfields)
+        if key in existing:
+            # Shouldn't happen, but make sure we don't leave duplicates behind
+            obj.delete()
+        else:
+            existing[key] = obj
+
+    result = []
+    to_create = []
+    to_update = []
+    for item in items:
+        key = tuple(item[field] for field in keyfields)
+        obj = existing.pop(key, None)
+        if obj is None:
+            obj = model(layerbranch=layerbranch)
+            set_fields(obj, fields, item)
+            truncate_charfield_values(model, obj)
+            to_create.append(obj)
+        elif set_fields(obj, fields, item):
+            truncate_charfield_values(model, obj)
+            to_update.append(obj)
+        result.append(obj)
+
+    deleted = len(existing)
+    if existing:
+        model.objects.filter(id__in=[obj.id for obj in existing.values()]).delete()
+    if to_update:
+        model.objects.bulk_update(to_update, [field.attname for field in fields], batch_size=CHUNK_SIZE)
+    if to_create:
+        model.objects.bulk_create(to_create, batch_size=CHUNK_SIZE)
+        if any(obj.pk is None for obj in to_create):
+            # The database backend can't tell us the ids of the rows just
+            # inserted, so look them up
+            ids = {}
+            for values in model.objects.filter(layerbranch=layerbranch).values_list('id', *keyfields):
+                ids[tuple(values[1:])] = values[0]
+            for obj in to_create:
+                obj.pk = ids[tuple(getattr(obj, field) for field in keyfields)]
+    return result, len(to_create), len(to_update), deleted
+
+
+def import_recipes(layerbranch, items, writebuffer):
+    from layerindex.models import Recipe, Patch
+
+    fields = get_fields(Recipe)
+    recipes, created, updated, deleted = sync_objects(Recipe, fields, RECIPE_KEY, layerbranch, items)
+    patch_fields = get_fields(Patch)
+    for recipe, item in zip(recipes, items):
+        patches = []
+        for patchitem in item['patches']:
+            patch = Patch(recipe=recipe)
+            set_fields(patch, patch_fields, patchitem)
+            patches.append(patch)
+        packageconfig_opts = {}
+        for feature, with_option, without_option, build_deps in item['package_configs']:
+            packageconfig_opts[feature] = ','.join([with_option, without_option, build_deps])
+        writebuffer.add(recipe,
+                        item['sources'],
+                        ' '.join(item['depends']),
+                        ' '.join(item['inherited_classes']),
+                        packageconfig_opts,
+                        patches,
+                        item['filedeps'])
+    writebuffer.flush()
+    return created, updated, deleted
+
+
+def import_layers(branch, header, layers, notes, layerbranches):
+    from layerindex.models import LayerItem, LayerBranch, LayerDependency, LayerMaintainer, LayerNote
+
+    # Layers (saved individually, since there are relatively few of them and
+    # saving them may affect the cached dependency graph)
+    layer_fields = get_fields(LayerItem)
+    layer_map = {layer.name: layer for layer in LayerItem.objects.filter(name__in=[item['name'] for item in layers])}
+    for item in layers:
+        layer = layer_map.get(item['name'])
+        if layer is None:
+            layer = LayerItem()
+            logger.info('Adding layer %s' % item['name'])
+        if set_fields(layer, layer_fields, item) or layer.pk is None:
+            layer.save()
+        layer_map[layer.name] = layer
+
+    for layer in layer_map.values():
+        layernotes = [item['text'] for item in notes if item['layer'] == layer.name]
+        if list(layer.layernote_set.order_by('id').values_list('text', flat=True)) != layernotes:
+            layer.layernote_set.all().delete()
+            LayerNote.objects.bulk_create([LayerNote(layer=layer, text=text) for text in layernotes])
+
+    # Remove layer branches no longer on the branch
+    for layerbranch in LayerBranch.objects.filter(branch=branch).exclude(layer__name__in=header['layerbranches']).select_related('layer'):
+        logger.info('Deleting layer %s from branch %s' % (layerbranch.layer.name, branch.name))
+        layerbranch.delete()
+
+    layerbranch_fields = get_fields(LayerBranch)
+    maintainer_fields = get_fields(LayerMaintainer)
+    layerbranch_map = {lb.layer.name: lb for lb in LayerBranch.objects.filter(branch=branch).select_related('layer')}
+    for item in layerbranches:
+        layerbranch = layerbranch_map.get(item['layer'])
+        if layerbranch is None:
+            layerbranch = LayerBranch(layer=layer_map[item['layer']], branch=branch)
+        if set_fields(layerbranch, layerbranch_fields, item) or layerbranch.pk is None:
+            layerbranch.save()
+        layerbranch_map[item['layer']] = layerbranch
+
+        existing = {}
+        for dep in layerbranch.dependencies_set.select_related('dependency'):
+            existing[dep.dependency.name] = dep
+        for name, required in item['dependencies']:
+            dep = existing.pop(name, None)
+            if dep is None:
+                dep = LayerDependency(layerbranch=layerbranch, dependency=layer_map[name])
+            if dep.pk is None or dep.required != required:
+                dep.required = required
+                dep.save()
+        for dep in existing.values():
+            dep.delete()
+
+        maintainers = []
+        for maintaineritem in item['maintainers']:
+            maintainer = LayerMaintainer(layerbranch=layerbranch)
+            set_fields(maintainer, maintainer_fields, maintaineritem)
+            maintainers.append(maintainer)
+        current = [[getattr(m, f.attname) for f in maintainer_fields] for m in layerbranch.layermaintainer_set.order_by('id')]
+        if current != [[getattr(m, f.attname) for f in maintainer_fields] for m in maintainers]:
+            layerbranch.layermaintainer_set.all().delete()
+            LayerMaintainer.objects.bulk_create(maintainers)
+
+    return layerbranch_map
+
+
+def import_snapshot(records):
+    """
+    Import the records of a snapshot (as produced by export_snapshot()) into
+    the database. The branch must already exist.
+    """
+    from layerindex.models import Branch, Recipe
+    from layerindex import apicache, search
+    import recipeparse
+
+    header = next(records, None)
+    if not header or header.get('type') != 'snapshot':
+        raise SnapshotError('Not a branch snapshot')
+    if header['format'] != SNAPSHOT_FORMAT:
+        raise SnapshotError('Unsupported snapshot format %s' % header['format'])
+    branch = Branch.objects.filter(name=header['branch']).first()
+    if not branch:
+        raise SnapshotError('"%s" is not a valid branch in this database (branches must be created manually first)' % header['branch'])
+    if header['since'] is None:
+        logger.info('Importing snapshot of branch %s as of update %s' % (branch.name, header['update']))
+    else:
+        logger.info('Importing changes to branch %s between updates %s and %s' % (branch.name, header['since'], header['update']))
+
+    layers = []
+    notes = []
+    layerbranches = []
+    layerbranch_map = None
+    content = None
+    writebuffer = recipeparse.RecipeWriteBuffer(logger, CHUNK_SIZE)
+    backend = search.get_backend()
+    for item in records:
+        recordtype = item.pop('type')
+        if content is not None:
+            if recordtype == 'end':
+                layerbranch = layerbranch_map[item['layer']]
+                old_pns = set(layerbranch.recipe_set.values_list('pn', flat=True))
+                created, updated, deleted = import_recipes(layerbranch, content.pop('recipe'), writebuffer)
+                logger.info('%s: %d recipes added, %d updated, %d deleted' % (item['layer'], created, updated, deleted))
+                for recordtype, model, keyfields in get_content_models():
+                    sync_objects(model, get_fields(model), keyfields, layerbranch, content.pop(recordtype))
+                Recipe.update_preferred_counts(branch.id, old_pns | set(layerbranch.recipe_set.values_list('pn', flat=True)))
+                backend.update_layerbranch(layerbranch)
+                content = None
+            elif recordtype in content:
+                content[recordtype].append(item)
+            else:
+                raise SnapshotError('Unexpected %s record within layer content' % recordtype)
+        elif recordtype == 'layer':
+            layers.append(item)
+        elif recordtype == 'layernote':
+            notes.append(item)
+        elif recordtype == 'layerbranch':
+            layerbranches.append(item)
+        elif recordtype == 'content':
+            if layerbranch_map is None:
+                layerbranch_map = import_layers(branch, header, layers, notes, layerbranches)
+            if item['layer'] not in layerbranch_map:
+                raise SnapshotError('Content for unknown layer %s' % item['layer'])
+            content = {'recipe': []}
+            for recordtype, _, _ in get_content_models():
+                content[recordtype] = []
+        else:
+            raise SnapshotError('Unexpected %s record' % recordtype)
+    if content is not None:
+        raise SnapshotError('Snapshot is truncated')
+    if layerbranch_map is None:
+        import_layers(branch, header, layers, notes, layerbranches)
+    apicache.invalidate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Branch snapshot utility. Exports all layer data for a branch to a compressed file, or imports such a file (typically on a mirror). WARNING: importing will overwrite data in your database, use with caution!")
+    parser.add_argument('-d', '--debug', action='store_true', help='Enable debug output')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Hide all output except error messages')
+    subparsers = parser.add_subparsers(title='subcommands', metavar='<subcommand>')
+    subparsers.required = True
+
+    parser_export = subparsers.add_parser('export', help='Export a snapshot of a branch')
+    parser_export.add_argument('branch', help='Branch to export')
+    parser_export.add_argument('outfile', help='File to write the snapshot to')
+    parser_export.add_argument('-s', '--since', type=int, help='Only include the content of layers updated since the specified update (by id)')
+    parser_export.set_defaults(command='export')
+
+    parser_import = subparsers.add_parser('import', help='Import a snapshot')
+    parser_import.add_argument('infile', help='Snapshot file to import')
+    parser_import.add_argument('-n', '--dry-run', action='store_true', help="Don't write any data back to the database")
+    parser_import.set_defaults(command='import')
+
+    args = parser.parse_args()
+
+    if args.debug:
+        loglevel = logging.DEBUG
+    elif args.quiet:
+        loglevel = logging.WARNING
+    else:
+        loglevel = logging.INFO
+
+    utils.setup_django()
+    from layerindex.models import Branch
+    from django.db import transaction
+
+    logger.setLevel(loglevel)
+
+    try:
+        if args.command == 'export':
+            branch = Branch.objects.filter(name=args.branch).first()
+            if not branch:
+                logger.error('Specified branch %s is not valid' % args.branch)
+                sys.exit(1)
+            count = write_snapshot(branch, args.outfile, args.since)
+            logger.info('Wrote %d records to %s' % (count, args.outfile))
+        else:
+            try:
+                with transaction.atomic():
+                    import_snapshot(read_snapshot(args.infile))
+                    if args.dry_run:
+                        raise DryRunRollbackException()
+            except DryRunRollbackException:
+                pass
+    except SnapshotError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -97,6 +97,7 @@ def main():
     utils.setup_django()
     import settings
     from layerindex.models import LayerItem, LayerBranch, Recipe, ClassicRecipe, Machine, BBAppend, BBClass
+    from layerindex import search
     from django.db import transaction
 
     logger.setLevel(options.loglevel)
@@ -193,6 +194,8 @@ def main():
                         update_recipe_file(tinfoil, config_data_copy, root, recipe, layerdir_start, oeclassicpath)
                         recipe.save()
 
+            search.get_backend().update_layerbranch(layerbranch)
+
             layerbranch.vcs_last_fetch = datetime.now()
             layerbranch.save()
 
@@ -64,6 +64,8 @@ def main():
     import settings
     from layerindex.models import Branch, LayerItem, LayerBranch, LayerDependency, LayerMaintainer, LayerNote, Recipe, Source, Patch, PackageConfig, StaticBuildDep, DynamicBuildDep, RecipeFileDependency, Machine, Distro, BBClass, BBAppend, IncFile
     from django.db import transaction
+    from layerindex import search
+    import recipeparse
 
     logger.setLevel(loglevel)
 
@@ -196,7 +198,8 @@ def main():
                 if url:
                     if parent_orig_id is None:
                         raise Exception('import_child_items: if url is specified then parent_orig_id must also be specified')
-                    childjsdata = fetch_api_url(url + '?filter=%s:%s' % (parentfield, parent_orig_id))
+                    # Request cursor pagination (ignored by older servers)
+                    childjsdata = fetch_api_url(url + '?filter=%s:%s&cursor=' % (parentfield, parent_orig_id))
                 elif childlist is not None:
                     childjsdata = childlist
                 else:
@@ -345,14 +348,22 @@ def main():
                 layerbranch_idmap[layerbranchjs['id']] = layerbranch
 
                 if recipes_url:
+                    old_pns = set(layerbranch.recipe_set.values_list('pn', flat=True))
+                    # preferred_count depends on which layers are present
+                    # here, so it is calculated locally below
                     import_child_items(layerbranch,
                                        Recipe,
                                        url=recipes_url,
                                        parent_orig_id=layerbranchjs['id'],
-                                       exclude_fields=['id', 'layerbranch', 'updated'],
+                                       exclude_fields=['id', 'layerbranch', 'updated', 'preferred_count'],
                                        custom_fields=['sources', 'patches', 'package_configs'],
                                        custom_field_cb=recipe_field_handler,
                                        key_fields=['pn'])
+                    # The REST API only gives us the inherits / provides
+                    # values, so fill in the relations derived from them
+                    writebuffer = recipeparse.RecipeWriteBuffer(logger, 500)
+                    writebuffer.sync_recipe_links(layerbranch.recipe_set.all())
+                    Recipe.update_preferred_counts(branch.id, old_pns | set(layerbranch.recipe_set.values_list('pn', flat=True)))
 
                 if machines_url:
                     import_child_items(layerbranch,
@@ -397,6 +408,8 @@ def main():
                                        exclude_fields=['id', 'layerbranch', 'updated'],
                                        key_fields=['path'])
 
+                search.get_backend().update_layerbranch(layerbranch)
+
             for idv in existing_layerbranches:
                 layerbranch = LayerBranch.objects.get(id=idv)
                 if layer_re is None or layer_re.match(layerbranch.layer.name):
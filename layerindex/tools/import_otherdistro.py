@@ -535,6 +535,7 @@ def import_pkgspec(args):
     utils.setup_django()
     import settings
     from layerindex.models import LayerItem, LayerBranch, Recipe, ClassicRecipe, Machine, BBAppend, BBClass, ComparisonRecipeUpdate
+    from layerindex import search
     from django.db import transaction
 
     ret, layerbranch = check_branch_layer(args)
@@ -578,6 +579,8 @@ def import_pkgspec(args):
                 layer.summary = args.description
                 layer.save()
 
+            search.get_backend().update_layerbranch(layerbranch)
+
             layerbranch.vcs_last_fetch = datetime.now()
             layerbranch.save()
 
@@ -644,6 +647,7 @@ def import_deblist(args):
     utils.setup_django()
     import settings
     from layerindex.models import LayerItem, LayerBranch, Recipe, ClassicRecipe, Machine, BBAppend, BBClass
+    from layerindex import search
     from django.db import transaction
 
     ret, layerbranch = check_branch_layer(args)
@@ -719,6 +723,8 @@ def import_deblist(args):
                     logger.info('Marking as deleted: %s' % ', '.join(existing))
                     layerrecipes.filter(pn__in=existing).update(deleted=True)
 
+                search.get_backend().update_layerbranch(layerbranch)
+
                 layerbranch.vcs_last_fetch = datetime.now()
                 layerbranch.save()
 
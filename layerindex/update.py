@@ -16,12 +16,16 @@ import optparse
 import codecs
 import logging
 import subprocess
+import tempfile
 from datetime import datetime, timedelta
 from packaging_legacy.version import parse as parse_version
 import utils
+import parseworker
 import operator
 import re
+import signal
 import multiprocessing
+import concurrent.futures
 
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -36,7 +40,7 @@ except ImportError:
     sys.exit(1)
 
 
-def prepare_update_layer_command(options, branch, layer, initial=False):
+def prepare_update_layer_command(options, branch, layer, initial=False, parse_worker=None, shared_checkout=False):
     """Prepare the update_layer.py command line"""
     if branch.update_environment:
         cmdprefix = branch.update_environment.get_command()
@@ -51,6 +55,8 @@ def prepare_update_layer_command(options, branch, layer, initial=False):
         cmd += ' --fullreload'
     if options.nocheckout:
         cmd += ' --nocheckout'
+    elif shared_checkout:
+        cmd += ' --shared-checkout'
     if options.dryrun:
         cmd += ' -n'
     if initial:
@@ -63,6 +69,8 @@ def prepare_update_layer_command(options, branch, layer, initial=False):
         cmd += ' --keep-temp'
     if options.stop_on_error:
         cmd += ' --stop-on-error'
+    if parse_worker:
+        cmd += ' --parse-worker=%s' % parse_worker.sockpath
     return cmd
 
 def update_actual_branch(layerquery, fetchdir, branch, options, update_bitbake, bitbakepath):
@@ -134,6 +142,123 @@ def extract_value(valuename, output):
     else:
         return ''
 
+def get_layer_checkouts(layer, branchobj, fetchdir, options):
+    """
+    Get the repository revisions that update_layer.py will check out when
+    updating the specified layer (excluding bitbake and OE-Core, which are
+    the same for all layers on a branch) as a dict of repodir: ref
+    """
+    from layerindex.models import LayerBranch
+
+    checkouts = {}
+    layerbranch = layer.get_layerbranch(branchobj.name)
+    if options.actual_branch:
+        branchname = options.actual_branch
+    elif layerbranch:
+        branchname = layerbranch.get_checkout_branch()
+    else:
+        branchname = branchobj.name
+    checkouts[os.path.join(fetchdir, layer.get_fetch_dir())] = 'origin/%s' % branchname
+    if layerbranch:
+        graph = branchobj.get_layer_dependency_graph()
+        dep_ids = [edge.layerbranch_id for edge in graph.dependencies(layerbranch.id)
+                   if edge.layerbranch_id and edge.name != 'openembedded-core']
+        dep_layerbranches = LayerBranch.objects.select_related('layer', 'branch').in_bulk(dep_ids)
+        for dep_layerbranch in [dep_layerbranches[dep_id] for dep_id in dep_ids if dep_id in dep_layerbranches]:
+            dep_repodir = os.path.join(fetchdir, dep_layerbranch.layer.get_fetch_dir())
+            checkouts.setdefault(dep_repodir, 'origin/%s' % dep_layerbranch.get_checkout_branch())
+    return checkouts
+
+
+class LayerUpdateScheduler:
+    """
+    Runs update_layer.py for a set of layers, with up to the specified
+    number of jobs in parallel. A layer is started as soon as all of the
+    layers it depends upon (within the set being updated) have finished,
+    and two layers that need the same repository checked out at different
+    revisions are never run at the same time.
+    """
+    def __init__(self, layers, layer_deps, checkouts, jobs):
+        # layers must already be sorted such that dependencies come first
+        self.layers = layers
+        self.layer_deps = layer_deps
+        self.checkouts = checkouts
+        self.jobs = max(jobs, 1)
+
+    def _can_start(self, layer, finished, running):
+        if not self.layer_deps.get(layer, set()).issubset(finished):
+            return False
+        checkouts = self.checkouts.get(layer, {})
+        for other in running:
+            for repodir, ref in self.checkouts.get(other, {}).items():
+                if checkouts.get(repodir, ref) != ref:
+                    return False
+        return True
+
+    def run(self, start_fn, finish_fn):
+        """
+        Run the update. start_fn(layer) is called just before a layer is
+        dispatched and should return the command to run, or None to skip
+        the layer; finish_fn(layer, retcode, output) is called on completion
+        and should return False to stop dispatching further layers. Both are
+        always called from the calling thread.
+        """
+        if self.jobs == 1:
+            for layer in self.layers:
+                cmd = start_fn(layer)
+                if cmd is None:
+                    continue
+                logger.debug('Running layer update command: %s' % cmd)
+                ret, output = utils.run_command_interruptible(cmd)
+                if not finish_fn(layer, ret, output):
+                    break
+            return
+
+        pending = list(self.layers)
+        finished = set()
+        running = {}
+        stop = False
+
+        # Let Ctrl+C be handled by the child processes (the handler is reset
+        # to the default in each child upon exec) rather than killing us
+        # while they are still running
+        def sigint_handler(signum, frame):
+            logger.info('Interrupt received, waiting for running layer updates to finish')
+        old_handler = signal.signal(signal.SIGINT, sigint_handler)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                while True:
+                    if not stop:
+                        for layer in pending[:]:
+                            if len(running) >= self.jobs:
+                                break
+                            if not self._can_start(layer, finished, running.values()):
+                                continue
+                            pending.remove(layer)
+                            cmd = start_fn(layer)
+                            if cmd is None:
+                                finished.add(layer)
+                                continue
+                            logger.debug('Running layer update command: %s' % cmd)
+                            running[executor.submit(utils.run_command_buffered, cmd)] = layer
+                    if not running:
+                        if stop or not pending:
+                            break
+                        # Skipped layers may have satisfied the dependencies of others
+                        continue
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        layer = running.pop(future)
+                        ret, output = future.result()
+                        sys.stdout.write(output)
+                        sys.stdout.flush()
+                        finished.add(layer)
+                        if not finish_fn(layer, ret, output):
+                            stop = True
+        finally:
+            signal.signal(signal.SIGINT, old_handler)
+
+
 def main():
     if parse_version(git.__version__) < parse_version('0.3.1'):
         logger.error("Version of GitPython is too old, please install GitPython (python-git) 0.3.1 or later in order to use this script")
@@ -186,6 +311,12 @@ def main():
     parser.add_option("", "--keep-temp",
             help = "Preserve temporary directory at the end instead of deleting it",
             action="store_true")
+    parser.add_option("-j", "--jobs",
+            help = "Number of layers to update in parallel (default is PARALLEL_JOBS from settings.py)",
+            type="int", action="store", dest="jobs")
+    parser.add_option("-w", "--parse-workers",
+            help = "Parse recipes using persistent worker processes rather than starting bitbake for every layer",
+            action="store_true", dest="parse_workers")
 
     options, args = parser.parse_args(sys.argv)
     if len(args) > 1:
@@ -348,7 +479,19 @@ def main():
                 deps_dict_all = {}
                 layerquery_sorted = []
                 collections = set()
+                layer_collections = {}
+                layer_requires = {}
                 branchobj = utils.get_branch(branch)
+                if not options.nocheckout:
+                    # Ensure the core layer is at the right revision, since its
+                    # layer.conf forms part of the cached layer.conf value hash
+                    core_layer = utils.get_layer(settings.CORE_LAYER_NAME)
+                    core_layerbranch = core_layer.get_layerbranch(branch) if core_layer else None
+                    if core_layerbranch:
+                        core_repodir = os.path.join(fetchdir, core_layer.get_fetch_dir())
+                        if os.path.exists(core_repodir):
+                            utils.checkout_layer_branch(core_layerbranch, core_repodir, logger=logger)
+                core_layerdir = utils.get_core_layerdir(settings, branch)
                 for layer in layerquery_all:
                     # Get all collections from database, but we can't trust the
                     # one which will be updated since its collections maybe
@@ -448,10 +591,18 @@ def main():
                             logger.error("conf/layer.conf not found for layer %s (branch %s) - is subdirectory set correctly?" % (layer.name, branch))
                             continue
 
-                    cmd = prepare_update_layer_command(options, branchobj, layer, initial=True)
-                    logger.debug('Running layer update command: %s' % cmd)
-                    ret, output = utils.run_command_interruptible(cmd)
-                    logger.debug('output: %s' % output)
+                    layerdir = os.path.join(repodir, layerbranch.vcs_subdir)
+                    if (not newbranch and not options.fullreload and layerbranch.layerconf_values
+                            and layerbranch.layerconf_hash == utils.get_layerconf_hash(layerdir, core_layerdir)):
+                        # layer.conf hasn't changed since the last update, so
+                        # there's no need to spin up bitbake to read it
+                        logger.debug('Using cached layer.conf values for layer %s' % layer.name)
+                        ret, output = 0, layerbranch.layerconf_values
+                    else:
+                        cmd = prepare_update_layer_command(options, branchobj, layer, initial=True)
+                        logger.debug('Running layer update command: %s' % cmd)
+                        ret, output = utils.run_command_interruptible(cmd)
+                        logger.debug('output: %s' % output)
                     if ret == 254:
                         # Interrupted by user, break out of loop
                         logger.info('Update interrupted, exiting')
@@ -487,6 +638,8 @@ def main():
 
                     deps_dict = utils.explode_dep_versions2(bitbakepath, deps)
                     recs_dict = utils.explode_dep_versions2(bitbakepath, recs)
+                    layer_collections[layer] = col
+                    layer_requires[layer] = set(deps_dict) | set(recs_dict)
                     if not (deps_dict or recs_dict):
                         # No depends, add it firstly
                         layerquery_sorted.append(layer)
@@ -549,7 +702,48 @@ def main():
                         logger.warning("Known collections on branch %s: %s" % (branch, collections))
                         break
 
-                for layer in layerquery_sorted:
+                # Work out which of the layers being updated each layer needs
+                # to wait for (anything it depends on or recommends which
+                # was sorted ahead of it)
+                layer_deps = {}
+                for i, layer in enumerate(layerquery_sorted):
+                    requires = layer_requires.get(layer, set())
+                    layer_deps[layer] = set(dep for dep in layerquery_sorted[:i] if layer_collections.get(dep) in requires)
+
+                jobs = options.jobs or int(settings.PARALLEL_JOBS)
+                layer_checkouts = {}
+                # With more than one job the repositories are shared between
+                # concurrent update_layer.py processes, so check everything
+                # out (and clean it) up-front so that they find their revisions
+                # already in place and can leave the working trees alone
+                # (the core layer has already been checked out above)
+                shared_checkout = jobs > 1 and not options.nocheckout
+                if shared_checkout:
+                    utils.checkout_repo(bitbakepath, utils.get_bitbake_ref(branchobj), logger=logger)
+                    checked_out = set()
+                    for layer in layerquery_sorted:
+                        layer_checkouts[layer] = get_layer_checkouts(layer, branchobj, fetchdir, options)
+                        for repodir, ref in layer_checkouts[layer].items():
+                            if repodir not in checked_out and os.path.exists(repodir):
+                                utils.checkout_repo(repodir, ref, logger=logger)
+                                checked_out.add(repodir)
+
+                layerupdates = {}
+                exitcode = None
+
+                parse_workers = []
+                layer_workers = {}
+                if options.parse_workers and layerquery_sorted:
+                    if not os.path.exists(settings.TEMP_BASE_DIR):
+                        os.makedirs(settings.TEMP_BASE_DIR)
+                    workerdir = tempfile.mkdtemp(dir=settings.TEMP_BASE_DIR)
+                    max_worker_jobs = getattr(settings, 'PARSE_WORKER_MAX_JOBS', 20)
+                    for i in range(max(jobs, 1)):
+                        sockpath = os.path.join(workerdir, 'parseworker%d.sock' % i)
+                        parse_workers.append(parseworker.ParseWorker(branchobj, sockpath, max_worker_jobs, options.nocheckout, options.loglevel, shared_checkout=shared_checkout))
+                free_workers = list(parse_workers)
+
+                def start_layer_update(layer):
                     layerupdate = LayerUpdate()
                     layerupdate.update = update
                     layerupdate.layer = layer
@@ -566,14 +760,26 @@ def main():
                         layerupdate.log = 'ERROR: fetch failed: %s' % errmsg
                         if not options.dryrun:
                             layerupdate.save()
-                        continue
+                        return None
 
                     layerupdate.started = datetime.now()
                     if not options.dryrun:
                         layerupdate.save()
-                    cmd = prepare_update_layer_command(options, branchobj, layer)
-                    logger.debug('Running layer update command: %s' % cmd)
-                    ret, output = utils.run_command_interruptible(cmd)
+                    layerupdates[layer] = layerupdate
+                    worker = None
+                    if free_workers:
+                        # The scheduler never runs more layers at once than we
+                        # have workers, so there's always one free here
+                        worker = free_workers.pop()
+                        worker.ensure_running()
+                        layer_workers[layer] = worker
+                    return prepare_update_layer_command(options, branchobj, layer, parse_worker=worker, shared_checkout=shared_checkout)
+
+                def finish_layer_update(layer, ret, output):
+                    nonlocal exitcode
+                    if layer in layer_workers:
+                        free_workers.append(layer_workers.pop(layer))
+                    layerupdate = layerupdates.pop(layer)
                     layerupdate.finished = datetime.now()
 
                     # We need to get layerbranch here because it might not have existed until
@@ -588,12 +794,28 @@ def main():
                         layerupdate.save()
 
                     if ret == 254:
-                        # Interrupted by user, break out of loop
-                        logger.info('Update interrupted, exiting')
-                        sys.exit(254)
+                        # Interrupted by user, stop starting new layers
+                        exitcode = 254
+                        return False
                     if options.stop_on_error and ret != 0:
                         logger.info('Layer update failed with --stop-on-error, stopping')
-                        sys.exit(1)
+                        exitcode = 1
+                        return False
+                    return True
+
+                scheduler = LayerUpdateScheduler(layerquery_sorted, layer_deps, layer_checkouts, jobs)
+                try:
+                    scheduler.run(start_layer_update, finish_layer_update)
+                finally:
+                    for worker in parse_workers:
+                        worker.stop()
+                    if parse_workers:
+                        utils.rmtree_force(workerdir)
+                if exitcode == 254:
+                    logger.info('Update interrupted, exiting')
+                    sys.exit(254)
+                elif exitcode:
+                    sys.exit(exitcode)
             if failed_layers:
                 for branch, err_msg_list in failed_layers.items():
                     if err_msg_list:
@@ -617,6 +839,10 @@ def main():
             update.save()
 
     if not options.dryrun:
+        # Make sure the REST API doesn't serve stale cached responses
+        from layerindex import apicache
+        apicache.invalidate()
+
         # Purge old update records
         update_purge_days = getattr(settings, 'UPDATE_PURGE_DAYS', 30)
         Update.objects.filter(started__lte=datetime.now()-timedelta(days=update_purge_days)).delete()
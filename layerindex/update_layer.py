@@ -24,6 +24,7 @@ import itertools
 import utils
 import recipeparse
 import layerconfparse
+import parseworker
 
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -38,6 +39,10 @@ except ImportError:
     sys.exit(1)
 
 
+# Number of recipes to accumulate before writing out their associated records
+RECIPE_WRITE_BATCH_SIZE = 50
+
+
 class DryRunRollbackException(Exception):
     pass
 
@@ -59,7 +64,6 @@ def split_recipe_fn(path):
     return (pn, pv)
 
 def collect_patch(recipe, patchfn, index, layerdir_start, stop_on_error):
-    from django.db import DatabaseError
     from layerindex.models import Patch
 
     patchrec = Patch()
@@ -69,125 +73,72 @@ def collect_patch(recipe, patchfn, index, layerdir_start, stop_on_error):
     patchrec.apply_order = index
     try:
         patchrec.read_status_from_file(patchfn, logger)
-        patchrec.save()
-    except DatabaseError:
-        raise
     except Exception as e:
         if stop_on_error:
             raise
         else:
             logger.error("Unable to read patch %s: %s", patchfn, str(e))
-            patchrec.save()
+    return patchrec
 
-def collect_patches(recipe, envdata, layerdir_start, stop_on_error):
-    from layerindex.models import Patch
-
-    try:
-        import oe.recipeutils
-    except ImportError:
-        logger.warn('Failed to find lib/oe/recipeutils.py in layers - patches will not be imported')
-        return
+def collect_patches(recipe, patches, layerdir_start, stop_on_error):
+    if patches is None:
+        # lib/oe/recipeutils.py wasn't available (we've already warned about this)
+        return None
 
-    Patch.objects.filter(recipe=recipe).delete()
-    patches = oe.recipeutils.get_recipe_patches(envdata)
+    patchrecs = []
     for i, patch in enumerate(patches):
         if not patch.startswith(layerdir_start):
             # Likely a remote patch, skip it
             continue
-        collect_patch(recipe, patch, i, layerdir_start, stop_on_error)
+        patchrecs.append(collect_patch(recipe, patch, i, layerdir_start, stop_on_error))
+    return patchrecs
 
-def update_recipe_file(tinfoil, data, path, recipe, layerdir_start, repodir, stop_on_error, skip_patches=False):
+def update_recipe_file(parser, path, recipe, layerdir_start, repodir, stop_on_error, writebuffer, inputhasher, skip_patches=False):
     from django.db import DatabaseError
 
     fn = str(os.path.join(path, recipe.filename))
-    from layerindex.models import PackageConfig, StaticBuildDep, DynamicBuildDep, Source, Patch
     try:
         logger.debug('Updating recipe %s' % fn)
-        if hasattr(tinfoil, 'parse_recipe_file'):
-            envdata = tinfoil.parse_recipe_file(fn, appends=False, config_data=data)
-        else:
-            envdata = bb.cache.Cache.loadDataFull(fn, [], data)
-        envdata.setVar('SRCPV', 'X')
-        recipe.pn = envdata.getVar("PN", True)
-        recipe.pv = envdata.getVar("PV", True)
-        recipe.pr = envdata.getVar("PR", True) or ""
-        recipe.pe = envdata.getVar("PE", True) or ""
-        recipe.srcrev = envdata.getVar('SRCREV', True) or ''
-        if recipe.srcrev == 'INVALID':
-            # INVALID is the default from bitbake.conf, but we don't want to see it
-            recipe.srcrev = ''
-        recipe.summary = envdata.getVar("SUMMARY", True)
-        recipe.description = envdata.getVar("DESCRIPTION", True)
-        recipe.section = envdata.getVar("SECTION", True)
-        recipe.license = envdata.getVar("LICENSE", True)
-        recipe.homepage = envdata.getVar("HOMEPAGE", True)
-        recipe.bugtracker = envdata.getVar("BUGTRACKER", True) or ""
-        recipe.provides = envdata.getVar("PROVIDES", True) or ""
-        recipe.bbclassextend = envdata.getVar("BBCLASSEXTEND", True) or ""
-        # Handle recipe inherits for this recipe
-        gr = set(data.getVar("__inherit_cache", True) or [])
-        lr = set(envdata.getVar("__inherit_cache", True) or [])
-        recipe.inherits = ' '.join(sorted({os.path.splitext(os.path.basename(r))[0] for r in lr if r not in gr}))
-        recipe.blacklisted = envdata.getVarFlag('PNBLACKLIST', recipe.pn, True) or ""
-        for confvar in ['EXTRA_OEMESON', 'EXTRA_OECMAKE', 'EXTRA_OESCONS', 'EXTRA_OECONF']:
-            recipe.configopts = envdata.getVar(confvar, True) or ""
-            if recipe.configopts:
-                break
-        else:
-            recipe.configopts = ''
+        values = parser.get_recipe_values(fn, layerdir_start, repodir, skip_patches)
+        recipe.pn = values['pn']
+        recipe.pv = values['pv']
+        recipe.pr = values['pr']
+        recipe.pe = values['pe']
+        recipe.srcrev = values['srcrev']
+        recipe.summary = values['summary']
+        recipe.description = values['description']
+        recipe.section = values['section']
+        recipe.license = values['license']
+        recipe.homepage = values['homepage']
+        recipe.bugtracker = values['bugtracker']
+        recipe.provides = values['provides']
+        recipe.bbclassextend = values['bbclassextend']
+        recipe.inherits = values['inherits']
+        recipe.blacklisted = values['blacklisted']
+        recipe.configopts = values['configopts']
+        recipe.parse_inputs = '\n'.join(values['inputs'])
+        recipe.parse_inputs_hash = inputhasher.get_hash(values['inputs'])
         recipe.save()
 
-        # Handle sources
-        old_urls = list(recipe.source_set.values_list('url', flat=True))
-        for url in (envdata.getVar('SRC_URI', True) or '').split():
+        sources = []
+        for url in values['src_uri'].split():
             if not url.startswith('file://'):
-                url = url.split(';')[0]
-                if url in old_urls:
-                    old_urls.remove(url)
-                else:
-                    src = Source(recipe=recipe, url=url)
-                    src.save()
-        for url in old_urls:
-            recipe.source_set.filter(url=url).delete()
-
-        recipeparse.handle_recipe_depends(recipe, envdata.getVar('DEPENDS', True) or '', envdata.getVarFlags('PACKAGECONFIG'), logger)
-
-        recipeparse.handle_recipe_provides(recipe)
-
-        if not skip_patches:
-            # Handle patches
-            collect_patches(recipe, envdata, layerdir_start, stop_on_error)
-
-        # Get file dependencies within this layer
-        deps = envdata.getVar('__depends', True)
-        filedeps = []
-        for depstr, date in deps:
-            found = False
-            if depstr.startswith(layerdir_start) and not depstr.endswith('/conf/layer.conf'):
-                filedeps.append(os.path.relpath(depstr, repodir))
-        from layerindex.models import RecipeFileDependency
-
-        recipedeps_delete = []
-
-        recipedeps = RecipeFileDependency.objects.filter(recipe=recipe)
-
-        for values in recipedeps.values('path'):
-            if 'path' in values:
-                recipedeps_delete.append(values['path'])
-
-        for filedep in filedeps:
-            if filedep in recipedeps_delete:
-                recipedeps_delete.remove(filedep)
-                continue
-            # New item, add it...
-            recipedep = RecipeFileDependency()
-            recipedep.layerbranch = recipe.layerbranch
-            recipedep.recipe = recipe
-            recipedep.path = filedep
-            recipedep.save()
-
-        for filedep in recipedeps_delete:
-            recipedeps.filter(path=filedep).delete()
+                sources.append(url.split(';')[0])
+
+        if skip_patches:
+            patches = None
+        else:
+            patches = collect_patches(recipe, values['patches'], layerdir_start, stop_on_error)
+
+        # The remaining records for the recipe get written out in bulk
+        writebuffer.add(recipe,
+                        sources=sources,
+                        depends=values['depends'],
+                        inherits=values['inherits'],
+                        packageconfig_opts=values['packageconfig'],
+                        patches=patches,
+                        filedeps=values['filedeps'],
+                        stage_data=values.get('stages'))
 
     except KeyboardInterrupt:
         raise
@@ -199,6 +150,14 @@ def update_recipe_file(tinfoil, data, path, recipe, layerdir_start, repodir, sto
         else:
             if not recipe.pn:
                 recipe.pn = recipe.filename[:-3].split('_')[0]
+            # Ensure we try again next time (not all callers save the recipe
+            # afterwards; new recipes are saved by the caller)
+            recipe.parse_inputs_hash = ''
+            if recipe.pk:
+                recipe.save(update_fields=['parse_inputs_hash'])
+                # Anything collected from the last successful parse is now
+                # potentially out of date
+                writebuffer.discard(recipe)
             logger.error("Unable to read %s: %s", fn, str(e))
 
 def update_machine_conf_file(path, machine):
@@ -214,7 +173,7 @@ def update_machine_conf_file(path, machine):
                 break
     machine.description = desc
 
-def update_distro_conf_file(path, distro, d):
+def update_distro_conf_file(path, distro, parser):
     logger.debug('Updating distro %s' % path)
     desc = ""
     with open(path, 'r') as f:
@@ -228,8 +187,7 @@ def update_distro_conf_file(path, distro, d):
 
     distro_name = ''
     try:
-        d = utils.parse_conf(path, d)
-        distro_name = d.getVar('DISTRO_NAME', True)
+        distro_name = parser.get_distro_name(path)
     except Exception as e:
         logger.warn('Error parsing distro configuration file %s: %s' % (path, str(e)))
 
@@ -238,6 +196,16 @@ def update_distro_conf_file(path, distro, d):
     else:
         distro.description = desc
 
+def get_layerconf_values(layer_config_data):
+    """
+    Get the values from layer.conf needed by update.py to sort layers, in
+    the form printed by --initial (and cached in the LayerBranch record)
+    """
+    lines = []
+    for i in ["BBFILE_COLLECTIONS", "LAYERVERSION", "LAYERDEPENDS", "LAYERRECOMMENDS"]:
+        lines.append('%s = "%s"' % (i, utils.get_layer_var(layer_config_data, i, logger)))
+    return '\n'.join(lines)
+
 def main():
     if parse_version(git.__version__) < parse_version('0.3.1'):
         logger.error("Version of GitPython is too old, please install GitPython (python-git) 0.3.1 or later in order to use this script")
@@ -266,6 +234,9 @@ def main():
     parser.add_option("", "--nocheckout",
             help = "Don't check out branches",
             action="store_true", dest="nocheckout")
+    parser.add_option("", "--shared-checkout",
+            help = "Repositories are shared with other concurrent updates; leave them alone if already at the right revision",
+            action="store_true", dest="shared_checkout")
     parser.add_option("", "--stop-on-error",
             help = "Stop on first parsing error",
             action="store_true", default=False, dest="stop_on_error")
@@ -284,6 +255,9 @@ def main():
     parser.add_option("", "--keep-temp",
             help = "Preserve temporary directory at the end instead of deleting it",
             action="store_true")
+    parser.add_option("", "--parse-worker",
+            help = "Use the parse worker listening on the specified socket instead of starting bitbake",
+            action="store", dest="parse_worker")
 
     options, args = parser.parse_args(sys.argv)
     if len(args) > 1:
@@ -291,6 +265,10 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    if options.parse_worker and options.initial:
+        logger.error('--parse-worker cannot be used with --initial')
+        sys.exit(1)
+
     if options.fullreload:
         options.reload = True
 
@@ -300,6 +278,7 @@ def main():
                                    Recipe, RecipeFileDependency, Machine,
                                    Distro, BBAppend, BBClass,
                                    BBClassGlobal, BBClassRecipe, IncFile)
+    from layerindex import search
     from django.db import transaction
 
     logger.setLevel(options.loglevel)
@@ -347,6 +326,7 @@ def main():
 
     tinfoil = None
     tempdir = None
+    workerclient = None
     try:
         with transaction.atomic():
             newbranch = False
@@ -389,7 +369,7 @@ def main():
             if layerbranch.vcs_last_rev != topcommit.hexsha or options.reload or options.initial:
                 # Check out appropriate branch
                 if not options.nocheckout:
-                    utils.checkout_layer_branch(layerbranch, repodir, logger=logger)
+                    utils.checkout_layer_branch(layerbranch, repodir, logger=logger, shared=options.shared_checkout)
                     # Ensure dependent layers are checked out at the same release
                     for layerdependency in layerdependencies:
                         logger.debug("layerdependency: %s" % layerdependency)
@@ -401,63 +381,95 @@ def main():
                             dep_layerbranch = dep_layer.get_layerbranch(options.branch)
                             dep_urldir = dep_layer.get_fetch_dir()
                             dep_repodir = os.path.join(fetchdir, dep_urldir)
-                            utils.checkout_layer_branch(dep_layerbranch, dep_repodir, logger=logger)
+                            utils.checkout_layer_branch(dep_layerbranch, dep_repodir, logger=logger, shared=options.shared_checkout)
                         except Exception as e:
                             logger.warn("Unable to checkout dependent layer %s - %s" % (layerdependency.dependency, str(e)))
 
                 logger.info("Collecting data for layer %s on branch %s" % (layer.name, branchdesc))
-                try:
-                    (tinfoil, tempdir) = recipeparse.init_parser(settings, branch, bitbakepath, nocheckout=options.nocheckout, logger=logger)
-                except recipeparse.RecipeParseError as e:
-                    logger.error(str(e))
-                    sys.exit(1)
-                logger.debug('Using temp directory %s' % tempdir)
-                # Clear the default value of SUMMARY so that we can use DESCRIPTION instead if it hasn't been set
-                tinfoil.config_data.setVar('SUMMARY', '')
-                # Clear the default value of DESCRIPTION so that we can see where it's not set
-                tinfoil.config_data.setVar('DESCRIPTION', '')
-                # Clear the default value of HOMEPAGE ('unknown')
-                tinfoil.config_data.setVar('HOMEPAGE', '')
-                # Set a blank value for LICENSE so that it doesn't cause the parser to die (e.g. with meta-ti -
-                # why won't they just fix that?!)
-                tinfoil.config_data.setVar('LICENSE', '')
-
-                layerconfparser = layerconfparse.LayerConfParse(logger=logger, tinfoil=tinfoil)
-                if layer.name == settings.CORE_LAYER_NAME:
-                    # Skip parsing the core layer, we already did via BBLAYERS
-                    layer_config_data = layerconfparser.config_data_copy
+                if options.parse_worker:
+                    # The worker has already done the expensive bitbake setup
+                    utils.import_bitbake(bitbakepath)
+                    try:
+                        workerclient = parseworker.ParseWorkerClient(options.parse_worker)
+                        layer_config_data = workerclient.parse_layer_conf(layerdir, layer.name, core=(layer.name == settings.CORE_LAYER_NAME))
+                    except (parseworker.ParseWorkerError, recipeparse.RecipeParseError) as e:
+                        logger.error(str(e))
+                        sys.exit(1)
                 else:
-                    layer_config_data = layerconfparser.parse_layer(layerdir)
+                    try:
+                        (tinfoil, tempdir) = recipeparse.init_parser(settings, branch, bitbakepath, nocheckout=options.nocheckout, logger=logger, shared_checkout=options.shared_checkout)
+                    except recipeparse.RecipeParseError as e:
+                        logger.error(str(e))
+                        sys.exit(1)
+                    logger.debug('Using temp directory %s' % tempdir)
+                    # Clear the default value of SUMMARY so that we can use DESCRIPTION instead if it hasn't been set
+                    tinfoil.config_data.setVar('SUMMARY', '')
+                    # Clear the default value of DESCRIPTION so that we can see where it's not set
+                    tinfoil.config_data.setVar('DESCRIPTION', '')
+                    # Clear the default value of HOMEPAGE ('unknown')
+                    tinfoil.config_data.setVar('HOMEPAGE', '')
+                    # Set a blank value for LICENSE so that it doesn't cause the parser to die (e.g. with meta-ti -
+                    # why won't they just fix that?!)
+                    tinfoil.config_data.setVar('LICENSE', '')
+
+                    layerconfparser = layerconfparse.LayerConfParse(logger=logger, tinfoil=tinfoil)
+                    if layer.name == settings.CORE_LAYER_NAME:
+                        # Skip parsing the core layer, we already did via BBLAYERS
+                        layer_config_data = layerconfparser.config_data_copy
+                    else:
+                        layer_config_data = layerconfparser.parse_layer(layerdir)
                 if not layer_config_data:
                     logger.info("Skipping update of layer %s for branch %s - conf/layer.conf may have parse issues" % (layer.name, branchdesc))
-                    layerconfparser.shutdown()
+                    if tinfoil:
+                        layerconfparser.shutdown()
                     sys.exit(1)
                 utils.set_layerbranch_collection_version(layerbranch, layer_config_data, logger=logger)
                 if options.initial:
                     # Use print() rather than logger.info() since "-q" makes it print nothing.
-                    for i in ["BBFILE_COLLECTIONS", "LAYERVERSION", "LAYERDEPENDS", "LAYERRECOMMENDS"]:
-                        print('%s = "%s"' % (i, utils.get_layer_var(layer_config_data, i, logger)))
+                    print(get_layerconf_values(layer_config_data))
                     sys.exit(0)
 
+                # Cache the values so that update.py can avoid running us with
+                # --initial next time if layer.conf hasn't changed
+                layerbranch.layerconf_values = get_layerconf_values(layer_config_data)
+                layerbranch.layerconf_hash = utils.get_layerconf_hash(layerdir, utils.get_core_layerdir(settings, branch.name))
+
                 # Set up for recording patch info
-                utils.setup_core_layer_sys_path(settings, branch.name)
-                skip_patches = False
-                try:
-                    import oe.recipeutils
-                except ImportError:
+                if workerclient:
+                    skip_patches = workerclient.skip_patches
+                else:
+                    utils.setup_core_layer_sys_path(settings, branch.name)
+                    skip_patches = False
+                    try:
+                        import oe.recipeutils
+                    except ImportError:
+                        skip_patches = True
+                if skip_patches:
                     logger.warn('Failed to find lib/oe/recipeutils.py in layers - patch information will not be collected')
-                    skip_patches = True
 
                 utils.add_dependencies(layerbranch, layer_config_data, logger=logger)
                 utils.add_recommends(layerbranch, layer_config_data, logger=logger)
                 layerbranch.save()
 
+                # Additional processing of recipes configured via RECIPE_PARSE_STAGES
+                stages = recipeparse.get_recipe_parse_stages()
+
                 try:
-                    config_data_copy = recipeparse.setup_layer(tinfoil.config_data, fetchdir, layerdir, layer, layerbranch, logger)
-                except recipeparse.RecipeParseError as e:
+                    deplayerdirs = recipeparse.get_dependency_layerdirs(fetchdir, layer, layerbranch, logger)
+                    if workerclient:
+                        workerclient.setup_layer(layerdir, deplayerdirs)
+                        recipeparser = workerclient
+                    else:
+                        config_data_copy = recipeparse.setup_layer_dirs(tinfoil.config_data, layerdir, deplayerdirs)
+                        recipeparser = recipeparse.TinfoilRecipeParser(tinfoil, config_data_copy, stages)
+                except (parseworker.ParseWorkerError, recipeparse.RecipeParseError) as e:
                     logger.error(str(e))
                     sys.exit(1)
 
+                writebuffer = recipeparse.RecipeWriteBuffer(logger, RECIPE_WRITE_BATCH_SIZE, stages)
+                oldpns = set(layerbranch.recipe_set.values_list('pn', flat=True))
+                inputhasher = recipeparse.RecipeInputsHasher(fetchdir, [layerdir] + deplayerdirs, skip_patches, stages)
+
                 if layerbranch.vcs_last_rev and not options.reload:
                     try:
                         diff = repo.commit(layerbranch.vcs_last_rev).diff(topcommit)
@@ -525,7 +537,7 @@ def main():
                                     recipe.filepath = newfilepath
                                     recipe.filename = newfilename
                                     recipe.save()
-                                    update_recipe_file(tinfoil, config_data_copy, os.path.join(layerdir, newfilepath), recipe, layerdir_start, repodir, options.stop_on_error, skip_patches)
+                                    update_recipe_file(recipeparser, os.path.join(layerdir, newfilepath), recipe, layerdir_start, repodir, options.stop_on_error, writebuffer, inputhasher, skip_patches)
                                     updatedrecipes.add(os.path.join(oldfilepath, oldfilename))
                                     updatedrecipes.add(os.path.join(newfilepath, newfilename))
                                 else:
@@ -644,7 +656,7 @@ def main():
                                 distro = Distro()
                                 distro.layerbranch = layerbranch
                                 distro.name = filename
-                                update_distro_conf_file(os.path.join(repodir, path), distro, config_data_copy)
+                                update_distro_conf_file(os.path.join(repodir, path), distro, recipeparser)
                                 distro.save()
                             elif typename == 'bbclass':
                                 if '/classes-global/' in path:
@@ -678,7 +690,7 @@ def main():
                                 results = layerrecipes.filter(filepath=filepath).filter(filename=filename)[:1]
                                 if results:
                                     recipe = results[0]
-                                    update_recipe_file(tinfoil, config_data_copy, os.path.join(layerdir, filepath), recipe, layerdir_start, repodir, options.stop_on_error, skip_patches)
+                                    update_recipe_file(recipeparser, os.path.join(layerdir, filepath), recipe, layerdir_start, repodir, options.stop_on_error, writebuffer, inputhasher, skip_patches)
                                     recipe.save()
                                     updatedrecipes.add(recipe.full_path())
                             elif typename == 'machine':
@@ -691,7 +703,7 @@ def main():
                                 results = layerdistros.filter(name=filename)
                                 if results:
                                     distro = results[0]
-                                    update_distro_conf_file(os.path.join(repodir, path), distro, config_data_copy)
+                                    update_distro_conf_file(os.path.join(repodir, path), distro, recipeparser)
                                     distro.save()
 
                             deps = RecipeFileDependency.objects.filter(layerbranch=layerbranch).filter(path=path)
@@ -700,7 +712,10 @@ def main():
 
                     for recipe in dirtyrecipes:
                         if not recipe.full_path() in updatedrecipes:
-                            update_recipe_file(tinfoil, config_data_copy, os.path.join(layerdir, recipe.filepath), recipe, layerdir_start, repodir, options.stop_on_error, skip_patches)
+                            if inputhasher.is_unchanged(recipe):
+                                logger.debug('Skipping %s - inputs unchanged' % recipe.full_path())
+                                continue
+                            update_recipe_file(recipeparser, os.path.join(layerdir, recipe.filepath), recipe, layerdir_start, repodir, options.stop_on_error, writebuffer, inputhasher, skip_patches)
                 else:
                     # Collect recipe data from scratch
 
@@ -731,7 +746,10 @@ def main():
                                 # Recipe still exists, update it
                                 results = layerrecipes.filter(id=v['id'])[:1]
                                 recipe = results[0]
-                                update_recipe_file(tinfoil, config_data_copy, root, recipe, layerdir_start, repodir, options.stop_on_error, skip_patches)
+                                if inputhasher.is_unchanged(recipe):
+                                    logger.debug('Skipping %s - inputs unchanged' % recipe.full_path())
+                                else:
+                                    update_recipe_file(recipeparser, root, recipe, layerdir_start, repodir, options.stop_on_error, writebuffer, inputhasher, skip_patches)
                             else:
                                 # Recipe no longer exists, mark it for later on
                                 layerrecipes_delete.append(v)
@@ -770,7 +788,7 @@ def main():
                                 distro = Distro()
                                 distro.layerbranch = layerbranch
                                 distro.name = filename
-                                update_distro_conf_file(fullpath, distro, config_data_copy)
+                                update_distro_conf_file(fullpath, distro, recipeparser)
                                 distro.save()
                             elif typename == 'bbclass':
                                 if '/classes-global/' in fullpath:
@@ -810,15 +828,27 @@ def main():
                     recipe.filename = os.path.basename(added)
                     root = os.path.dirname(added)
                     recipe.filepath = os.path.relpath(root, layerdir)
-                    update_recipe_file(tinfoil, config_data_copy, root, recipe, layerdir_start, repodir, options.stop_on_error, skip_patches)
+                    update_recipe_file(recipeparser, root, recipe, layerdir_start, repodir, options.stop_on_error, writebuffer, inputhasher, skip_patches)
                     recipe.save()
 
+                # Any outstanding writes need to happen before we delete recipes
+                writebuffer.flush()
+                if writebuffer.queries_saved:
+                    logger.info("Batching recipe data writes saved approximately %d queries" % writebuffer.queries_saved)
+
                 for deleted in layerrecipes_delete:
                     logger.debug("Delete %s" % deleted)
                     results = Recipe.objects.filter(id=deleted['id'])[:1]
                     recipe = results[0]
                     recipe.delete()
 
+                # Recipes of the same name in other layers may now be shadowed
+                # by (or no longer shadowed by) recipes in this layer
+                Recipe.update_preferred_counts(layerbranch.branch_id,
+                        oldpns | set(layerbranch.recipe_set.values_list('pn', flat=True)))
+
+                search.get_backend().update_layerbranch(layerbranch)
+
                 # Save repo info
                 layerbranch.vcs_last_rev = topcommit.hexsha
                 layerbranch.vcs_last_commit = datetime.fromtimestamp(topcommit.committed_date)
@@ -846,6 +876,8 @@ def main():
     finally:
         if tinfoil and (parse_version(bb.__version__) > parse_version("1.27")):
             tinfoil.shutdown()
+        if workerclient:
+            workerclient.close()
 
     if tempdir:
         if options.keep_temp:
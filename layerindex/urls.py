@@ -195,10 +195,26 @@ urlpatterns = [
             content_type='text/plain; charset=utf-8',
             template_name='layerindex/branchcompare_plain.txt'),
         name='branch_comparison_plain'),
+    re_path(r'^branch_comparison/csv/$',
+        BranchCompareView.as_view(
+            export_format='csv'),
+        name='branch_comparison_csv'),
+    re_path(r'^branch_comparison/json/$',
+        BranchCompareView.as_view(
+            export_format='json'),
+        name='branch_comparison_json'),
     re_path(r'^recipe_deps/$',
         RecipeDependenciesView.as_view(
             template_name='layerindex/recipedeps.html'),
         name='recipe_deps'),
+    re_path(r'^recipe_deps/csv/$',
+        RecipeDependenciesView.as_view(
+            export_format='csv'),
+        name='recipe_deps_csv'),
+    re_path(r'^recipe_deps/json/$',
+        RecipeDependenciesView.as_view(
+            export_format='json'),
+        name='recipe_deps_json'),
     re_path(r'^ajax/layerchecklist/(?P<branch>[-.\w]+)/$',
         LayerCheckListView.as_view(
             template_name='layerindex/layerchecklist.html'),
@@ -8,7 +8,7 @@
 
 from django.views.defaults import page_not_found
 from django.urls import include, re_path, reverse_lazy
-from layerindex.views import LayerListView, RecipeSearchView, MachineSearchView, DistroSearchView, ClassSearchView, LayerDetailView, edit_layer_view, delete_layer_view, edit_layernote_view, delete_layernote_view, RedirectParamsView, DuplicatesView, LayerUpdateDetailView, layer_export_recipes_csv_view, comparison_update_view, update_layer_view
+from layerindex.views import LayerListView, RecipeSearchView, MachineSearchView, DistroSearchView, ClassSearchView, LayerDetailView, edit_layer_view, delete_layer_view, edit_layernote_view, delete_layernote_view, RedirectParamsView, DuplicatesView, LayerUpdateDetailView, layer_export_recipes_csv_view, recipes_export_view, comparison_update_view, update_layer_view
 
 urlpatterns = [
     re_path(r'^$',
@@ -24,6 +24,9 @@ urlpatterns = [
     re_path(r'^layer/(?P<slug>[-\.\w]+)/recipes/csv/$',
         layer_export_recipes_csv_view,
         name='layer_export_recipes_csv'),
+    re_path(r'^recipes/export/$',
+        recipes_export_view,
+        name='recipes_export'),
     re_path(r'^recipes/$',
         RecipeSearchView.as_view(
             template_name='layerindex/recipes.html'),
@@ -235,6 +235,19 @@ def setup_tinfoil(bitbakepath, enable_tracking, loglevel=None):
 
     return tinfoil
 
+def import_bitbake(bitbakepath):
+    """
+    Make BitBake's library available in this process without starting
+    tinfoil (some of the functions here refer to the bb module without
+    importing it themselves)
+    """
+    bblib = bitbakepath + '/lib'
+    if not bblib in sys.path:
+        sys.path.insert(0, bblib)
+    import builtins
+    import bb.utils
+    builtins.bb = bb
+
 def explode_dep_versions2(bitbakepath, deps):
     bblib = bitbakepath + '/lib'
     if not bblib in sys.path:
@@ -266,13 +279,16 @@ def is_commit_ancestor(repodir, commit, logger):
     except Exception as esc:
         logger.warn(esc)
 
-def checkout_repo(repodir, commit, logger, force=False):
+def checkout_repo(repodir, commit, logger, force=False, shared=False):
     """
     Check out a revision in a repository, ensuring that untracked/uncommitted
     files don't get in the way.
     WARNING: this will throw away any untracked/uncommitted files in the repo,
     so it is only suitable for use with repos where you don't care about such
     things (which we don't for the layer repos that we use)
+    If shared is True, the repository may be in use by other processes
+    running concurrently (which will have been checked out and cleaned up
+    front), so if the revision is already checked out it is left alone.
     """
     if force:
         currentref = ''
@@ -287,7 +303,16 @@ def checkout_repo(repodir, commit, logger, force=False):
         except Exception as esc:
             logger.warn(esc)
             currentref = ''
-    if currentref != commit:
+    targetref = commit
+    if currentref and shared:
+        # Resolve the revision so that we can tell if it's already checked out
+        # (avoiding the reset/clean, which would otherwise disrupt anything
+        # else concurrently reading from the same repository)
+        try:
+            targetref = runcmd(['git', 'rev-parse', '--verify', '%s^{commit}' % commit], repodir, printerr=False, logger=logger).strip()
+        except subprocess.CalledProcessError:
+            pass
+    if currentref != targetref:
         # Reset in case there are added but uncommitted changes
         runcmd(['git', 'reset', '--hard'], repodir, logger=logger)
         # Drop any untracked files in case these cause problems (either because
@@ -297,12 +322,21 @@ def checkout_repo(repodir, commit, logger, force=False):
         # Now check out the revision
         runcmd(['git', 'checkout', commit], repodir, logger=logger)
 
-def checkout_layer_branch(layerbranch, repodir, actual_branch=None, logger=None):
+def get_bitbake_ref(branch):
+    """Get the revision of BitBake to check out for the specified branch"""
+    if re.match('[0-9a-f]{40}', branch.bitbake_branch):
+        # SHA1 hash
+        return branch.bitbake_branch
+    else:
+        # Branch name
+        return 'origin/%s' % branch.bitbake_branch
+
+def checkout_layer_branch(layerbranch, repodir, actual_branch=None, logger=None, shared=False):
     if actual_branch:
         branchname = actual_branch
     else:
         branchname = layerbranch.get_checkout_branch()
-    checkout_repo(repodir, 'origin/%s' % branchname, logger)
+    checkout_repo(repodir, 'origin/%s' % branchname, logger, shared=shared)
 
 def is_layer_valid(layerdir):
     conf_file = os.path.join(layerdir, "conf", "layer.conf")
@@ -473,19 +507,63 @@ def chain_unique(*iterables):
                 seen.add(k)
                 yield item
 
-def setup_core_layer_sys_path(settings, branchname):
+def get_core_layerdir(settings, branchname):
     """
-    Add OE-Core's lib/oe directory to sys.path in order to allow importing
-    OE python modules
+    Get the path to the core layer for the specified branch, or None if
+    there is no core layer branch record
     """
     core_layer = get_layer(settings.CORE_LAYER_NAME)
+    if not core_layer:
+        return None
     core_layerbranch = core_layer.get_layerbranch(branchname)
     if core_layerbranch:
         core_urldir = core_layer.get_fetch_dir()
         core_repodir = os.path.join(settings.LAYER_FETCH_DIR, core_urldir)
-        core_layerdir = os.path.join(core_repodir, core_layerbranch.vcs_subdir)
+        return os.path.join(core_repodir, core_layerbranch.vcs_subdir)
+    return None
+
+def setup_core_layer_sys_path(settings, branchname):
+    """
+    Add OE-Core's lib/oe directory to sys.path in order to allow importing
+    OE python modules
+    """
+    core_layerdir = get_core_layerdir(settings, branchname)
+    if core_layerdir:
         sys.path.insert(0, os.path.join(core_layerdir, 'lib'))
 
+def git_blob_hash(fn):
+    """
+    Get the git blob SHA-1 for a file (i.e. the same value that
+    "git hash-object" would return), or '' if the file does not exist
+    """
+    import hashlib
+    try:
+        with open(fn, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return ''
+    shash = hashlib.sha1()
+    shash.update(b'blob %d\0' % len(data))
+    shash.update(data)
+    return shash.hexdigest()
+
+def get_layerconf_hash(layerdir, core_layerdir):
+    """
+    Get a hash identifying the inputs for reading values from a layer's
+    conf/layer.conf, i.e. the file itself plus the core layer's
+    conf/layer.conf which is always parsed before it. The layers it depends
+    on don't need to be included: the values are what update_layer.py
+    --initial prints, and that parses only these two files (dependency
+    layers are only set up later, for parsing recipes).
+    """
+    import hashlib
+    shash = hashlib.sha256()
+    for confdir in [layerdir, core_layerdir]:
+        if confdir:
+            shash.update(git_blob_hash(os.path.join(confdir, 'conf', 'layer.conf')).encode('utf-8'))
+        shash.update(b'\0')
+    return shash.hexdigest()
+
 
 def run_command_interruptible(cmd):
     """
@@ -517,6 +595,20 @@ def run_command_interruptible(cmd):
     return process.returncode, buf
 
 
+def run_command_buffered(cmd):
+    """
+    Run a command, capturing its output instead of displaying it. Unlike
+    run_command_interruptible() this does not alter signal handlers, so it
+    is safe to call from a thread other than the main thread; the caller is
+    responsible for any Ctrl+C handling.
+    """
+    process = subprocess.Popen(
+        cmd, cwd=os.path.dirname(sys.argv[0]), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    output, _ = process.communicate()
+    return process.returncode, output.decode('utf-8', errors='surrogateescape')
+
+
 def sanitise_html(html):
     soup = BeautifulSoup(html, "html.parser")
     for tag in soup.findAll(True):
@@ -30,7 +30,7 @@ from django.db.models.functions import Lower
 from django.db.models.query import QuerySet
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_list_or_404, get_object_or_404, render
 from django.template.loader import get_template
 from django.utils.decorators import method_decorator
@@ -58,10 +58,11 @@ from layerindex.models import (BBAppend, BBClass, BBClassGlobal, BBClassRecipe,
                                LayerNote, LayerUpdate, Machine, Patch, Recipe,
                                RecipeChange, RecipeChangeset, Source, StaticBuildDep,
                                Update, SecurityQuestion, SecurityQuestionAnswer,
-                               UserProfile, PatchDisposition, ExtendedProvide)
+                               UserProfile, PatchDisposition, ExtendedProvide,
+                               InheritedClass)
 
 
-from . import tasks, utils
+from . import branchcompare, recipeexport, search, tasks, utils
 
 def edit_layernote_view(request, template_name, slug, pk=None):
     layeritem = get_object_or_404(LayerItem, name=slug)
@@ -476,6 +477,11 @@ class LayerDetailView(DetailView):
             context['appends'] = layerbranch.bbappend_set.order_by('filename')
             context['classes'] = layerbranch.bbclass_set.order_by('name')
             context['updates'] = LayerUpdate.objects.filter(layer=layerbranch.layer, branch=layerbranch.branch).order_by('-started')
+            graph = layerbranch.branch.get_layer_dependency_graph()
+            context['dependencies'] = graph.dependencies(layerbranch.id, required=True)
+            context['recommends'] = graph.dependencies(layerbranch.id, required=False)
+            context['dependents'] = [graph.nodes[layerbranch_id] for layerbranch_id in graph.dependents(layerbranch.id)
+                                     if graph.nodes[layerbranch_id].status in ['P', 'X']]
         context['url_branch'] = self.kwargs['branch']
         context['this_url_name'] = resolve(self.request.path_info).url_name
         if 'rrs' in settings.INSTALLED_APPS:
@@ -497,28 +503,6 @@ class LayerReviewDetailView(LayerDetailView):
         return context
 
 
-def recipes_preferred_count(qs):
-    # Add extra column so we can show "duplicate" recipes from other layers de-emphasised
-    # (it's a bit crude having to do this using SQL but I couldn't find a better way...)
-    return qs.extra(
-        select={
-            'preferred_count': """SELECT COUNT(1)
-FROM layerindex_recipe AS recipe2
-, layerindex_layerbranch as branch2
-, layerindex_layeritem as layer1
-, layerindex_layeritem as layer2
-WHERE branch2.id = recipe2.layerbranch_id
-AND layer2.id = branch2.layer_id
-AND layer2.layer_type in ('S', 'A')
-AND branch2.branch_id = layerindex_layerbranch.branch_id
-AND recipe2.pn = layerindex_recipe.pn
-AND recipe2.layerbranch_id <> layerindex_recipe.layerbranch_id
-AND layer1.id = layerindex_layerbranch.layer_id
-AND layer2.index_preference > layer1.index_preference
-"""
-        },
-    )
-
 class RecipeSearchView(ListView):
     context_object_name = 'recipe_list'
     paginate_by = 50
@@ -529,7 +513,7 @@ class RecipeSearchView(ListView):
         else:
             return super(ListView, self).render_to_response(context, **kwargs)
 
-    def search_recipe_query(self, init_qs, query_string, preferred=True):
+    def search_recipe_query(self, init_qs, query_string):
         """Do a prioritised search using the specified keyword (if any)"""
         # Lower() here isn't needed for OE recipes since we don't use uppercase
         # but we use this same code for "recipes" from other distros where
@@ -538,32 +522,13 @@ class RecipeSearchView(ListView):
 
         filtered = False
         if query_string.strip():
-            # First search by exact name
-            qs0 = init_qs.filter(pn=query_string).order_by(*order_by)
-            if preferred:
-                qs0 = recipes_preferred_count(qs0)
-
-            # Then keyword somewhere in the name
-            entry_query = utils.string_to_query(query_string, ['pn'])
-            qs1 = init_qs.filter(entry_query).order_by(*order_by)
-            if preferred:
-                qs1 = recipes_preferred_count(qs1)
-
-            # Then keyword somewhere in summary or description
-            entry_query = utils.string_to_query(query_string, ['description', 'summary'])
-            qs2 = init_qs.filter(entry_query).order_by(*order_by)
-            if preferred:
-                qs2 = recipes_preferred_count(qs2)
-
-            # Now chain the results together and drop any duplicates (e.g.
-            # if the keyword matched in the name and summary)
-            qs = list(utils.chain_unique(qs0, qs1, qs2))
+            # Exact name matches first, then keywords in the name, then
+            # full-text matches on summary / description by relevance
+            qs = search.search(init_qs, query_string, order_by)
             filtered = True
         elif 'q' in self.request.GET:
             # User clicked search with no query string, return all records
             qs = init_qs.order_by(*order_by)
-            if preferred:
-                qs = list(recipes_preferred_count(qs))
         else:
             # It's a bit too slow to return all records by default, and most people
             # won't actually want that (if they do they can just hit the search button
@@ -592,7 +557,7 @@ class RecipeSearchView(ListView):
         inherits = []
         query_terms = []
         for item in query_items:
-            # Support slightly crude search on inherits field
+            # Support search on inherited classes
             if item.startswith('inherits:'):
                 inherits.append(item.split(':')[1])
 
@@ -633,12 +598,10 @@ layer name is expected to follow the \"layer:\" prefix without any spaces.')
                 if ' ' in item:
                     item = '"%s"' % item
                 query_terms.append(item)
-        if inherits:
-            # FIXME This is a bit ugly, perhaps we should consider having this as a one-many relationship instead
-            for inherit in inherits:
-                init_qs = init_qs.filter(Q(inherits=inherit) | Q(inherits__startswith=inherit + ' ') | Q(inherits__endswith=' ' + inherit) | Q(inherits__contains=' %s ' % inherit))
+        for inherit in inherits:
+            init_qs = init_qs.filter(inheritedclass__name=inherit)
         query_string = ' '.join(query_terms)
-        qs, _ = self.search_recipe_query(init_qs, query_string, preferred=False)
+        qs, _ = self.search_recipe_query(init_qs, query_string)
         return qs
 
     def get_context_data(self, **kwargs):
@@ -657,8 +620,7 @@ class DuplicatesView(TemplateView):
         if layer_ids:
             init_qs = init_qs.filter(layerbranch__layer__in=layer_ids)
         dupes = init_qs.values('pn').annotate(Count('layerbranch', distinct=True)).filter(layerbranch__count__gt=1)
-        qs = init_qs.all().filter(pn__in=[item['pn'] for item in dupes]).order_by('pn', 'layerbranch__layer', '-pv')
-        return recipes_preferred_count(qs)
+        return init_qs.all().filter(pn__in=[item['pn'] for item in dupes]).order_by('pn', 'layerbranch__layer', '-pv')
 
     def get_classes(self, layer_ids):
         init_qs = BBClass.objects.filter(layerbranch__branch__name=self.kwargs['branch'])
@@ -833,8 +795,7 @@ class MachineSearchView(ListView):
             query_string = ""
         init_qs = Machine.objects.filter(layerbranch__branch__name=self.kwargs['branch'])
         if query_string.strip():
-            entry_query = utils.string_to_query(query_string, ['name', 'description'])
-            return init_qs.filter(entry_query).order_by('name', 'layerbranch__layer')
+            return search.search(init_qs, query_string, ('name', 'layerbranch__layer'))
         else:
             if 'q' in self.request.GET:
                 return init_qs.order_by('name', 'layerbranch__layer')
@@ -885,8 +846,7 @@ class DistroSearchView(ListView):
             query_string = ""
         init_qs = Distro.objects.filter(layerbranch__branch__name=self.kwargs['branch'])
         if query_string.strip():
-            entry_query = utils.string_to_query(query_string, ['name', 'description'])
-            return init_qs.filter(entry_query).order_by('name', 'layerbranch__layer')
+            return search.search(init_qs, query_string, ('name', 'layerbranch__layer'))
 
         if 'q' in self.request.GET:
             return init_qs.order_by('name', 'layerbranch__layer')
@@ -913,8 +873,7 @@ class ClassSearchView(ListView):
             query_string = ""
         init_qs = BBClass.objects.filter(layerbranch__branch__name=self.kwargs['branch'])
         if query_string.strip():
-            entry_query = utils.string_to_query(query_string, ['name'])
-            return init_qs.filter(entry_query).order_by('name', 'layerbranch__layer')
+            return search.search(init_qs, query_string, ('name', 'layerbranch__layer'))
 
         if 'q' in self.request.GET:
             return init_qs.order_by('name', 'layerbranch__layer')
@@ -924,6 +883,14 @@ class ClassSearchView(ListView):
 
     def get_context_data(self, **kwargs):
         context = super(ClassSearchView, self).get_context_data(**kwargs)
+        # Count the recipes on the branch inheriting each of the classes shown
+        class_list = context['class_list']
+        usage = dict(InheritedClass.objects.filter(name__in=[bbclass.name for bbclass in class_list],
+                                                   recipes__layerbranch__branch__name=self.kwargs['branch'])
+                                           .annotate(recipe_count=Count('recipes'))
+                                           .values_list('name', 'recipe_count'))
+        for bbclass in class_list:
+            bbclass.recipe_count = usage.get(bbclass.name, 0)
         context['search_keyword'] = self.request.GET.get('q', '')
         context['url_branch'] = self.kwargs['branch']
         context['this_url_name'] = resolve(self.request.path_info).url_name
@@ -1309,15 +1276,14 @@ class ClassicRecipeSearchView(RecipeSearchView):
             else:
                 init_qs = init_qs.filter(needs_attention=False)
             filtered = True
-        qs, filtered = self.search_recipe_query(init_qs, query_string, preferred=False)
+        qs, filtered = self.search_recipe_query(init_qs, query_string)
         if qreversed:
             init_rqs = Recipe.objects.filter(layerbranch__branch__name='master')
             if layer_ids:
                 init_rqs = init_rqs.filter(layerbranch__layer__id__in=layer_ids)
             excludeclasses_param = self.request.GET.get('excludeclasses', '')
             if excludeclasses_param:
-                for inherit in excludeclasses_param.split(','):
-                    init_rqs = init_rqs.exclude(inherits=inherit).exclude(inherits__startswith=inherit + ' ').exclude(inherits__endswith=' ' + inherit).exclude(inherits__contains=' %s ' % inherit)
+                init_rqs = init_rqs.exclude(inheritedclass__name__in=excludeclasses_param.split(','))
             all_values = []
             if filtered:
                 if isinstance(qs, list):
@@ -1531,28 +1497,52 @@ class StatsView(TemplateView):
         return context
 
 
+def _recipe_export_response(request, queryset, filename, default_format='csv', header=True):
+    export_format = request.GET.get('format', default_format)
+    if export_format not in ['csv', 'jsonl']:
+        return HttpResponse('Format %s is invalid' % export_format)
+    fieldlist = request.GET.get('fields', 'pn,pv,license').split(',')
+    invalid = recipeexport.validate_fields(fieldlist)
+    if invalid:
+        return HttpResponse('Field %s is invalid' % invalid)
+
+    rows = recipeexport.iter_recipes(queryset.order_by('pn', '-pv'), fieldlist)
+    if export_format == 'jsonl':
+        response = StreamingHttpResponse(recipeexport.iter_jsonl(rows), content_type='application/x-ndjson; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(recipeexport.iter_csv(rows, fieldlist, header), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, export_format)
+    return response
+
+
 def layer_export_recipes_csv_view(request, branch, slug):
-    import csv
     layer = get_object_or_404(LayerItem, name=slug)
     layerbranch = layer.get_layerbranch(branch)
     if not layerbranch:
         raise Http404
 
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = 'attachment; filename="recipes_%s_%s.csv"' % (layer.name, layerbranch.branch.name)
+    # No header row here, for compatibility with existing users
+    return _recipe_export_response(request,
+                                   layerbranch.recipe_set.all(),
+                                   'recipes_%s_%s' % (layer.name, layerbranch.branch.name),
+                                   header=False)
 
-    fieldlist = request.GET.get('fields', 'pn,pv,license').split(',')
-    recipe_fields = [f.name for f in Recipe._meta.get_fields() if not (f.auto_created and f.is_relation)]
-    for field in fieldlist:
-        if field not in recipe_fields:
-            return HttpResponse('Field %s is invalid' % field)
-
-    writer = csv.writer(response)
-    for recipe in layerbranch.sorted_recipes():
-        values = [getattr(recipe, field) for field in fieldlist]
-        writer.writerow(values)
 
-    return response
+def recipes_export_view(request, branch):
+    """
+    Export recipes on a branch, optionally limited to the layers specified
+    as a comma-separated list of names in the "layers" parameter
+    """
+    branchobj = get_object_or_404(Branch, name=branch)
+    queryset = Recipe.objects.filter(layerbranch__branch=branchobj)
+    layernames = [name for name in request.GET.get('layers', '').split(',') if name]
+    if layernames:
+        layers = list(LayerItem.objects.filter(name__in=layernames).values_list('name', flat=True))
+        for name in layernames:
+            if name not in layers:
+                return HttpResponse('Layer %s is invalid' % name)
+        queryset = queryset.filter(layerbranch__layer__name__in=layernames)
+    return _recipe_export_response(request, queryset, 'recipes_%s' % branchobj.name)
 
 
 def comparison_update_view(request, branch):
@@ -1723,7 +1713,7 @@ class ComparisonRecipeSelectView(ClassicRecipeSearchView):
         init_qs = Recipe.objects.filter(layerbranch__branch__name='master')
         if layer_ids:
             init_qs = init_qs.filter(layerbranch__layer__in=layer_ids)
-        qs, _ = self.search_recipe_query(init_qs, query_string, preferred=False)
+        qs, _ = self.search_recipe_query(init_qs, query_string)
         return qs
 
     def post(self, request, *args, **kwargs):
@@ -1779,74 +1769,44 @@ class ComparisonRecipeSelectDetailView(DetailView):
 
 class BranchCompareView(FormView):
     form_class = BranchComparisonForm
+    # Set to 'csv' or 'json' to export the results instead of rendering the page
+    export_format = None
 
-    def get_recipes(self, from_branch, to_branch, layer_ids):
-        class BranchComparisonResult:
-            def __init__(self, pn, short_desc):
-                self.pn = pn
-                self.short_desc = short_desc
-                self.from_versions = []
-                self.to_versions = []
-                self.id = None
-            def pv_changed(self):
-                from_pvs = sorted([x.pv for x in self.from_versions])
-                to_pvs = sorted([x.pv for x in self.to_versions])
-                return (from_pvs != to_pvs)
-        class BranchComparisonVersionResult:
-            def __init__(self, id, pv, srcrev):
-                self.id = id
-                self.pv = pv
-                self.srcrev = srcrev
-            def version_expr(self):
-                return (self.pv, self.srcrev)
-
-        def map_name(recipe):
-            pn = recipe.pn
-            if pn.startswith('gcc-source-'):
-                pn = pn.replace('-%s' % recipe.pv, '')
-            elif pn.endswith(('-i586', '-i686')):
-                pn = pn[:-5]
-            elif pn.endswith('-x86_64-oesdk-linux'):
-                pn = pn[:-19]
-            return pn
-
-        from_recipes = Recipe.objects.filter(layerbranch__branch=from_branch)
-        to_recipes = Recipe.objects.filter(layerbranch__branch=to_branch)
-        if layer_ids:
-            from_recipes = from_recipes.filter(layerbranch__layer__in=layer_ids)
-            to_recipes = to_recipes.filter(layerbranch__layer__in=layer_ids)
-        recipes = {}
-        for recipe in from_recipes:
-            pn = map_name(recipe)
-            res = recipes.get(pn, None)
-            if not res:
-                res = BranchComparisonResult(pn, recipe.short_desc)
-                recipes[pn] = res
-            res.from_versions.append(BranchComparisonVersionResult(id=recipe.id, pv=recipe.pv, srcrev=recipe.srcrev))
-        for recipe in to_recipes:
-            pn = map_name(recipe)
-            res = recipes.get(pn, None)
-            if not res:
-                res = BranchComparisonResult(pn, recipe.short_desc)
-                recipes[pn] = res
-            res.to_versions.append(BranchComparisonVersionResult(id=recipe.id, pv=recipe.pv, srcrev=recipe.srcrev))
-
-        added = []
-        changed = []
-        removed = []
-        for _, recipe in sorted(recipes.items(), key=lambda item: item[0]):
-            recipe.from_versions = sorted(recipe.from_versions, key=lambda item: parse_version(item.pv))
-            from_version_exprs = [x.version_expr() for x in recipe.from_versions]
-            recipe.to_versions = sorted(recipe.to_versions, key=lambda item: parse_version(item.pv))
-            to_version_exprs = [x.version_expr() for x in recipe.to_versions]
-            if not from_version_exprs:
-                added.append(recipe)
-            elif not to_version_exprs:
-                recipe.id = recipe.from_versions[-1].id
-                removed.append(recipe)
-            elif from_version_exprs != to_version_exprs:
-                changed.append(recipe)
-        return added, changed, removed
+    def render_to_response(self, context, **kwargs):
+        if not self.export_format:
+            return super(BranchCompareView, self).render_to_response(context, **kwargs)
+        sections = [('added', context.get('added', [])),
+                    ('changed', context.get('changed', [])),
+                    ('removed', context.get('removed', []))]
+        if self.export_format == 'json':
+            data = {'from_branch': context['from_branch'].name if context['from_branch'] else None,
+                    'to_branch': context['to_branch'].name if context['to_branch'] else None,
+                    'layers': context['showlayers_text'].split(', ') if context['showlayers_text'] else []}
+            for status, recipes in sections:
+                data[status] = [recipe.to_dict() for recipe in recipes]
+            return JsonResponse(data)
+
+        import csv
+        class Echo:
+            def write(self, value):
+                return value
+        def rows():
+            writer = csv.writer(Echo())
+            yield writer.writerow(['status', 'pn', 'from_versions', 'to_versions'])
+            for status, recipes in sections:
+                for recipe in recipes:
+                    # As with the page, show SRCREV where only that has changed
+                    if status == 'changed' and not recipe.pv_changed():
+                        fmt = lambda x: '%s (%s)' % (x.pv, x.srcrev) if x.srcrev else x.pv
+                    else:
+                        fmt = lambda x: x.pv
+                    yield writer.writerow([status,
+                                           recipe.pn,
+                                           ' '.join([fmt(x) for x in recipe.from_versions]),
+                                           ' '.join([fmt(x) for x in recipe.to_versions])])
+        response = StreamingHttpResponse(rows(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="branch_comparison.csv"'
+        return response
 
     def form_valid(self, form):
         return HttpResponseRedirect(reverse_lazy('branch_comparison', args=(form.cleaned_data['from_branch'].name, form.cleaned_data['to_branch'].name)))
@@ -1867,28 +1827,31 @@ class BranchCompareView(FormView):
         from_branch_id = self.request.GET.get('from_branch', None)
         to_branch_id = self.request.GET.get('to_branch', None)
 
-        layer_ids = self.request.GET.get('layers', str(LayerItem.objects.get(name=settings.CORE_LAYER_NAME).id))
+        layers_param = self.request.GET.get('layers', str(LayerItem.objects.get(name=settings.CORE_LAYER_NAME).id))
+        layer_ids = [int(i) for i in layers_param.split(',') if i.strip().isdigit()]
         from_branch = None
         if from_branch_id is not None:
             from_branch = get_object_or_404(Branch, id=from_branch_id)
         context['from_branch'] = from_branch
         to_branch = None
-        if from_branch_id is not None:
+        if to_branch_id is not None:
             to_branch = get_object_or_404(Branch, id=to_branch_id)
         context['to_branch'] = to_branch
         if from_branch and to_branch:
-            context['added'], context['changed'], context['removed'] = self.get_recipes(from_branch, to_branch, layer_ids)
+            context['added'], context['changed'], context['removed'] = branchcompare.compare_branches(from_branch, to_branch, layer_ids)
         context['this_url_name'] = resolve(self.request.path_info).url_name
         context['layers'] = LayerItem.objects.filter(status__in=['P', 'X']).order_by('name')
         context['showlayers'] = layer_ids
         layerlist = dict(context['layers'].values_list('id', 'name'))
-        context['showlayers_text'] = ', '.join([layerlist[int(i)] for i in layer_ids])
+        context['showlayers_text'] = ', '.join([layerlist[i] for i in layer_ids if i in layerlist])
 
         return context
 
 
 class RecipeDependenciesView(FormView):
     form_class = RecipeDependenciesForm
+    # Set to 'csv' or 'json' to export the results instead of rendering the page
+    export_format = None
 
     def get_recipes(self, layerbranch, exclude_layer_ids, crosslayer):
         class RecipeResult:
@@ -1908,32 +1871,48 @@ class RecipeDependenciesView(FormView):
                 self.layer = layer
                 self.dynamic = dynamic
 
-        recipes = Recipe.objects.filter(layerbranch=layerbranch)
+        # Look up all of the build dependencies of recipes in the layer...
+        static_through = StaticBuildDep.recipes.through
+        dynamic_through = DynamicBuildDep.recipes.through
+        recipe_deps = {}
+        for recipe_id, depname in static_through.objects.filter(recipe__layerbranch=layerbranch).values_list('recipe_id', 'staticbuilddep__name'):
+            recipe_deps.setdefault(recipe_id, ([], []))[0].append(depname)
+        for recipe_id, depname in dynamic_through.objects.filter(recipe__layerbranch=layerbranch).values_list('recipe_id', 'dynamicbuilddep__name'):
+            recipe_deps.setdefault(recipe_id, ([], []))[1].append(depname)
 
-        layerprovides = []
+        layerprovides = set()
         if crosslayer:
-            layerprovides = list(ExtendedProvide.objects.filter(recipes__layerbranch=layerbranch).values_list('name', flat=True))
-
-        branch = layerbranch.branch
+            layerprovides = set(ExtendedProvide.objects.filter(recipes__layerbranch=layerbranch).values_list('name', flat=True))
+
+        # ... and then all of the recipes on the branch providing them
+        provide_through = ExtendedProvide.recipes.through
+        providers_qs = provide_through.objects.filter(
+            Q(extendedprovide__name__in=static_through.objects.filter(recipe__layerbranch=layerbranch).values('staticbuilddep__name')) |
+            Q(extendedprovide__name__in=dynamic_through.objects.filter(recipe__layerbranch=layerbranch).values('dynamicbuilddep__name')),
+            recipe__layerbranch__branch=layerbranch.branch)
+        if exclude_layer_ids:
+            providers_qs = providers_qs.exclude(recipe__layerbranch__layer__in=exclude_layer_ids)
+        providers = {}
+        for row in providers_qs.values_list('extendedprovide__name', 'recipe_id', 'recipe__pn', 'recipe__pv', 'recipe__license',
+                                            'recipe__layerbranch__layer__name', 'recipe__layerbranch__layer__index_preference',
+                                            'recipe__layerbranch_id'):
+            providers.setdefault(row[0], []).append(row[1:])
+        for deprecipes in providers.values():
+            deprecipes.sort(key=lambda deprecipe: (-deprecipe[5], deprecipe[6], deprecipe[1]))
 
         def process(resultobj, depname, dynamic):
-            if crosslayer and depname in layerprovides:
+            if depname in layerprovides:
                 return
-            eprovides = ExtendedProvide.objects.filter(name=depname)
-            if eprovides:
-                for eprovide in eprovides:
-                    deprecipes = eprovide.recipes.filter(layerbranch__branch=branch).values('id', 'pn', 'pv', 'license', 'layerbranch__layer__name').order_by('-layerbranch__layer__index_preference', 'layerbranch', 'pn')
-                    if exclude_layer_ids:
-                        deprecipes = deprecipes.exclude(layerbranch__layer__in=exclude_layer_ids)
-                    for deprecipe in deprecipes:
-                        resultobj.deps.append(RecipeDependencyResult(deprecipe['id'],
-                                                            depname,
-                                                            deprecipe['pn'],
-                                                            deprecipe['pv'],
-                                                            deprecipe['license'],
-                                                            deprecipe['layerbranch__layer__name'],
-                                                            dynamic))
-            if not resultobj.deps:
+            deprecipes = providers.get(depname, [])
+            for deprecipe in deprecipes:
+                resultobj.deps.append(RecipeDependencyResult(deprecipe[0],
+                                                    depname,
+                                                    deprecipe[1],
+                                                    deprecipe[2],
+                                                    deprecipe[3],
+                                                    deprecipe[4],
+                                                    dynamic))
+            if not deprecipes:
                 resultobj.deps.append(RecipeDependencyResult(-1,
                                                     depname,
                                                     depname,
@@ -1943,16 +1922,43 @@ class RecipeDependenciesView(FormView):
                                                     dynamic))
 
         outrecipes = []
-        for recipe in recipes:
+        for recipe in Recipe.objects.filter(layerbranch=layerbranch).only('id', 'pn', 'summary', 'description', 'license'):
             res = RecipeResult(recipe.id, recipe.pn, recipe.short_desc, recipe.license)
-            for rdepname in recipe.staticbuilddep_set.values_list('name', flat=True).order_by('name'):
+            static_deps, dynamic_deps = recipe_deps.get(recipe.id, ([], []))
+            for rdepname in sorted(static_deps):
                 process(res, rdepname, False)
-            for rdepname in recipe.dynamicbuilddep_set.values_list('name', flat=True).order_by('name'):
+            for rdepname in sorted(dynamic_deps):
                 process(res, rdepname, True)
             outrecipes.append(res)
 
         return outrecipes
 
+    def render_to_response(self, context, **kwargs):
+        if not self.export_format:
+            return super(RecipeDependenciesView, self).render_to_response(context, **kwargs)
+        rows = []
+        for recipe in context.get('recipes', []):
+            for dep in recipe.deps:
+                rows.append({'recipe': recipe.pn,
+                             'license': recipe.license,
+                             'dependency': dep.depname,
+                             'dependency_recipe': dep.pn if dep.id > -1 else '',
+                             'dependency_pv': dep.pv,
+                             'dependency_license': dep.license,
+                             'dependency_layer': dep.layer,
+                             'optional': dep.dynamic})
+        if self.export_format == 'json':
+            return JsonResponse(rows, safe=False)
+        import csv
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        layer = context.get('layer')
+        branch = context.get('branch')
+        response['Content-Disposition'] = 'attachment; filename="recipedeps_%s_%s.csv"' % (layer.name if layer else '', branch.name if branch else '')
+        writer = csv.DictWriter(response, fieldnames=['recipe', 'license', 'dependency', 'dependency_recipe', 'dependency_pv', 'dependency_license', 'dependency_layer', 'optional'])
+        writer.writeheader()
+        writer.writerows(rows)
+        return response
+
     def form_valid(self, form):
         return HttpResponseRedirect(reverse_lazy('recipe_deps', args=(form.cleaned_data['branch'].name)))
 
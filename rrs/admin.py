@@ -16,7 +16,8 @@ from rrs.models import Release, Milestone, Maintainer, RecipeMaintainerHistory,
         RecipeMaintainer, RecipeDistro, RecipeUpgrade, RecipeUpstream, \
         RecipeUpstreamHistory, MaintenancePlan, MaintenancePlanLayerBranch, \
         RecipeMaintenanceLink, RecipeSymbol, RecipeUpgradeGroupRule, \
-        RecipeUpgradeGroup
+        RecipeUpgradeGroup, MilestoneStatistics, MilestoneIntervalStatistics, \
+        RecipeParseData
 
 class MaintenancePlanLayerBranchFormSet(BaseInlineFormSet):
     def __init__(self, *args, **kwargs):
@@ -163,6 +164,7 @@ class RecipeMaintainerHistoryAdmin(admin.ModelAdmin):
 class RecipeMaintainerAdmin(admin.ModelAdmin):
     search_fields = ['recipesymbol__pn']
     list_filter = ['recipesymbol__layerbranch__layer__name', 'history', 'maintainer__name']
+    list_display = ('__str__', 'history', 'end_date')
     model = RecipeMaintainer
 
 class RecipeDistroAdmin(admin.ModelAdmin):
@@ -199,6 +201,25 @@ class RecipeSymbolAdmin(admin.ModelAdmin):
     search_fields = ['pn']
     list_filter = ['layerbranch']
 
+class MilestoneIntervalStatisticsInline(admin.TabularInline):
+    model = MilestoneIntervalStatistics
+    readonly_fields = ['interval', 'upgrades']
+    can_delete = False
+    extra = 0
+
+class MilestoneStatisticsAdmin(admin.ModelAdmin):
+    list_filter = ['milestone__release__plan', 'milestone__release__name']
+    list_display = ('milestone', 'maintainer', 'recipes_all', 'up_to_date', 'updated')
+    readonly_fields = [f.name for f in MilestoneStatistics._meta.fields]
+    inlines = [MilestoneIntervalStatisticsInline]
+    model = MilestoneStatistics
+
+class RecipeParseDataAdmin(admin.ModelAdmin):
+    search_fields = ['recipe__pn']
+    list_filter = ['recipe__layerbranch__layer__name']
+    readonly_fields = ['recipe', 'variables', 'updated']
+    model = RecipeParseData
+
 admin.site.register(MaintenancePlan, MaintenancePlanAdmin)
 admin.site.register(Release, ReleaseAdmin)
 admin.site.register(Milestone, MilestoneAdmin)
@@ -213,3 +234,5 @@ admin.site.register(RecipeMaintenanceLink, RecipeMaintenanceLinkAdmin)
 admin.site.register(RecipeSymbol, RecipeSymbolAdmin)
 admin.site.register(RecipeUpgradeGroupRule)
 admin.site.register(RecipeUpgradeGroup)
+admin.site.register(MilestoneStatistics, MilestoneStatisticsAdmin)
+admin.site.register(RecipeParseData, RecipeParseDataAdmin)
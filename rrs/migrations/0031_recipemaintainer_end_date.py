@@ -0,0 +1,58 @@
+# Generated by Django 4.2 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+def convert_to_deltas(apps, schema_editor):
+    """
+    Previously a full snapshot of maintainers was recorded for every
+    history entry; keep only the records where the maintainer changed
+    and mark when each one stopped applying
+    """
+    RecipeMaintainerHistory = apps.get_model('rrs', 'RecipeMaintainerHistory')
+    RecipeMaintainer = apps.get_model('rrs', 'RecipeMaintainer')
+
+    def chunks(ids):
+        for i in range(0, len(ids), 500):
+            yield ids[i:i + 500]
+
+    layerbranch_ids = RecipeMaintainerHistory.objects.values_list('layerbranch_id', flat=True).distinct()
+    for layerbranch_id in layerbranch_ids:
+        # recipesymbol_id -> (RecipeMaintainer id, maintainer_id)
+        current = {}
+        for rmh in RecipeMaintainerHistory.objects.filter(layerbranch_id=layerbranch_id).order_by('date', 'id'):
+            snapshot = {}
+            redundant = []
+            for rm_id, symbol_id, maintainer_id in RecipeMaintainer.objects.filter(history=rmh).values_list('id', 'recipesymbol_id', 'maintainer_id'):
+                if symbol_id in snapshot:
+                    redundant.append(rm_id)
+                    continue
+                prev = current.get(symbol_id)
+                if prev and prev[1] == maintainer_id:
+                    snapshot[symbol_id] = prev
+                    redundant.append(rm_id)
+                else:
+                    snapshot[symbol_id] = (rm_id, maintainer_id)
+            ended = [rm_id for symbol_id, (rm_id, _) in current.items()
+                     if snapshot.get(symbol_id, (None,))[0] != rm_id]
+            for ids in chunks(ended):
+                RecipeMaintainer.objects.filter(id__in=ids).update(end_date=rmh.date)
+            for ids in chunks(redundant):
+                RecipeMaintainer.objects.filter(id__in=ids).delete()
+            current = snapshot
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rrs', '0030_alter_recipeupgrade_maintainer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipemaintainer',
+            name='end_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(convert_to_deltas, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rrs', '0031_recipemaintainer_end_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipeupstream',
+            name='check_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
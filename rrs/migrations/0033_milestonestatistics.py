@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rrs', '0032_recipeupstream_check_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MilestoneStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipes_all', models.IntegerField(default=0)),
+                ('up_to_date', models.IntegerField(default=0)),
+                ('not_updated', models.IntegerField(default=0)),
+                ('cant_be_updated', models.IntegerField(default=0)),
+                ('unknown', models.IntegerField(default=0)),
+                ('all_upgraded', models.IntegerField(default=0)),
+                ('all_not_upgraded', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('maintainer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='rrs.maintainer')),
+                ('milestone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rrs.milestone')),
+            ],
+            options={
+                'verbose_name_plural': 'Milestone statistics',
+                'unique_together': {('milestone', 'maintainer')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MilestoneIntervalStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.IntegerField()),
+                ('upgrades', models.IntegerField(default=0)),
+                ('statistics', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='intervals', to='rrs.milestonestatistics')),
+            ],
+            options={
+                'verbose_name_plural': 'Milestone interval statistics',
+                'ordering': ['interval'],
+                'unique_together': {('statistics', 'interval')},
+            },
+        ),
+    ]
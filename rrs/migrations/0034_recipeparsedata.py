@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layerindex', '0055_branch_layerdeps_version'),
+        ('rrs', '0033_milestonestatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeParseData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variables', models.TextField(blank=True, help_text='Variable values (JSON)')),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='layerindex.recipe')),
+            ],
+            options={
+                'verbose_name_plural': 'Recipe parse data',
+            },
+        ),
+    ]
@@ -9,11 +9,15 @@
 import sys
 import os
 import re
+import json
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '../')))
 
 from datetime import date, datetime
 
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from layerindex.models import Recipe, LayerBranch, PythonEnvironment
 from django.core.exceptions import ObjectDoesNotExist
@@ -214,6 +218,40 @@ class RecipeSymbol(models.Model):
             rsym.save()
         return rsym
 
+    @staticmethod
+    def symbols(layerbranch, summaries):
+        """
+        Bulk equivalent of symbol(): summaries maps pn -> summary (or None)
+        for each symbol wanted. Returns a dict of pn -> RecipeSymbol.
+        """
+        from layerindex.models import truncate_charfield_values
+        symbols = {}
+        for rsym in RecipeSymbol.objects.filter(layerbranch=layerbranch).order_by('id'):
+            if rsym.pn in summaries:
+                symbols.setdefault(rsym.pn, rsym)
+
+        missing = [pn for pn in summaries if pn not in symbols]
+        if missing:
+            recipe_summaries = {}
+            for pn, summary in Recipe.objects.filter(layerbranch=layerbranch).order_by('id').values_list('pn', 'summary'):
+                recipe_summaries.setdefault(pn, summary)
+            to_create = []
+            for pn in missing:
+                rsym = RecipeSymbol(pn=pn, layerbranch=layerbranch,
+                        summary=summaries[pn] or recipe_summaries.get(pn, ''))
+                truncate_charfield_values(RecipeSymbol, rsym)
+                to_create.append(rsym)
+            RecipeSymbol.objects.bulk_create(to_create)
+            if any(rsym.pk is None for rsym in to_create):
+                # The database backend can't tell us the ids of the rows just
+                # inserted, so look them up
+                ids = dict(RecipeSymbol.objects.filter(layerbranch=layerbranch, pn__in=[rsym.pn for rsym in to_create]).values_list('pn', 'id'))
+                for rsym in to_create:
+                    rsym.pk = ids[rsym.pn]
+            for pn, rsym in zip(missing, to_create):
+                symbols[pn] = rsym
+        return symbols
+
     def __str__(self):
         return "%s: %s" % (str(self.layerbranch), self.pn)
 
@@ -288,12 +326,26 @@ class RecipeMaintainerHistory(models.Model):
 class RecipeMaintainer(models.Model):
     recipesymbol = models.ForeignKey(RecipeSymbol, on_delete=models.CASCADE)
     maintainer = models.ForeignKey(Maintainer, on_delete=models.CASCADE)
+    # Only changes in maintainership are recorded: a record applies from its
+    # history entry up until end_date (or indefinitely if end_date is not set)
     history = models.ForeignKey(RecipeMaintainerHistory, on_delete=models.CASCADE)
+    end_date = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    @staticmethod
+    def get_by_history(history):
+        """
+        Get the maintainer records in effect as of the specified history entry
+        """
+        if history is None:
+            return RecipeMaintainer.objects.none()
+        return RecipeMaintainer.objects.filter(
+                history__layerbranch_id=history.layerbranch_id,
+                history__date__lte=history.date).filter(
+                Q(end_date__isnull=True) | Q(end_date__gt=history.date))
 
     @staticmethod
     def get_maintainer_by_recipe_and_history(recipe, history):
-        qry = RecipeMaintainer.objects.filter(recipesymbol__pn=recipe.pn,
-                history=history)
+        qry = RecipeMaintainer.get_by_history(history).filter(recipesymbol__pn=recipe.pn)
 
         if qry:
             return qry[0].maintainer
@@ -367,6 +419,10 @@ class RecipeUpstream(models.Model):
     status =  models.CharField(max_length=1, choices=RECIPE_UPSTREAM_STATUS_CHOICES, blank=True, db_index=True)
     no_update_reason = models.CharField(max_length=255, blank=True, db_index=True)
     date = models.DateTimeField(db_index=True)
+    # Hash of the values used to check the upstream version, set only when
+    # the check was actually performed (rather than reusing an earlier
+    # result) so that later runs can reuse it for a limited time
+    check_key = models.CharField(max_length=64, blank=True, db_index=True)
 
     @staticmethod
     def get_all_recipes(history):
@@ -431,6 +487,30 @@ class RecipeDistro(models.Model):
         return recipe_distros
 
 
+class RecipeParseData(models.Model):
+    """
+    Values needed by the RRS tools, collected from the recipe by
+    rrs.parsestage.RRSRecipeStage when the layer update last parsed it
+    """
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE)
+    variables = models.TextField(blank=True, help_text='Variable values (JSON)')
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Recipe parse data'
+
+    def __str__(self):
+        return str(self.recipe)
+
+    def get_variables(self):
+        if not self.variables:
+            return {}
+        return json.loads(self.variables)
+
+    def set_variables(self, variables):
+        self.variables = json.dumps(variables, sort_keys=True)
+
+
 class RecipeUpgradeGroup(models.Model):
     recipesymbol = models.ForeignKey(RecipeSymbol, on_delete=models.CASCADE)
     title = models.CharField(max_length=100, help_text='Group title')
@@ -556,7 +636,7 @@ class RecipeMaintenanceLink(models.Model):
             if fnmatch.fnmatch(pn, rml.pn_match):
                 recipe_link_objs = rmh.layerbranch.recipe_set.filter(pn=rml.pn_target)
                 if recipe_link_objs:
-                    lrm = RecipeMaintainer.objects.filter(recipesymbol__pn=recipe_link_objs[0].pn, history=rmh)
+                    lrm = RecipeMaintainer.get_by_history(rmh).filter(recipesymbol__pn=recipe_link_objs[0].pn)
                     if lrm:
                         return lrm[0]
         return None
@@ -564,3 +644,59 @@ class RecipeMaintenanceLink(models.Model):
 
     def __str__(self):
         return '%s -> %s' % (self.pn_match, self.pn_target)
+
+
+class MilestoneStatistics(models.Model):
+    """
+    Statistics for a milestone, either overall (maintainer is None) or for
+    a single maintainer, precomputed from the history records since they
+    are expensive to calculate (see rrs.views.update_milestone_statistics())
+    """
+    milestone = models.ForeignKey(Milestone, on_delete=models.CASCADE)
+    maintainer = models.ForeignKey(Maintainer, blank=True, null=True, on_delete=models.CASCADE)
+    recipes_all = models.IntegerField(default=0)
+    up_to_date = models.IntegerField(default=0)
+    not_updated = models.IntegerField(default=0)
+    cant_be_updated = models.IntegerField(default=0)
+    unknown = models.IntegerField(default=0)
+    all_upgraded = models.IntegerField(default=0)
+    all_not_upgraded = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Milestone statistics'
+        unique_together = ('milestone', 'maintainer',)
+
+    def __str__(self):
+        if self.maintainer:
+            return '%s: %s' % (self.milestone, self.maintainer.name)
+        return str(self.milestone)
+
+class MilestoneIntervalStatistics(models.Model):
+    """
+    Number of upgrades by a maintainer within an interval of a milestone
+    (a week, or for the "All" milestone, each of the other milestones)
+    """
+    statistics = models.ForeignKey(MilestoneStatistics, related_name='intervals', on_delete=models.CASCADE)
+    # Position of the interval (sorted)
+    interval = models.IntegerField()
+    upgrades = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Milestone interval statistics'
+        unique_together = ('statistics', 'interval',)
+        ordering = ['interval']
+
+    def __str__(self):
+        return '%s: %d: %d' % (self.statistics, self.interval, self.upgrades)
+
+
+@receiver(post_save, sender=Milestone)
+def milestone_post_save(sender, instance, *args, **kwargs):
+    # The dates may have changed, so the statistics need to be recalculated
+    MilestoneStatistics.objects.filter(milestone__release=instance.release).delete()
+
+@receiver(post_save, sender=MaintenancePlanLayerBranch)
+@receiver(post_delete, sender=MaintenancePlanLayerBranch)
+def maintplanlayerbranch_changed(sender, instance, *args, **kwargs):
+    MilestoneStatistics.objects.filter(milestone__release__plan_id=instance.plan_id).delete()
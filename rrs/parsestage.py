@@ -0,0 +1,130 @@
+# rrs-web - collection of recipe data during the layer index update
+#
+# Enable by adding 'rrs.parsestage.RRSRecipeStage' to RECIPE_PARSE_STAGES
+# in settings.py, so that rrs_upstream_history.py and rrs_distros.py can use
+# the values collected here rather than parsing every recipe again.
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+from layerindex.recipeparse import RecipeParseStage
+
+
+# Variables the RRS tools need from each recipe
+RRS_RECIPE_VARS = ['PN', 'BPN', 'PV', 'PE', 'SUMMARY', 'DESCRIPTION',
+        'SRC_URI', 'SRCREV', 'SRCREV_FORMAT', 'UPSTREAM_VERSION_UNKNOWN',
+        'RECIPE_UPSTREAM_VERSION', 'RECIPE_UPSTREAM_DATE',
+        'RECIPE_NO_UPDATE_REASON', 'DISTRO_PN_ALIAS']
+# Prefixes of other variables that affect the upstream version check
+RRS_RECIPE_VAR_PREFIXES = ('UPSTREAM_CHECK_', 'SRCREV_')
+
+
+def set_regexes(d, logger=None):
+    """
+        Utility function to set regexes to SPECIAL_PKGSUFFIX packages
+        that don't have set it.
+
+        For example: python-native use regex from python if don't have
+        one set it.
+    """
+    import bb.data
+
+    variables = ('UPSTREAM_CHECK_REGEX', 'UPSTREAM_CHECK_URI', 'UPSTREAM_CHECK_GITTAGREGEX')
+
+    if any(d.getVar(var, True) for var in variables):
+        return
+
+    suffixes = d.getVar('SPECIAL_PKGSUFFIX', True).split()
+    prefixes = ['nativesdk-']
+
+    special = list(suffixes)
+    special.extend(prefixes)
+
+    localdata = bb.data.createCopy(d)
+    pn = localdata.getVar('PN', True)
+    for s in special:
+        if pn.find(s) != -1:
+            if s in suffixes:
+                pnstripped = pn.split(s)[0]
+            else:
+                pnstripped = pn.replace(s, '')
+
+            localdata.setVar('OVERRIDES', "pn-" + pnstripped + ":" +
+                    d.getVar('OVERRIDES', True))
+            try:
+                bb.data.update_data(localdata)
+            except AttributeError:
+                pass
+
+            for var in variables:
+                new_value = localdata.getVar(var, True)
+                if new_value is None:
+                    continue
+
+                d.setVar(var, new_value)
+                if logger:
+                    logger.debug("%s: %s new value %s" % (pn, var,
+                        d.getVar(var, True)))
+            break
+
+
+def get_rrs_variables(d):
+    """
+    Get the values of the variables the RRS tools need from a recipe
+    datastore (with upstream check regexes already set, see set_regexes())
+    """
+    names = set(RRS_RECIPE_VARS)
+    names.update([var for var in d.keys() if var.startswith(RRS_RECIPE_VAR_PREFIXES)])
+
+    variables = {}
+    for var in sorted(names):
+        try:
+            value = d.getVar(var, True)
+        except Exception:
+            value = d.getVar(var, False)
+        if value is not None:
+            variables[var] = str(value)
+    return variables
+
+
+class RRSRecipeStage(RecipeParseStage):
+    """
+    Records the values needed by the RRS tools for each recipe parsed by
+    the layer update in RecipeParseData
+    """
+    name = 'rrs'
+
+    def collect(self, envdata):
+        set_regexes(envdata)
+        return get_rrs_variables(envdata)
+
+    def store(self, items):
+        from rrs.models import RecipeParseData
+
+        existing = {parsedata.recipe_id: parsedata for parsedata in
+                RecipeParseData.objects.filter(recipe_id__in=[recipe.id for recipe, _ in items])}
+        to_create = []
+        to_update = []
+        for recipe, variables in items:
+            parsedata = existing.get(recipe.id)
+            if parsedata:
+                to_update.append(parsedata)
+            else:
+                parsedata = RecipeParseData(recipe=recipe)
+                to_create.append(parsedata)
+            parsedata.set_variables(variables)
+        if to_create:
+            RecipeParseData.objects.bulk_create(to_create)
+        if to_update:
+            # bulk_update() doesn't apply auto_now
+            from django.utils import timezone
+            now = timezone.now()
+            for parsedata in to_update:
+                parsedata.updated = now
+            RecipeParseData.objects.bulk_update(to_update, ['variables', 'updated'])
+
+    def discard(self, recipes):
+        from rrs.models import RecipeParseData
+
+        RecipeParseData.objects.filter(recipe_id__in=[recipe.id for recipe in recipes]).delete()
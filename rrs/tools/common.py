@@ -45,6 +45,20 @@ def get_logger(name, settings):
 
     return logger
 
+def update_statistics(maintplans, options, logger):
+    """
+    Refresh the precomputed milestone statistics for the specified plans
+    (only those milestones that can be affected by recent changes, unless
+    doing a full reload)
+    """
+    import rrs.views
+
+    if options.dry_run:
+        return
+    for maintplan in maintplans:
+        logger.debug('Updating milestone statistics for plan %s' % maintplan)
+        rrs.views.update_plan_statistics(maintplan, full=getattr(options, 'fullreload', False), logger=logger)
+
 def get_pv_type(pv):
     pv_type = ''
     if '+git' in pv:
@@ -56,6 +70,70 @@ def get_pv_type(pv):
 
     return pv_type
 
+def get_commit_changes(repodir, revargs, pathspecs, logger):
+    """
+    Run a single "git log" over the specified revisions and yield a
+    (commit, commit timestamp, changes) tuple for each commit that changes
+    any of the specified paths relative to any of its parents, oldest
+    first. changes is a list of (status, a_path, b_path) tuples.
+    """
+    import subprocess
+    import re
+
+    # --full-history so that we see everything we would by looking at each
+    # commit individually, and -m to get changes for merges against each parent
+    cmd = ['git', 'log', '--reverse', '--full-history', '-m', '-M', '--name-status', '-z',
+           '--format=commit %H %ct'] + revargs + ['--'] + pathspecs
+    logger.debug("run cmd '%s' in %s" % (cmd, repodir))
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=repodir)
+
+    def read_fields():
+        buf = b''
+        while True:
+            data = proc.stdout.read(65536)
+            if not data:
+                break
+            buf += data
+            fields = buf.split(b'\0')
+            buf = fields.pop()
+            for field in fields:
+                yield field.decode('utf-8', errors='surrogateescape')
+        if buf:
+            yield buf.decode('utf-8', errors='surrogateescape')
+
+    header_re = re.compile('^commit ([0-9a-f]{40}) ([0-9]+)$')
+    commit = None
+    ctepoch = None
+    changes = []
+    fields = read_fields()
+    try:
+        for field in fields:
+            res = header_re.match(field)
+            if res:
+                if res.group(1) != commit:
+                    if commit:
+                        yield commit, ctepoch, changes
+                    commit, ctepoch = res.groups()
+                    changes = []
+                # Otherwise this is the same merge commit against another parent
+                continue
+            status = field.strip()
+            if not status:
+                continue
+            a_path = next(fields)
+            if status[0] in 'RC':
+                b_path = next(fields)
+            else:
+                b_path = a_path
+            changes.append((status[0], a_path, b_path))
+        if commit:
+            yield commit, ctepoch, changes
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
 def get_recipe_files(layerdir):
     from layerindex import recipeparse
 
@@ -86,10 +164,9 @@ def get_recipe_files(layerdir):
                 recipe_files.append(fullpath)
     return recipe_files
 
-def load_recipes(layerbranch, bitbakepath, fetchdir, settings, logger,
-        recipe_files=None, nocheckout=False):
+def init_layer_parser(layerbranch, bitbakepath, fetchdir, settings, logger,
+        nocheckout=False):
     from layerindex import recipeparse
-    from bb.fetch import FetchError
 
     try:
         (tinfoil, tempdir) = recipeparse.init_parser(settings,
@@ -107,9 +184,23 @@ def load_recipes(layerbranch, bitbakepath, fetchdir, settings, logger,
     d = recipeparse.setup_layer(tinfoil.config_data, fetchdir, layerdir,
             layer, layerbranch, logger)
 
+    return (tinfoil, d, layerdir, tempdir)
+
+def load_recipes(layerbranch, bitbakepath, fetchdir, settings, logger,
+        recipe_files=None, nocheckout=False):
+    (tinfoil, d, layerdir, tempdir) = init_layer_parser(layerbranch,
+            bitbakepath, fetchdir, settings, logger, nocheckout=nocheckout)
+
     if recipe_files is None:
         recipe_files = get_recipe_files(layerdir)
 
+    recipes = parse_recipe_files(tinfoil, d, layerbranch, recipe_files, logger)
+
+    return (tinfoil, d, recipes, tempdir)
+
+def parse_recipe_files(tinfoil, d, layerbranch, recipe_files, logger):
+    from bb.fetch import FetchError
+
     recipes = []
     for fn in recipe_files:
         try:
@@ -130,6 +221,49 @@ def load_recipes(layerbranch, bitbakepath, fetchdir, settings, logger,
                     % (layerbranch, fn, str(e)))
             continue
 
+    return recipes
+
+def load_recipe_data(layerbranch, bitbakepath, fetchdir, settings, logger,
+        recipe_qry, reparse=False):
+    """
+    Get a datastore for each of the specified recipes, with the upstream
+    check regexes set. Where the layer update has already collected the
+    values we need (see rrs/parsestage.py) the datastore is built from
+    those on top of the base configuration (so recipe-level variables that
+    weren't collected come from the base configuration, which may not give
+    the same result as parsing); recipes without them (or all recipes if
+    reparse is True) get parsed instead.
+    """
+    import bb.data
+    from django.core.exceptions import ObjectDoesNotExist
+    from rrs.parsestage import set_regexes
+
+    (tinfoil, d, layerdir, tempdir) = init_layer_parser(layerbranch,
+            bitbakepath, fetchdir, settings, logger)
+
+    recipes = []
+    recipe_files = []
+    for recipe in recipe_qry.select_related('recipeparsedata'):
+        fn = str(os.path.join(layerdir, recipe.full_path()))
+        try:
+            variables = recipe.recipeparsedata.get_variables()
+        except ObjectDoesNotExist:
+            variables = None
+        if reparse or not variables:
+            recipe_files.append(fn)
+            continue
+        data = bb.data.createCopy(d)
+        data.setVar('FILE', fn)
+        for var, value in variables.items():
+            data.setVar(var, value)
+        recipes.append(data)
+    logger.debug('%s: %d recipes using values from the last layer update, %d to parse' %
+            (layerbranch, len(recipes), len(recipe_files)))
+
+    for data in parse_recipe_files(tinfoil, d, layerbranch, recipe_files, logger):
+        set_regexes(data, logger)
+        recipes.append(data)
+
     return (tinfoil, d, recipes, tempdir)
 
 # XXX: Copied from oe-core recipeutils to avoid import errors.
@@ -161,3 +295,112 @@ def get_recipe_pv_without_srcpv(pv, uri_type):
             pfx = m.group('pfx')
 
     return (pv, pfx, sfx)
+
+def serialise_tinfoil_commands(tinfoil):
+    """
+    Allow recipe data returned by tinfoil to be used from more than one
+    thread. Variable lookups go back to the bitbake server over a single
+    connection that can only handle one command at a time, so we need to
+    serialise the commands.
+    """
+    import threading
+
+    lock = threading.RLock()
+    run_command = tinfoil.run_command
+
+    def locked_run_command(*args, **kwargs):
+        with lock:
+            return run_command(*args, **kwargs)
+
+    tinfoil.run_command = locked_run_command
+
+class ConcurrentChecker:
+    """
+    Runs a (network-bound) check function over a number of items using a
+    bounded pool of threads, limiting how many checks may be in progress
+    against any one host at a time.
+
+    A check that runs for longer than timeout seconds is abandoned: threads
+    can't be interrupted so it will carry on in the background, but its
+    result is discarded. (Setting a default socket timeout ensures such
+    threads do eventually finish.)
+    """
+    def __init__(self, check_fn, jobs=8, host_jobs=2, timeout=300):
+        self.check_fn = check_fn
+        self.jobs = jobs
+        self.host_jobs = host_jobs
+        self.timeout = timeout
+
+    def _check(self, item, started, index):
+        import time
+        started[index] = time.monotonic()
+        return self.check_fn(item)
+
+    def run(self, items):
+        """
+        Check each item in items, which should be (host, item) tuples.
+        Yields (item, result, error) tuples in order of completion, where
+        error is the exception raised by the check (or a TimeoutError if
+        it took too long), or None if the check succeeded.
+        """
+        import time
+        from collections import OrderedDict, deque
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        # Queue the items up per host and only hand them to the pool once
+        # their host has a free slot, so that worker threads never sit
+        # waiting on a busy host while checks against other hosts could run
+        queues = OrderedDict()
+        for index, (host, item) in enumerate(items):
+            queues.setdefault(host, deque()).append((index, item))
+        host_running = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.jobs)
+        started = {}
+        futures = {}
+        pending = set()
+
+        def dispatch():
+            for host in list(queues):
+                queue = queues[host]
+                while queue and len(pending) < self.jobs:
+                    # Items without a host (e.g. local files) aren't limited
+                    if host and host_running.get(host, 0) >= self.host_jobs:
+                        break
+                    index, item = queue.popleft()
+                    future = executor.submit(self._check, item, started, index)
+                    futures[future] = (index, host, item)
+                    pending.add(future)
+                    host_running[host] = host_running.get(host, 0) + 1
+                if not queue:
+                    del queues[host]
+
+        def finish(future):
+            pending.remove(future)
+            _, host, item = futures[future]
+            host_running[host] -= 1
+            return item
+
+        try:
+            dispatch()
+            while pending:
+                done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = finish(future)
+                    try:
+                        yield item, future.result(), None
+                    except Exception as e:
+                        yield item, None, e
+                if self.timeout:
+                    now = time.monotonic()
+                    for future in list(pending):
+                        index, _, _ = futures[future]
+                        start = started.get(index)
+                        if start is not None and now - start > self.timeout:
+                            item = finish(future)
+                            yield item, None, TimeoutError('Check timed out after %d seconds' % self.timeout)
+                dispatch()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
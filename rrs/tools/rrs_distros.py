@@ -16,14 +16,13 @@ import logging
 from datetime import datetime
 
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__))))
-from common import common_setup, load_recipes, \
+from common import common_setup, load_recipe_data, \
         get_pv_type, get_logger, DryRunRollbackException
 common_setup()
 from layerindex import utils
 
 utils.setup_django()
 from django.db import transaction
-from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 import settings
 
 logger = get_logger("RecipeDistros", settings)
@@ -43,14 +42,36 @@ if getattr(settings, 'BITBAKE_PATH', ''):
 sys.path.insert(0, os.path.join(bitbakepath, 'lib'))
 
 
-from layerindex.models import Recipe, LayerBranch
+from layerindex.models import LayerBranch
 from rrs.models import RecipeDistro, MaintenancePlan
 
+"""
+    Reads the package lists downloaded by oe.distro_check into an index of
+    package name -> list of (distro, section), so that recipes can be looked
+    up without scanning the lists each time.
+"""
+def load_distro_packages(pkglst_dir):
+    index = {}
+    for distro_file in os.listdir(pkglst_dir):
+        (distro, distro_release) = distro_file.split("-")
+
+        seen = set()
+        with open(os.path.join(pkglst_dir, distro_file), "r") as f:
+            for line in f:
+                (pkg, _, section) = line.rstrip('\n').partition(":")
+                # Only the first entry for a package in each list counts
+                if pkg in seen:
+                    continue
+                seen.add(pkg)
+                index.setdefault(pkg, []).append((distro, section))
+
+    return index
+
 """
     Searches the recipe's package in major distributions.
     Returns a dictionary containing pairs of (distro name, package aliases).
 """
-def search_package_in_distros(pkglst_dir, recipe, data):
+def search_package_in_distros(distro_packages, recipe, data):
     distros = {}
     distro_aliases = {}
 
@@ -69,21 +90,13 @@ def search_package_in_distros(pkglst_dir, recipe, data):
                 (dist, pn_alias) = alias.split('=')
                 distro_aliases[dist.strip().lower()] = pn_alias.strip()
 
-    for distro_file in os.listdir(pkglst_dir):
-        (distro, distro_release) = distro_file.split("-")
-
-        if distro.lower() in distro_aliases:
-            pn = distro_aliases[distro.lower()]
-        else:
-            pn = recipe_name
-
-        with open(os.path.join(pkglst_dir, distro_file), "r") as f:
-            for line in f:
-                (pkg, section) = line.split(":")
-                if pn == pkg:
-                    distro_complete = distro + "-" + section[:-1]
-                    distros[distro_complete] = pn
-                    break
+    for distro, section in distro_packages.get(recipe_name, []):
+        if distro.lower() not in distro_aliases:
+            distros[distro + "-" + section] = recipe_name
+    for dist, pn in distro_aliases.items():
+        for distro, section in distro_packages.get(pn, []):
+            if distro.lower() == dist:
+                distros[distro + "-" + section] = pn
 
     return distros
 
@@ -102,6 +115,10 @@ if __name__=="__main__":
             help="Specify maintenance plan to operate on (default is all plans that have updates enabled)",
             action="store", dest="plan", default=None)
 
+    parser.add_option("--reparse",
+            help="Parse all recipes rather than using the values collected by the last layer update",
+            action="store_true", dest="reparse", default=False)
+
     options, args = parser.parse_args(sys.argv)
     logger.setLevel(options.loglevel)
 
@@ -119,13 +136,14 @@ if __name__=="__main__":
     logger.debug("Starting recipe distros update ...")
 
     origsyspath = sys.path
-    pkglst_dir = None
+    distro_packages = None
     for maintplan in maintplans:
         for item in maintplan.maintenanceplanlayerbranch_set.all():
             layerbranch = item.layerbranch
             sys.path = origsyspath
-            (tinfoil, d, recipes, tempdir) = load_recipes(layerbranch, bitbakepath,
-                    fetchdir, settings, logger)
+            (tinfoil, d, recipes, tempdir) = load_recipe_data(layerbranch, bitbakepath,
+                    fetchdir, settings, logger, layerbranch.recipe_set.all(),
+                    reparse=options.reparse)
             try:
                 if not recipes:
                     continue
@@ -134,39 +152,46 @@ if __name__=="__main__":
                     with transaction.atomic():
                         utils.setup_core_layer_sys_path(settings, layerbranch.branch.name)
 
-                        if not pkglst_dir:
+                        if distro_packages is None:
                             # Only need to do this once
                             from oe import distro_check
                             logger.debug("Downloading distro's package information ...")
                             distro_check.create_distro_packages_list(fetchdir, d)
                             pkglst_dir = os.path.join(fetchdir, "package_lists")
+                            distro_packages = load_distro_packages(pkglst_dir)
 
-                        RecipeDistro.objects.filter(recipe__layerbranch = layerbranch).delete()
+                        layer_recipes = {}
+                        for recipe in layerbranch.recipe_set.all():
+                            layer_recipes.setdefault(recipe.filename, []).append(recipe)
 
+                        recipedistros = []
                         for recipe_data in recipes:
                             pn = recipe_data.getVar('PN', True)
                             fn = os.path.basename(recipe_data.getVar('FILE', True))
 
-                            try:
-                                recipe = Recipe.objects.get(filename=fn, layerbranch=layerbranch)
-                            except MultipleObjectsReturned:
-                                logger.warn('Recipe file %s appears more than once in layerbranch %s!' % (fn,
+                            fn_recipes = layer_recipes.get(fn)
+                            if not fn_recipes:
+                                logger.warn('Recipe file %s not found in layerbranch %s' % (fn,
                                     str(layerbranch)))
                                 continue
-                            except ObjectDoesNotExist:
-                                logger.warn('Recipe file %s not found in layerbranch %s' % (fn,
+                            elif len(fn_recipes) > 1:
+                                logger.warn('Recipe file %s appears more than once in layerbranch %s!' % (fn,
                                     str(layerbranch)))
                                 continue
+                            recipe = fn_recipes[0]
 
-                            distro_info = search_package_in_distros(pkglst_dir, recipe, recipe_data)
+                            distro_info = search_package_in_distros(distro_packages, recipe, recipe_data)
                             for distro, alias in distro_info.items():
                                 recipedistro = RecipeDistro()
                                 recipedistro.recipe = recipe
                                 recipedistro.distro = distro
                                 recipedistro.alias = alias
-                                recipedistro.save()
+                                recipedistros.append(recipedistro)
                                 logger.debug('%s: layer branch %s, add distro %s alias %s' % (pn,
                                     str(layerbranch), distro, alias))
+
+                        RecipeDistro.objects.filter(recipe__layerbranch = layerbranch).delete()
+                        RecipeDistro.objects.bulk_create(recipedistros)
                         if options.dry_run:
                             raise DryRunRollbackException
                 except DryRunRollbackException:
@@ -14,8 +14,10 @@ import os.path
 import optparse
 import logging
 
+import git
+
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__))))
-from common import common_setup, get_logger, DryRunRollbackException
+from common import common_setup, get_logger, update_statistics, DryRunRollbackException
 common_setup()
 from layerindex import utils, recipeparse
 
@@ -46,31 +48,10 @@ def get_recipe_maintainer(line, logger):
         logger.debug("line (%s) don\'t match" % (line))
         return None
 
-"""
-    Get commit information from text.
-    Returns author_name, author_email, date and title.
-"""
-def get_commit_info(info, logger):
-    import re
+def maintainers_inc_history(options, logger, maintplan, layerbranch, repodir, layerdir):
+    import fnmatch
     from datetime import datetime
-    from email.utils import parsedate_tz, mktime_tz
-
-    author_regex = re.compile("^Author: (?P<name>.*) <(?P<email>.*)>$")
-    date_regex = re.compile("^Date:   (?P<date>.*)$")
-    title_regex = re.compile("^    (?P<title>.*)$")
-
-    lines = info.split('\n')
-
-    author_name = author_regex.search(lines[1]).group('name')
-    author_email = author_regex.search(lines[1]).group('email')
-    date_str = date_regex.search(lines[2]).group('date')
-    date = datetime.utcfromtimestamp(mktime_tz(parsedate_tz(date_str)))
-    title = title_regex.search(lines[4]).group('title')
-
-    return (author_name, author_email, date, title)
 
-
-def maintainers_inc_history(options, logger, maintplan, layerbranch, repodir, layerdir):
     utils.checkout_layer_branch(layerbranch, repodir, logger=logger)
 
     maintainers_full_path = os.path.join(layerdir, MAINTAINERS_INCLUDE_PATH)
@@ -80,85 +61,123 @@ def maintainers_inc_history(options, logger, maintplan, layerbranch, repodir, la
 
     logger.debug('Checking maintainers.inc history for %s' % layerbranch)
 
-    commits = utils.runcmd(['git', 'log', '--format=%H', '--reverse', '--date=rfc', 'origin/master',
-                        os.path.join(layerbranch.vcs_subdir, MAINTAINERS_INCLUDE_PATH)],
-                        repodir, logger=logger)
+    maintainers_path = os.path.join(layerbranch.vcs_subdir, MAINTAINERS_INCLUDE_PATH)
+    repo = git.Repo(repodir)
+    existing = set(RecipeMaintainerHistory.objects.filter(layerbranch=layerbranch).values_list('sha1', flat=True))
+    commits = [commit for commit in repo.iter_commits('origin/master', paths=maintainers_path, reverse=True)
+               if commit.hexsha not in existing]
 
     no_maintainer, _ = Maintainer.objects.get_or_create(name='No maintainer')
 
+    # Lookups that would otherwise be repeated for every recipe in every commit
+    recipes = list(layerbranch.recipe_set.values_list('pn', 'summary'))
+    recipe_pns = set(pn for pn, _ in recipes)
+    links = list(RecipeMaintenanceLink.objects.all())
+    symbols = {}
+    for rsym in RecipeSymbol.objects.filter(layerbranch=layerbranch):
+        symbols[rsym.pn] = rsym
+    maintainers = {}
+
+    def get_symbol(pn, summary=None):
+        rsym = symbols.get(pn)
+        if not rsym:
+            rsym = RecipeSymbol.symbol(pn, layerbranch, summary=summary)
+            symbols[pn] = rsym
+        return rsym
+
+    def get_maintainer(name, email):
+        m = maintainers.get((name, email))
+        if not m:
+            m = Maintainer.create_or_update(name, email)
+            maintainers[(name, email)] = m
+        return m
+
+    def link_maintainer(pn, assigned):
+        # Equivalent of RecipeMaintenanceLink.link_maintainer() using the
+        # assignments we already have in memory
+        for rml in links:
+            if fnmatch.fnmatch(pn, rml.pn_match) and rml.pn_target in recipe_pns:
+                maintainer_id = assigned.get(rml.pn_target)
+                if maintainer_id:
+                    return rml.pn_target, maintainer_id
+        return None, None
+
+    def fill_missing(assigned, msg):
+        for pn, summary in recipes:
+            if pn in assigned:
+                continue
+            link_pn, maintainer_id = link_maintainer(pn, assigned)
+            if maintainer_id:
+                logger.debug("%s: %slinked to maintainer for %s" % (pn, msg, link_pn))
+            else:
+                maintainer_id = no_maintainer.id
+                logger.debug("%s: %sno maintainer found, set to 'No maintainer'." % (pn, msg))
+            get_symbol(pn, summary)
+            assigned[pn] = maintainer_id
+
+    # Only changes are recorded, so we need to know the current assignments
+    # (by recipe name) to compare against
+    current = {}
+    for pn, maintainer_id in RecipeMaintainer.objects.filter(history__layerbranch=layerbranch, end_date__isnull=True).values_list('recipesymbol__pn', 'maintainer_id'):
+        current[pn] = maintainer_id
+
+    def record_changes(assigned, rms):
+        ended = [symbols[pn].id for pn, maintainer_id in current.items()
+                 if pn in symbols and assigned.get(pn) != maintainer_id]
+        for i in range(0, len(ended), 500):
+            RecipeMaintainer.objects.filter(history__layerbranch=layerbranch,
+                                            recipesymbol_id__in=ended[i:i+500],
+                                            end_date__isnull=True).update(end_date=rms.date)
+        new_rms = []
+        for pn, maintainer_id in assigned.items():
+            if current.get(pn) != maintainer_id:
+                new_rms.append(RecipeMaintainer(recipesymbol=get_symbol(pn),
+                                                maintainer_id=maintainer_id,
+                                                history=rms))
+        RecipeMaintainer.objects.bulk_create(new_rms)
+        logger.debug("Recorded %d maintainer changes in commit %s" % (len(new_rms), rms.sha1))
+
     try:
         with transaction.atomic():
-            for commit in commits.strip().split("\n"):
-                if RecipeMaintainerHistory.objects.filter(layerbranch=layerbranch, sha1=commit):
-                    continue
-
-                logger.debug("Analysing commit %s ..." % (commit))
+            for commit in commits:
+                logger.debug("Analysing commit %s ..." % (commit.hexsha))
 
-                (author_name, author_email, date, title) = \
-                    get_commit_info(utils.runcmd(['git', 'show', commit], repodir,
-                        logger=logger), logger)
-
-                author = Maintainer.create_or_update(author_name, author_email)
-                rms = RecipeMaintainerHistory(title=title, date=date, author=author,
-                        sha1=commit, layerbranch=layerbranch)
+                author = get_maintainer(commit.author.name, commit.author.email)
+                rms = RecipeMaintainerHistory(title=commit.summary[:255],
+                        date=datetime.utcfromtimestamp(commit.authored_date),
+                        author=author, sha1=commit.hexsha, layerbranch=layerbranch)
                 rms.save()
 
-                utils.runcmd(['git', 'checkout', commit, '-f'],
-                        repodir, logger=logger)
-
-                with open(maintainers_full_path, 'r') as f:
-                    for line in f:
-                        line = line.strip()
-                        res = get_recipe_maintainer(line, logger)
-                        if res:
-                            (pn, name, email) = res
-                            m = Maintainer.create_or_update(name, email)
-
-                            rm = RecipeMaintainer()
-                            rm.recipesymbol = RecipeSymbol.symbol(pn, layerbranch)
-                            rm.maintainer = m
-                            rm.history = rms
-                            rm.save()
-
+                # Read the file straight from the commit rather than checking it out
+                try:
+                    data = (commit.tree / maintainers_path).data_stream.read().decode('utf-8', errors='replace')
+                except KeyError:
+                    logger.debug("%s does not exist in commit %s" % (maintainers_path, commit.hexsha))
+                    data = ''
+
+                assigned = {}
+                for line in data.splitlines():
+                    line = line.strip()
+                    res = get_recipe_maintainer(line, logger)
+                    if res:
+                        (pn, name, email) = res
+                        m = get_maintainer(name, email)
+                        assigned[pn] = m.id
+                        if current.get(pn) != m.id:
                             logger.debug("%s: Change maintainer to %s in commit %s." % \
-                                    (pn, m.name, commit))
+                                    (pn, m.name, commit.hexsha))
 
                 # set missing recipes to no maintainer
-                for recipe in layerbranch.recipe_set.all():
-                    if not RecipeMaintainer.objects.filter(recipesymbol__pn=recipe.pn, history=rms):
-                        rm = RecipeMaintainer()
-                        rm.recipesymbol = RecipeSymbol.symbol(recipe.pn, layerbranch, summary=recipe.summary)
-                        link_maintainer = RecipeMaintenanceLink.link_maintainer(recipe.pn, rms)
-                        if link_maintainer:
-                            rm.maintainer = link_maintainer.maintainer
-                        else:
-                            rm.maintainer = no_maintainer
-                        rm.history = rms
-                        rm.save()
-                        if link_maintainer:
-                            logger.debug("%s: linked to maintainer for %s" % (recipe.pn, link_maintainer.recipesymbol.pn))
-                        else:
-                            logger.debug("%s: Not found maintainer in commit %s set to 'No maintainer'." % \
-                                            (recipe.pn, rms.sha1))
+                fill_missing(assigned, '')
+                record_changes(assigned, rms)
+                current = assigned
 
             # set new recipes to no maintainer if don't have one
             rms = RecipeMaintainerHistory.get_last(layerbranch)
-            for recipe in layerbranch.recipe_set.all():
-                if not RecipeMaintainer.objects.filter(recipesymbol__pn=recipe.pn, history=rms):
-                    rm = RecipeMaintainer()
-                    rm.recipesymbol = RecipeSymbol.symbol(recipe.pn, layerbranch, summary=recipe.summary)
-                    link_maintainer = RecipeMaintenanceLink.link_maintainer(recipe.pn, rms)
-                    if link_maintainer:
-                        rm.maintainer = link_maintainer.maintainer
-                    else:
-                        rm.maintainer = no_maintainer
-                    rm.history = rms
-                    rm.save()
-                    if link_maintainer:
-                        logger.debug("%s: New recipe linked to maintainer for %s" % (recipe.pn, link_maintainer.recipesymbol.pn))
-                    else:
-                        logger.debug("%s: New recipe not found maintainer set to 'No maintainer'." % \
-                                    (recipe.pn))
+            if rms:
+                assigned = dict(current)
+                fill_missing(assigned, 'New recipe ')
+                record_changes(assigned, rms)
         if options.dry_run:
             raise DryRunRollbackException
     except DryRunRollbackException:
@@ -203,6 +222,7 @@ def maintainer_history(options, logger):
                     logger.debug('Skipping maintainer processing for %s - plan %s maintainer style is layer-wide' % (layerbranch, maintplan))
                 else:
                     raise Exception('Unknown maintainer style %s for maintenance plan %s' % (maintplan.maintainer_style, maintplan))
+        update_statistics(maintplans, options, logger)
     finally:
         utils.unlock_file(lockfile)
 
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Standalone script which refreshes the precomputed milestone statistics
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+import sys
+import os.path
+import optparse
+import logging
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__))))
+from common import common_setup, get_logger, update_statistics
+common_setup()
+from layerindex import utils
+
+utils.setup_django()
+import settings
+
+from rrs.models import MaintenancePlan
+
+
+def update_plan_statistics(options, logger):
+    if options.plan:
+        maintplans = MaintenancePlan.objects.filter(id=int(options.plan))
+        if not maintplans.exists():
+            logger.error('No maintenance plan with ID %s found' % options.plan)
+            sys.exit(1)
+    else:
+        maintplans = MaintenancePlan.objects.all()
+
+    update_statistics(maintplans, options, logger)
+
+
+if __name__=="__main__":
+    parser = optparse.OptionParser(usage = """%prog [options]""")
+
+    parser.add_option("-p", "--plan",
+            help="Specify maintenance plan to operate on (default is all plans)",
+            action="store", dest="plan", default=None)
+
+    parser.add_option("--fullreload",
+            help="Recalculate statistics for all milestones rather than just recent ones",
+            action="store_true", dest="fullreload", default=False)
+
+    parser.add_option("-d", "--debug",
+            help = "Enable debug output",
+            action="store_const", const=logging.DEBUG, dest="loglevel",
+            default=logging.INFO)
+
+    parser.add_option("--dry-run",
+            help = "Do not write any data back to the database",
+            action="store_true", dest="dry_run", default=False)
+
+    logger = get_logger("StatisticsUpdate", settings)
+    options, args = parser.parse_args(sys.argv)
+    logger.setLevel(options.loglevel)
+
+    update_plan_statistics(options, logger)
@@ -16,10 +16,16 @@ import sys
 import os.path
 import optparse
 import logging
+import tempfile
+import json
+import signal
+import queue
+import collections
+import concurrent.futures
 from datetime import date, datetime, timedelta
 
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__))))
-from common import common_setup, get_logger
+from common import common_setup, get_logger, get_commit_changes, update_statistics
 
 common_setup()
 from layerindex import utils
@@ -42,7 +48,7 @@ bitbakepath = os.path.join(fetchdir, bitbakeitem.get_fetch_dir())
 if getattr(settings, 'BITBAKE_PATH', ''):
     bitbakepath = os.path.join(bitbakepath, settings.BITBAKE_PATH)
 
-def run_internal(maintplanlayerbranch, commit, commitdate, options, logger, bitbake_map, initial=False):
+def get_internal_command(maintplanlayerbranch, commit, commitdate, options, logger, bitbake_map, initial=False):
     from layerindex.models import PythonEnvironment
     from rrs.models import Release
     if commitdate < maintplanlayerbranch.python3_switch_date:
@@ -84,13 +90,149 @@ def run_internal(maintplanlayerbranch, commit, commitdate, options, logger, bitb
         cmd += ' --dry-run'
     if options.loglevel == logging.DEBUG:
         cmd += ' --debug'
+    return cmd
+
+def run_internal(maintplanlayerbranch, commit, commitdate, options, logger, bitbake_map, initial=False, changes=None):
+    cmd = get_internal_command(maintplanlayerbranch, commit, commitdate, options, logger, bitbake_map, initial)
+    changesfn = None
+    if changes is not None:
+        # Pass on the changes we already have so they don't need to be worked out again
+        if not os.path.exists(settings.TEMP_BASE_DIR):
+            os.makedirs(settings.TEMP_BASE_DIR)
+        (changesfd, changesfn) = tempfile.mkstemp('.json', 'upgrade-changes-', settings.TEMP_BASE_DIR)
+        with os.fdopen(changesfd, 'w') as f:
+            json.dump(changes, f)
+        cmd += ' --changes-file %s' % changesfn
     logger.debug('Running %s' % cmd)
-    ret, output = utils.run_command_interruptible(cmd)
+    try:
+        ret, output = utils.run_command_interruptible(cmd)
+    finally:
+        if changesfn:
+            os.remove(changesfn)
     if ret == 254:
         # Interrupted by user, break out of loop
         logger.info('Update interrupted, exiting')
         sys.exit(254)
 
+def get_worktree_repos(layerbranch):
+    """
+    Get the fetch directories of the repositories that need to be checked
+    out in order to analyse a layer's history
+    """
+    from layerindex.models import LayerItem
+    bitbakeitem = LayerItem()
+    bitbakeitem.vcs_url = settings.BITBAKE_REPO_URL
+    urldirs = [bitbakeitem.get_fetch_dir(), layerbranch.layer.get_fetch_dir()]
+    layers = [dep.layer for dep in layerbranch.get_recursive_dependencies()]
+    core_layer = utils.get_layer(settings.CORE_LAYER_NAME)
+    if core_layer:
+        layers.append(core_layer)
+    for layer in layers:
+        urldir = layer.get_fetch_dir()
+        if urldir not in urldirs:
+            urldirs.append(urldir)
+    return [str(urldir) for urldir in urldirs]
+
+def setup_worktrees(layerbranch, count, logger):
+    """
+    Create the specified number of sets of git worktrees for the layer's
+    repository and all of the others needed to parse it, so that commits
+    can be analysed in parallel. Returns a list of directories, each laid
+    out like LAYER_FETCH_DIR.
+    """
+    if not os.path.exists(settings.TEMP_BASE_DIR):
+        os.makedirs(settings.TEMP_BASE_DIR)
+    basedir = tempfile.mkdtemp(prefix='rrs-worktrees-', dir=settings.TEMP_BASE_DIR)
+    worktrees = []
+    for i in range(count):
+        wtfetchdir = os.path.join(basedir, str(i))
+        for urldir in get_worktree_repos(layerbranch):
+            utils.runcmd(['git', 'worktree', 'add', '--detach', os.path.join(wtfetchdir, urldir), 'HEAD'],
+                         os.path.join(fetchdir, urldir), logger=logger)
+        worktrees.append(wtfetchdir)
+    return worktrees
+
+def remove_worktrees(layerbranch, worktrees, logger):
+    if not worktrees:
+        return
+    utils.rmtree_force(os.path.dirname(worktrees[0]))
+    for urldir in get_worktree_repos(layerbranch):
+        utils.runcmd(['git', 'worktree', 'prune'], os.path.join(fetchdir, urldir), logger=logger)
+
+def run_internal_parallel(maintplanbranch, commits, options, logger, bitbake_map, worktrees):
+    """
+    Parse the recipes for each of the specified commits in parallel (using
+    one set of worktrees per job), recording the resulting upgrades in
+    commit order so that each commit sees the upgrades before it
+    """
+    workdir = os.path.join(os.path.dirname(worktrees[0]), 'data')
+    os.makedirs(workdir)
+    free_worktrees = queue.Queue()
+    for worktree in worktrees:
+        free_worktrees.put(worktree)
+
+    def parse_commit(cmd):
+        worktree = free_worktrees.get()
+        try:
+            return utils.run_command_buffered('%s --fetchdir %s' % (cmd, worktree))
+        finally:
+            free_worktrees.put(worktree)
+
+    # Let Ctrl+C be handled by the child processes rather than killing us
+    # while they are still running
+    def sigint_handler(signum, frame):
+        logger.info('Interrupt received, waiting for running jobs to finish')
+    old_handler = signal.signal(signal.SIGINT, sigint_handler)
+    interrupted = False
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(worktrees)) as executor:
+            pending = collections.deque()
+            commit_iter = iter(commits)
+            while True:
+                # Keep a limited number of commits queued up ahead
+                while not interrupted and len(pending) < len(worktrees) * 2:
+                    item = next(commit_iter, None)
+                    if item is None:
+                        break
+                    ct, ctdate, changes = item
+                    changesfn = os.path.join(workdir, '%s-changes.json' % ct)
+                    with open(changesfn, 'w') as f:
+                        json.dump(changes, f)
+                    datafn = os.path.join(workdir, '%s-data.json' % ct)
+                    # (This has to be done here rather than in the thread)
+                    cmd = get_internal_command(maintplanbranch, ct, ctdate, options, logger, bitbake_map)
+                    logger.debug("Analysing commit %s ..." % ct)
+                    future = executor.submit(parse_commit, '%s --changes-file %s --output %s' % (cmd, changesfn, datafn))
+                    pending.append((ct, ctdate, future, '%s --apply %s' % (cmd, datafn), datafn))
+                if not pending:
+                    break
+                ct, ctdate, future, applycmd, datafn = pending.popleft()
+                ret, output = future.result()
+                sys.stdout.write(output)
+                if ret == 254:
+                    interrupted = True
+                if interrupted:
+                    continue
+                if os.path.exists(datafn):
+                    logger.debug("Recording upgrades for commit %s ..." % ct)
+                    ret, output = utils.run_command_buffered(applycmd)
+                    sys.stdout.write(output)
+                    if ret == 254:
+                        interrupted = True
+                        continue
+                    os.remove(datafn)
+                sys.stdout.flush()
+                if not (options.dry_run or options.filter_files):
+                    maintplanbranch.upgrade_rev = ct
+                    maintplanbranch.upgrade_date = ctdate
+                    maintplanbranch.save()
+    finally:
+        signal.signal(signal.SIGINT, old_handler)
+        utils.rmtree_force(workdir)
+    if interrupted:
+        logger.info('Update interrupted, exiting')
+        sys.exit(254)
+
 """
     Upgrade history handler.
 """
@@ -189,16 +331,22 @@ def upgrade_history(options, logger):
                 remap_range('5796ed550d127853808f38257f8dcc8c1cf59342', '547128731e62b36d2271c4390b3fee2b16c535dc')
                 remap_range('a06619951a43acb80b80d92e0caac560657ca249', '2117db3146ce38bb4a6e2df40b6cd2ab11b514d5')
 
-                if options.stop_commit and (options.stop_commit not in [x.split()[0] for x in commit_list]):
-                    logger.error('Stop commit %s is not in repository %s' % (options.stop_commit, repodir))
-                    sys.exit(1)
+                commit_hashes = [x.split()[0] for x in commit_list if x]
+                stop_commits = set()
+                if options.stop_commit:
+                    if options.stop_commit not in commit_hashes:
+                        logger.error('Stop commit %s is not in repository %s' % (options.stop_commit, repodir))
+                        sys.exit(1)
+                    stop_commits = set(commit_hashes[commit_hashes.index(options.stop_commit):])
 
+                initial_commit = None
                 if initial:
                     logger.debug("Adding initial upgrade history ....")
 
                     ct, ctepoch = commit_list.pop(0).split()
                     ctdate = datetime.fromtimestamp(int(ctepoch))
                     run_internal(maintplanbranch, ct, ctdate, options, logger, bitbake_map, initial=True)
+                    initial_commit = ct
 
                 if layerbranch.vcs_subdir:
                     layersubdir_start = layerbranch.vcs_subdir
@@ -207,44 +355,43 @@ def upgrade_history(options, logger):
                 else:
                     layersubdir_start = ''
                 logger.debug("Adding upgrade history from %s to %s ..." % (since, datetime.today().strftime("%Y-%m-%d")))
-                for item in commit_list:
-                    if item:
-                        ct, ctepoch = item.split()
-                        if ct == options.stop_commit:
-                            logger.debug('Stopping at requested commit %s' % ct)
-                            break
-                        ctdate = datetime.fromtimestamp(int(ctepoch))
-                        commitobj = repo.commit(ct)
-                        touches_recipe = False
-                        for parent in commitobj.parents:
-                            diff = parent.diff(commitobj)
-                            for diffitem in diff:
-                                if layersubdir_start and not (diffitem.a_path.startswith(layersubdir_start) or diffitem.b_path.startswith(layersubdir_start)):
-                                    # Not in this layer, skip it
-                                    continue
-                                if options.filter_files and not (diffitem.a_path.startswith(options.filter_files) or diffitem.b_path.startswith(options.filter_files)):
-                                    # Doesn't match path filter
-                                    continue
-                                if diffitem.a_path.endswith(('.bb', '.inc')) or diffitem.b_path.endswith(('.bb', '.inc')):
-                                    # We need to look at this commit
-                                    touches_recipe = True
-                                    break
-                            if touches_recipe:
-                                break
-                        if not touches_recipe:
-                            # No recipes in the layer changed in this commit
-                            # NOTE: Whilst it's possible that a change to a class might alter what's
-                            # in the recipe, we can ignore that since we are only concerned with actual
-                            # upgrades which would always require some sort of change to the recipe
-                            # or an include file, so we can safely skip commits that don't do that
-                            logger.debug("Skipping commit %s" % ct)
+                # Rather than looking at each commit individually, get git to
+                # tell us in one go which commits change recipes or include
+                # files within the layer (and what those changes are).
+                # NOTE: Whilst it's possible that a change to a class might alter what's
+                # in the recipe, we can ignore that since we are only concerned with actual
+                # upgrades which would always require some sort of change to the recipe
+                # or an include file, so we can safely skip commits that don't do that
+                pathspecs = [layersubdir_start + '*.bb', layersubdir_start + '*.inc']
+                def get_recipe_commits():
+                    for ct, ctepoch, changes in get_commit_changes(repodir, since_option, pathspecs, logger):
+                        if ct == initial_commit:
                             continue
+                        if ct in stop_commits:
+                            logger.debug('Stopping at requested commit %s' % options.stop_commit)
+                            break
+                        if options.filter_files:
+                            if not [change for change in changes if change[1].startswith(options.filter_files) or change[2].startswith(options.filter_files)]:
+                                # Doesn't match path filter
+                                logger.debug("Skipping commit %s" % ct)
+                                continue
+                        yield ct, datetime.fromtimestamp(int(ctepoch)), changes
+
+                if options.jobs > 1:
+                    worktrees = setup_worktrees(layerbranch, options.jobs, logger)
+                    try:
+                        run_internal_parallel(maintplanbranch, get_recipe_commits(), options, logger, bitbake_map, worktrees)
+                    finally:
+                        remove_worktrees(layerbranch, worktrees, logger)
+                else:
+                    for ct, ctdate, changes in get_recipe_commits():
                         logger.debug("Analysing commit %s ..." % ct)
-                        run_internal(maintplanbranch, ct, ctdate, options, logger, bitbake_map)
+                        run_internal(maintplanbranch, ct, ctdate, options, logger, bitbake_map, changes=changes)
                         if not (options.dry_run or options.filter_files):
                             maintplanbranch.upgrade_rev = ct
                             maintplanbranch.upgrade_date = ctdate
                             maintplanbranch.save()
+        update_statistics(maintplans, options, logger)
     finally:
         utils.unlock_file(lockfile)
 
@@ -285,6 +432,10 @@ if __name__=="__main__":
             help="Only operate on a specified subset of files (filepath 'startswith')",
             action="store", dest="filter_files", default='')
 
+    parser.add_option("-j", "--jobs",
+            help="Number of commits to parse in parallel, each in its own set of git worktrees (default 1)",
+            type="int", action="store", dest="jobs", default=1)
+
     parser.add_option("--regroup",
             help="Re-group records only",
             action="store_true", dest="regroup", default=False)
@@ -179,8 +179,8 @@ def main():
                 if recipe_upstream_query and recipe_upstream_query[0].status == 'N':
                     recipes[recipe] = {}
 
-                    recipe_maintainer = RecipeMaintainer.objects.filter(recipesymbol__pn =
-                            recipe.pn, history = recipe_maintainer_history)[0]
+                    recipe_maintainer = RecipeMaintainer.get_by_history(recipe_maintainer_history
+                            ).filter(recipesymbol__pn = recipe.pn)[0]
                     recipes[recipe]['maintainer'] = recipe_maintainer
                     recipes[recipe]['upstream'] = recipe_upstream_query[0]
 
@@ -13,11 +13,14 @@ import sys
 import os.path
 import optparse
 import logging
-from datetime import datetime
+import socket
+import urllib.parse
+from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__))))
-from common import common_setup, load_recipes, \
-        get_pv_type, get_logger, DryRunRollbackException
+from common import common_setup, load_recipe_data, \
+        get_pv_type, get_logger, DryRunRollbackException, \
+        ConcurrentChecker, serialise_tinfoil_commands, update_statistics
 common_setup()
 from layerindex import utils
 
@@ -42,58 +45,89 @@ if getattr(settings, 'BITBAKE_PATH', ''):
 
 sys.path.insert(0, os.path.join(bitbakepath, 'lib'))
 
-from layerindex.models import Recipe, LayerBranch
+from layerindex.models import Recipe, LayerBranch, truncate_charfield_values
 from rrs.models import RecipeUpstream, RecipeUpstreamHistory, MaintenancePlan, RecipeSymbol
 
-def set_regexes(d):
-    """
-        Utility function to set regexes to SPECIAL_PKGSUFFIX packages
-        that don't have set it.
-
-        For example: python-native use regex from python if don't have
-        one set it.
-    """
-
-    variables = ('UPSTREAM_CHECK_REGEX', 'UPSTREAM_CHECK_URI', 'UPSTREAM_CHECK_GITTAGREGEX')
-
-    if any(d.getVar(var, True) for var in variables):
-        return
+# Number of upstream results to insert per query
+UPSTREAM_WRITE_BATCH_SIZE = 500
 
-    suffixes = d.getVar('SPECIAL_PKGSUFFIX', True).split()
-    prefixes = ['nativesdk-']
+# Variables that determine the result of an upstream version check
+UPSTREAM_CHECK_KEY_VARS = ['PV', 'SRC_URI', 'SRCREV', 'UPSTREAM_CHECK_URI',
+        'UPSTREAM_CHECK_REGEX', 'UPSTREAM_CHECK_GITTAGREGEX',
+        'UPSTREAM_CHECK_COMMITS', 'UPSTREAM_VERSION_UNKNOWN',
+        'RECIPE_UPSTREAM_VERSION', 'RECIPE_UPSTREAM_DATE']
 
-    special = list(suffixes)
-    special.extend(prefixes)
-
-    localdata = bb.data.createCopy(d)
-    pn = localdata.getVar('PN', True)
-    for s in special:
-        if pn.find(s) != -1:
-            if s in suffixes:
-                pnstripped = pn.split(s)[0]
-            else:
-                pnstripped = pn.replace(s, '')
-
-            localdata.setVar('OVERRIDES', "pn-" + pnstripped + ":" +
-                    d.getVar('OVERRIDES', True))
-            try:
-                bb.data.update_data(localdata)
-            except AttributeError:
-                pass
+def get_upstream_check_key(recipe_data):
+    """
+        Get a hash of the values affecting the upstream version check
+        for a recipe, so that the result can be reused if they haven't
+        changed since it was last checked.
+    """
+    import hashlib
 
-            for var in variables:
-                new_value = localdata.getVar(var, True)
-                if new_value is None:
-                    continue
+    h = hashlib.sha256()
+    for var in UPSTREAM_CHECK_KEY_VARS:
+        try:
+            value = recipe_data.getVar(var, True)
+        except Exception:
+            value = recipe_data.getVar(var, False)
+        h.update(('%s=%s\n' % (var, value or '')).encode('utf-8'))
+    return h.hexdigest()
 
-                d.setVar(var, new_value)
-                logger.debug("%s: %s new value %s" % (pn, var,
-                    d.getVar(var, True)))
-            break
+def get_upstream_host(recipe_data):
+    """
+        Get the name of the host that will be contacted to check the
+        upstream version of a recipe (or '' if there isn't one).
+    """
+    uri = recipe_data.getVar('UPSTREAM_CHECK_URI', True)
+    if not uri:
+        src_uri = (recipe_data.getVar('SRC_URI', True) or '').split()
+        if not src_uri:
+            return ''
+        uri = src_uri[0]
+    return urllib.parse.urlparse(uri.split(';')[0]).hostname or ''
+
+def check_upstream_version(recipe_data):
+    from oe.recipeutils import get_recipe_upstream_version
+    return get_recipe_upstream_version(recipe_data)
 
-def get_upstream_info(layerbranch, recipe_data, result):
+def get_cached_upstream_info(layerbranch):
+    """
+        Get the results of upstream version checks actually performed
+        within the last RRS_UPSTREAM_CHECK_CACHE_HOURS, by check key.
+    """
+    cache = {}
+    hours = getattr(settings, 'RRS_UPSTREAM_CHECK_CACHE_HOURS', 0)
+    if not hours:
+        return cache
+    cutoff = datetime.now() - timedelta(hours=hours)
+    qry = RecipeUpstream.objects.filter(history__layerbranch=layerbranch,
+            history__start_date__gte=cutoff).exclude(check_key='') \
+            .order_by('history__start_date')
+    for check_key, version, rtype, date in qry.values_list('check_key', 'version', 'type', 'date'):
+        cache[check_key] = {'version': version, 'type': rtype, 'datetime': date}
+    return cache
+
+def add_missing_upstream(layerbranch, history, result, logger):
+    """
+    Record the upstream status as unknown for any recipes shown in the
+    recipe list that didn't get a result (e.g. because they failed to parse)
+    """
+    from rrs.views import Raw
+
+    checked = set(ru.recipesymbol_id for ru in result)
+    missing = []
+    for recipe in Raw.get_reupg_by_date(layerbranch.id, history.end_date):
+        if recipe['id'] not in checked:
+            missing.append(RecipeUpstream(recipesymbol_id=recipe['id'],
+                    history=history, version='', type='M', status='U',
+                    no_update_reason='', date=history.end_date))
+    if missing:
+        logger.debug('%s: recording unknown upstream status for %d recipes without results' % (layerbranch, len(missing)))
+        RecipeUpstream.objects.bulk_create(missing, batch_size=UPSTREAM_WRITE_BATCH_SIZE)
+
+def get_upstream_info(symbols, recipe_data, ru_info, check_key, result):
     from bb.utils import vercmp_string
-    from oe.recipeutils import get_recipe_upstream_version
     try:
         from oe.recipeutils import get_recipe_pv_without_srcpv
     except ImportError:
@@ -102,16 +136,9 @@ def get_upstream_info(layerbranch, recipe_data, result):
     pn = recipe_data.getVar('PN', True)
 
     ru = RecipeUpstream()
-    summary = recipe_data.getVar('SUMMARY', True) or recipe_data.getVar('DESCRIPTION', True)
-    ru.recipesymbol = RecipeSymbol.symbol(pn, layerbranch, summary=summary)
+    ru.recipesymbol = symbols[pn]
     recipe_pv = recipe_data.getVar('PV', True)
-
-    ru_info = None
-    try:
-        ru_info = get_recipe_upstream_version(recipe_data)
-    except Exception as e:
-        logger.exception("%s: in layer branch %s, %s" % (pn,
-            str(layerbranch), str(e)))
+    ru.check_key = check_key
 
     if ru_info is not None and ru_info['version']:
         ru.version = ru_info['version']
@@ -170,6 +197,26 @@ if __name__=="__main__":
             help = "Recipe IDs to operate on",
             action="store", dest="recipe", default=None)
 
+    parser.add_option("-j", "--jobs",
+            help = "Number of upstream checks to run concurrently (default %default)",
+            type="int", action="store", dest="jobs", default=8)
+
+    parser.add_option("--host-jobs",
+            help = "Maximum number of concurrent upstream checks against any one host (default %default)",
+            type="int", action="store", dest="host_jobs", default=2)
+
+    parser.add_option("--timeout",
+            help = "Give up checking the upstream version of a recipe after this many seconds (default %default)",
+            type="int", action="store", dest="timeout", default=300)
+
+    parser.add_option("--recheck",
+            help = "Check all recipes, ignoring the results of recent checks",
+            action="store_true", dest="recheck", default=False)
+
+    parser.add_option("--reparse",
+            help="Parse all recipes rather than using the values collected by the last layer update",
+            action="store_true", dest="reparse", default=False)
+
     options, args = parser.parse_args(sys.argv)
     logger.setLevel(options.loglevel)
 
@@ -186,6 +233,9 @@ if __name__=="__main__":
 
     logger.debug("Starting upstream history...")
 
+    # Ensure that network operations within the checks can't block forever
+    socket.setdefaulttimeout(options.timeout)
+
     lockfn = os.path.join(fetchdir, "layerindex.lock")
     lockfile = utils.lock_file(lockfn)
     if not lockfile:
@@ -201,22 +251,13 @@ if __name__=="__main__":
                     with transaction.atomic():
                         sys.path = origsyspath
 
-                        layer = layerbranch.layer
-                        urldir = layer.get_fetch_dir()
-                        repodir = os.path.join(fetchdir, urldir)
-                        layerdir = os.path.join(repodir, layerbranch.vcs_subdir)
-
-                        recipe_files = []
                         if options.recipe:
                             recipe_qry = layerbranch.recipe_set.filter(id__in=options.recipe.split(','))
                         else:
                             recipe_qry = layerbranch.recipe_set.all()
-                        for recipe in recipe_qry:
-                            file = str(os.path.join(layerdir, recipe.full_path()))
-                            recipe_files.append(file)
 
-                        (tinfoil, d, recipes, tempdir) = load_recipes(layerbranch, bitbakepath,
-                                fetchdir, settings, logger,  recipe_files=recipe_files)
+                        (tinfoil, d, recipes, tempdir) = load_recipe_data(layerbranch, bitbakepath,
+                                fetchdir, settings, logger, recipe_qry, reparse=options.reparse)
                         try:
 
                             if not recipes:
@@ -224,18 +265,57 @@ if __name__=="__main__":
 
                             utils.setup_core_layer_sys_path(settings, layerbranch.branch.name)
 
-                            for recipe_data in recipes:
-                                set_regexes(recipe_data)
-
                             history = RecipeUpstreamHistory(layerbranch=layerbranch, start_date=datetime.now())
 
+                            if options.recheck:
+                                cache = {}
+                            else:
+                                cache = get_cached_upstream_info(layerbranch)
+
+                            summaries = {}
+                            for recipe_data in recipes:
+                                pn = recipe_data.getVar('PN', True)
+                                summaries.setdefault(pn, recipe_data.getVar('SUMMARY', True) or recipe_data.getVar('DESCRIPTION', True))
+                            symbols = RecipeSymbol.symbols(layerbranch, summaries)
+
                             result = []
+                            # Recipes sharing the same check values (e.g.
+                            # native variants) only need to be checked once
+                            checks = {}
                             for recipe_data in recipes:
-                                try:
-                                    get_upstream_info(layerbranch, recipe_data, result)
-                                except:
-                                    import traceback
-                                    traceback.print_exc()
+                                check_key = get_upstream_check_key(recipe_data)
+                                if check_key in cache:
+                                    # Don't set the key on the new record, so
+                                    # the result expires from when it was
+                                    # actually checked
+                                    try:
+                                        get_upstream_info(symbols, recipe_data, cache[check_key], '', result)
+                                    except:
+                                        import traceback
+                                        traceback.print_exc()
+                                else:
+                                    checks.setdefault(check_key, []).append(recipe_data)
+                            logger.debug('%s: %d recipes to check upstream, %d reusing recent results' %
+                                    (layerbranch, sum(len(v) for v in checks.values()), len(result)))
+
+                            serialise_tinfoil_commands(tinfoil)
+                            checker = ConcurrentChecker(lambda item: check_upstream_version(item[1]), jobs=options.jobs,
+                                    host_jobs=options.host_jobs, timeout=options.timeout)
+                            items = [(get_upstream_host(rds[0]), (check_key, rds[0]))
+                                     for check_key, rds in checks.items()]
+                            for (check_key, recipe_data), ru_info, error in checker.run(items):
+                                if error:
+                                    pn = recipe_data.getVar('PN', True)
+                                    logger.error("%s: in layer branch %s, %s" % (pn, str(layerbranch), str(error)),
+                                            exc_info=None if isinstance(error, TimeoutError) else error)
+                                for rd in checks[check_key]:
+                                    try:
+                                        # Don't allow failed checks to be reused
+                                        get_upstream_info(symbols, rd, ru_info,
+                                                '' if error else check_key, result)
+                                    except:
+                                        import traceback
+                                        traceback.print_exc()
 
                             history.end_date = datetime.now()
                             history.save()
@@ -243,9 +323,10 @@ if __name__=="__main__":
                             logger.debug('Results for layerbranch %s:' % str(layerbranch))
                             for ru in result:
                                 ru.history = history
-                                ru.save()
-
+                                truncate_charfield_values(RecipeUpstream, ru)
                                 logger.debug(str(ru))
+                            RecipeUpstream.objects.bulk_create(result, batch_size=UPSTREAM_WRITE_BATCH_SIZE)
+                            add_missing_upstream(layerbranch, history, result, logger)
 
                         finally:
                             tinfoil.shutdown()
@@ -254,5 +335,6 @@ if __name__=="__main__":
                             raise DryRunRollbackException
                 except DryRunRollbackException:
                     pass
+        update_statistics(maintplans, options, logger)
     finally:
         utils.unlock_file(lockfile)
@@ -20,6 +20,8 @@ from packaging_legacy.version import parse as parse_version
 import git
 from datetime import datetime
 import calendar
+import json
+from collections import namedtuple
 from email.utils import parsedate_tz
 
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__))))
@@ -295,10 +297,27 @@ def _create_upgrade(recipe_data, layerbranch, ct, title, info, filepath, logger,
                             " in ct %s: %s" % (pn, prev_pv, pv, ct, str(e)))
 
 
+ChangedFile = namedtuple('ChangedFile', 'a_path b_path new_file deleted_file')
+
+"""
+    Returns the files changed by a commit, either from a list of
+    (status, a_path, b_path) as written out by rrs_upgrade_history.py
+    or by diffing against each parent.
+"""
+def _get_commit_changes(ct, repo, changes=None):
+    if changes is not None:
+        for status, a_path, b_path in changes:
+            yield ChangedFile(a_path, b_path, status == 'A', status == 'D')
+        return
+    commitobj = repo.commit(ct)
+    for parent in commitobj.parents:
+        for diffitem in parent.diff(commitobj):
+            yield diffitem
+
 """
     Returns a list containing the fullpaths to the recipes from a commit.
 """
-def _get_recipes_filenames(ct, repo, repodir, layersubdir_start, logger):
+def _get_recipes_filenames(ct, repo, repodir, layersubdir_start, logger, changes=None):
     import glob
     ct_files = []
     deleted = []
@@ -306,39 +325,36 @@ def _get_recipes_filenames(ct, repo, repodir, layersubdir_start, logger):
     added_files = []
 
     incdirs = []
-    commitobj = repo.commit(ct)
-    for parent in commitobj.parents:
-        diff = parent.diff(commitobj)
-        for diffitem in diff:
-            if layersubdir_start and not (diffitem.a_path.startswith(layersubdir_start) or diffitem.b_path.startswith(layersubdir_start)):
-                # Not in this layer, skip it
-                continue
-            if diffitem.a_path.startswith(layersubdir_start + 'lib/') or diffitem.b_path.startswith(layersubdir_start + 'lib/'):
-                # A little bit hacky, but we pick up templates otherwise
-                continue
+    for diffitem in _get_commit_changes(ct, repo, changes):
+        if layersubdir_start and not (diffitem.a_path.startswith(layersubdir_start) or diffitem.b_path.startswith(layersubdir_start)):
+            # Not in this layer, skip it
+            continue
+        if diffitem.a_path.startswith(layersubdir_start + 'lib/') or diffitem.b_path.startswith(layersubdir_start + 'lib/'):
+            # A little bit hacky, but we pick up templates otherwise
+            continue
+
+        (typename, _, _) = recipeparse.detect_file_type(diffitem.a_path,
+                                    layersubdir_start)
+
+        if not diffitem.b_path or diffitem.deleted_file or not diffitem.b_path.startswith(layersubdir_start):
+            # Deleted, or moved out of the layer (which we treat as a delete)
+            if typename == 'recipe':
+                deleted.append(diffitem.a_path)
+            continue
 
-            (typename, _, _) = recipeparse.detect_file_type(diffitem.a_path,
+        if typename == 'recipe':
+            (to_typename, _, _) = recipeparse.detect_file_type(diffitem.b_path,
                                         layersubdir_start)
-
-            if not diffitem.b_path or diffitem.deleted_file or not diffitem.b_path.startswith(layersubdir_start):
-                # Deleted, or moved out of the layer (which we treat as a delete)
-                if typename == 'recipe':
-                    deleted.append(diffitem.a_path)
-                continue
-
-            if typename == 'recipe':
-                (to_typename, _, _) = recipeparse.detect_file_type(diffitem.b_path,
-                                            layersubdir_start)
-                if to_typename == 'recipe':
-                    ct_files.append(os.path.join(repodir, diffitem.b_path))
-                    if diffitem.a_path is None or diffitem.new_file:
-                        added_files.append(diffitem.b_path)
-                if diffitem.a_path != diffitem.b_path:
-                    moved_files.append((diffitem.a_path, diffitem.b_path))
-            elif typename == 'incfile':
-                fpath = os.path.dirname(os.path.join(repodir, diffitem.a_path))
-                if not fpath in incdirs:
-                    incdirs.append(fpath)
+            if to_typename == 'recipe':
+                ct_files.append(os.path.join(repodir, diffitem.b_path))
+                if diffitem.a_path is None or diffitem.new_file:
+                    added_files.append(diffitem.b_path)
+            if diffitem.a_path != diffitem.b_path:
+                moved_files.append((diffitem.a_path, diffitem.b_path))
+        elif typename == 'incfile':
+            fpath = os.path.dirname(os.path.join(repodir, diffitem.a_path))
+            if not fpath in incdirs:
+                incdirs.append(fpath)
 
     for fpath in incdirs:
         # Let's just assume that all .bb files next to a .inc need to be checked
@@ -359,6 +375,16 @@ def _get_recipes_filenames(ct, repo, repodir, layersubdir_start, logger):
     return ct_files, deleted, moved_files
 
 
+def get_bitbake_path(fetchdir):
+    from layerindex.models import LayerItem
+    bitbakeitem = LayerItem()
+    bitbakeitem.vcs_url = settings.BITBAKE_REPO_URL
+    bitbakepath = os.path.join(fetchdir, bitbakeitem.get_fetch_dir())
+    if getattr(settings, 'BITBAKE_PATH', ''):
+        bitbakepath = os.path.join(bitbakepath, settings.BITBAKE_PATH)
+    return bitbakepath
+
+
 def checkout_layer_deps(layerbranch, commit, fetchdir, logger):
     """ Check out the repositories for a layer and its dependencies """
 
@@ -405,11 +431,24 @@ def checkout_layer_deps(layerbranch, commit, fetchdir, logger):
     return commitdate
 
 
-def generate_history(options, layerbranch_id, commit, logger):
-    from layerindex.models import LayerBranch
-    from rrs.models import Release, RecipeUpgrade
-    layerbranch = LayerBranch.objects.get(id=layerbranch_id)
+# Variables we need from each parsed recipe in order to record upgrades
+RECIPE_VARS = ['FILE', 'PN', 'PV', 'SRCREV', 'LICENSE', 'SUMMARY', 'DESCRIPTION']
 
+class RecipeValues(dict):
+    """
+    Values extracted from a parsed recipe, accessible via getVar() like
+    the datastore they came from
+    """
+    def getVar(self, var, expand=True):
+        return self.get(var)
+
+
+def collect_history_data(options, layerbranch, commit, logger):
+    """
+    Check out the specified commit, parse the recipes it changes and
+    return the data needed to record upgrades for it (or None if there is
+    nothing to record)
+    """
     fetchdir = settings.LAYER_FETCH_DIR
     if not fetchdir:
         logger.error("Please set LAYER_FETCH_DIR in settings.py")
@@ -418,7 +457,6 @@ def generate_history(options, layerbranch_id, commit, logger):
     layer = layerbranch.layer
     urldir = str(layer.get_fetch_dir())
     repodir = os.path.join(fetchdir, urldir)
-    layerdir = os.path.join(repodir, str(layerbranch.vcs_subdir))
 
     if layerbranch.vcs_subdir:
         layersubdir_start = layerbranch.vcs_subdir
@@ -443,18 +481,17 @@ def generate_history(options, layerbranch_id, commit, logger):
             filepath_start = options.filter_files
         else:
             filepath_start = layersubdir_start
-        fns, deleted, moved = _get_recipes_filenames(commit, repo, repodir, filepath_start, logger)
+        if options.changes_file:
+            with open(options.changes_file, 'r') as f:
+                changes = json.load(f)
+        else:
+            changes = None
+        fns, deleted, moved = _get_recipes_filenames(commit, repo, repodir, filepath_start, logger, changes)
         if not (fns or deleted or moved):
-            return
+            return None
 
     # setup bitbake
-    from layerindex.models import LayerItem
-    bitbakeitem = LayerItem()
-    bitbakeitem.vcs_url = settings.BITBAKE_REPO_URL
-    bitbakepath = os.path.join(fetchdir, bitbakeitem.get_fetch_dir())
-    if getattr(settings, 'BITBAKE_PATH', ''):
-        bitbakepath = os.path.join(bitbakepath, settings.BITBAKE_PATH)
-
+    bitbakepath = get_bitbake_path(fetchdir)
     if options.bitbake_rev:
         bitbake_rev = options.bitbake_rev
         if not re.match('^[0-9a-f]{40}$', bitbake_rev):
@@ -469,7 +506,6 @@ def generate_history(options, layerbranch_id, commit, logger):
                         fetchdir, settings, logger, recipe_files=fns,
                         nocheckout=True)
     try:
-
         if options.initial:
             title = options.initial
             info = 'No maintainer;;' + utils.runcmd(['git', 'log', '--format=%ad;%cd', '--date=rfc', '-n', '1', commit], destdir=repodir, logger=logger)
@@ -480,96 +516,161 @@ def generate_history(options, layerbranch_id, commit, logger):
             info = utils.runcmd(['git', 'log', '--format=%an;%ae;%ad;%cd', '--date=rfc', '-n', '1', commit], destdir=repodir, logger=logger)
             recordcommit = commit
 
-        fn_data = {}
+        recipe_values = []
         for recipe_data in recipes:
-            fn = os.path.relpath(recipe_data.getVar('FILE', True), repodir)
-            fn_data[fn] = recipe_data
+            try:
+                values = {var: recipe_data.getVar(var, True) for var in RECIPE_VARS}
+            except Exception as e:
+                logger.error("%s: unable to get values for %s: %s" % (layerbranch, recipe_data.getVar('FILE', True), str(e)))
+                continue
+            # Paths need to be relative since the data may be used with a different checkout
+            values['FILE'] = os.path.relpath(values['FILE'], repodir)
+            recipe_values.append(values)
+    finally:
+        if tinfoil and hasattr(tinfoil, 'shutdown') and (parse_version(bb.__version__) > parse_version("1.27")):
+            tinfoil.shutdown()
+        utils.rmtree_force(tempdir)
 
-        seen_pns = []
+    return {
+        'commit': commit,
+        'recordcommit': recordcommit,
+        'title': title,
+        'info': info,
+        'deleted': deleted,
+        'moved': moved,
+        'recipes': recipe_values,
+    }
+
+
+def apply_history_data(options, layerbranch, data, logger):
+    """
+    Record upgrades in the database from data returned by collect_history_data()
+    """
+    from rrs.models import RecipeUpgrade
+
+    repodir = os.path.join(settings.LAYER_FETCH_DIR, str(layerbranch.layer.get_fetch_dir()))
+    repo = git.Repo(repodir)
+    commit_tree = repo.commit(data['commit']).tree
+    def exists_in_commit(path):
+        # The working tree may not be at this commit, so look at git's view instead
         try:
-            with transaction.atomic():
-                # Handle recipes where PN has changed
+            commit_tree[path]
+        except KeyError:
+            return False
+        return True
+
+    recordcommit = data['recordcommit']
+    title = data['title']
+    info = data['info']
+    deleted = data['deleted']
+    moved = [tuple(item) for item in data['moved']]
+    recipes = [RecipeValues(values) for values in data['recipes']]
+
+    fn_data = {}
+    for recipe_data in recipes:
+        fn_data[recipe_data.getVar('FILE', True)] = recipe_data
+
+    seen_pns = []
+    try:
+        with transaction.atomic():
+            # Handle recipes where PN has changed
+            for a, b in moved:
+                logger.debug('Move %s -> %s' % (a,b))
+                rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=a).order_by('-commit_date', '-id')
+                recipe_data = fn_data.get(b, None)
+                if recipe_data:
+                    pn = recipe_data.getVar('PN', True)
+                    ru = rus.first()
+                    if ru and ru.recipesymbol.pn != pn:
+                        # PN has been changed! We need to mark the old record as deleted
+                        logger.debug('PN changed (with move): %s -> %s' % (ru.recipesymbol.pn, pn))
+                        if a not in deleted:
+                            deleted.append(a)
+                else:
+                    logger.warning('Unable to find parsed data for recipe %s' % b)
+
+            # Handle recipes that exist at this point in time (which may have upgraded)
+            for recipe_data in recipes:
+                pn = recipe_data.getVar('PN', True)
+                filepath = recipe_data.getVar('FILE', True)
+                # Check if PN has changed internally
+                rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=filepath).order_by('-commit_date', '-id')
+                deleted_pns = rus.filter(upgrade_type__in=['R', 'N']).values_list('recipesymbol__pn', flat=True).distinct()
+                for ru in rus:
+                    if ru.recipesymbol.pn != pn and ru.recipesymbol.pn not in deleted_pns and ru.upgrade_type not in ['R', 'N']:
+                        # PN changed (set within recipe), we need to mark the old recipe as deleted
+                        logger.debug('PN changed (without move): %s -> %s' % (ru.recipesymbol.pn, pn))
+                        _save_upgrade(ru.recipesymbol, layerbranch, ru.version, ru.srcrev, ru.license, recordcommit, title, info, ru.filepath, logger, upgrade_type='R')
+                orig_filepath = None
                 for a, b in moved:
-                    logger.debug('Move %s -> %s' % (a,b))
+                    if b == filepath:
+                        orig_filepath = a
+                        break
+                _create_upgrade(recipe_data, layerbranch, recordcommit, title,
+                        info, filepath, logger, initial=options.initial, orig_filepath=orig_filepath)
+                seen_pns.append(pn)
+
+            # Handle recipes that have been moved without it being an upgrade/delete
+            for a, b in moved:
+                if a not in deleted:
                     rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=a).order_by('-commit_date', '-id')
-                    recipe_data = fn_data.get(b, None)
-                    if recipe_data:
-                        pn = recipe_data.getVar('PN', True)
+                    if rus:
                         ru = rus.first()
-                        if ru and ru.recipesymbol.pn != pn:
-                            # PN has been changed! We need to mark the old record as deleted
-                            logger.debug('PN changed (with move): %s -> %s' % (ru.recipesymbol.pn, pn))
-                            if a not in deleted:
-                                deleted.append(a)
-                    else:
-                        logger.warning('Unable to find parsed data for recipe %s' % b)
-
-                # Handle recipes that exist at this point in time (which may have upgraded)
-                for recipe_data in recipes:
-                    pn = recipe_data.getVar('PN', True)
-                    filepath = os.path.relpath(recipe_data.getVar('FILE', True), repodir)
-                    # Check if PN has changed internally
-                    rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=filepath).order_by('-commit_date', '-id')
-                    deleted_pns = rus.filter(upgrade_type__in=['R', 'N']).values_list('recipesymbol__pn', flat=True).distinct()
-                    for ru in rus:
-                        if ru.recipesymbol.pn != pn and ru.recipesymbol.pn not in deleted_pns and ru.upgrade_type not in ['R', 'N']:
-                            # PN changed (set within recipe), we need to mark the old recipe as deleted
-                            logger.debug('PN changed (without move): %s -> %s' % (ru.recipesymbol.pn, pn))
-                            _save_upgrade(ru.recipesymbol, layerbranch, ru.version, ru.srcrev, ru.license, recordcommit, title, info, ru.filepath, logger, upgrade_type='R')
-                    orig_filepath = None
-                    for a, b in moved:
-                        if b == filepath:
-                            orig_filepath = a
+                        if not RecipeUpgrade.objects.filter(recipesymbol=ru.recipesymbol, filepath=b).exists():
+                            # Need to record the move, otherwise we won't be able to
+                            # find the record if we need to mark the recipe as deleted later
+                            _save_upgrade(ru.recipesymbol, layerbranch, ru.version, ru.srcrev, ru.license, recordcommit, title, info, b, logger, upgrade_type='M', orig_filepath=a)
+
+            # Handle deleted recipes
+            for df in deleted:
+                rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=df).order_by('-commit_date', '-id')
+                for ru in rus:
+                    other_rus = RecipeUpgrade.objects.filter(recipesymbol=ru.recipesymbol, commit_date__gte=ru.commit_date).exclude(filepath=df).order_by('-commit_date', '-id')
+                    # We make a distinction between deleting just one version and the entire recipe being deleted
+                    upgrade_type = 'R'
+                    for other_ru in other_rus:
+                        if other_ru.upgrade_type == 'R':
+                            logger.debug('There is a delete: %s' % other_ru)
+                            upgrade_type = ''
                             break
-                    _create_upgrade(recipe_data, layerbranch, recordcommit, title,
-                            info, filepath, logger, initial=options.initial, orig_filepath=orig_filepath)
-                    seen_pns.append(pn)
+                        if exists_in_commit(other_ru.filepath):
+                            upgrade_type = 'N'
+                    if not upgrade_type:
+                        continue
+                    if ru.upgrade_type != upgrade_type and ru.recipesymbol.pn not in seen_pns:
+                        if upgrade_type == 'R':
+                            finalmsg = ' [FINAL]'
+                        else:
+                            finalmsg = ''
+                        logger.debug("%s: marking as deleted%s (%s)" % (ru.recipesymbol.pn, finalmsg, ru.filepath))
+                        _save_upgrade(ru.recipesymbol, layerbranch, ru.version, ru.srcrev, ru.license, recordcommit, title, info, df, logger, upgrade_type=upgrade_type)
+                        break
+
+            if options.dry_run:
+                raise DryRunRollbackException
+    except DryRunRollbackException:
+        pass
 
-                # Handle recipes that have been moved without it being an upgrade/delete
-                for a, b in moved:
-                    if a not in deleted:
-                        rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=a).order_by('-commit_date', '-id')
-                        if rus:
-                            ru = rus.first()
-                            if not RecipeUpgrade.objects.filter(recipesymbol=ru.recipesymbol, filepath=b).exists():
-                                # Need to record the move, otherwise we won't be able to
-                                # find the record if we need to mark the recipe as deleted later
-                                _save_upgrade(ru.recipesymbol, layerbranch, ru.version, ru.srcrev, ru.license, recordcommit, title, info, b, logger, upgrade_type='M', orig_filepath=a)
-
-                # Handle deleted recipes
-                for df in deleted:
-                    rus = RecipeUpgrade.objects.filter(recipesymbol__layerbranch=layerbranch, filepath=df).order_by('-commit_date', '-id')
-                    for ru in rus:
-                        other_rus = RecipeUpgrade.objects.filter(recipesymbol=ru.recipesymbol, commit_date__gte=ru.commit_date).exclude(filepath=df).order_by('-commit_date', '-id')
-                        # We make a distinction between deleting just one version and the entire recipe being deleted
-                        upgrade_type = 'R'
-                        for other_ru in other_rus:
-                            if other_ru.upgrade_type == 'R':
-                                logger.debug('There is a delete: %s' % other_ru)
-                                upgrade_type = ''
-                                break
-                            if os.path.exists(os.path.join(repodir, other_ru.filepath)):
-                                upgrade_type = 'N'
-                        if not upgrade_type:
-                            continue
-                        if ru.upgrade_type != upgrade_type and ru.recipesymbol.pn not in seen_pns:
-                            if upgrade_type == 'R':
-                                finalmsg = ' [FINAL]'
-                            else:
-                                finalmsg = ''
-                            logger.debug("%s: marking as deleted%s (%s)" % (ru.recipesymbol.pn, finalmsg, ru.filepath))
-                            _save_upgrade(ru.recipesymbol, layerbranch, ru.version, ru.srcrev, ru.license, recordcommit, title, info, df, logger, upgrade_type=upgrade_type)
-                            break
 
-                if options.dry_run:
-                    raise DryRunRollbackException
-        except DryRunRollbackException:
-            pass
+def generate_history(options, layerbranch_id, commit, logger):
+    from layerindex.models import LayerBranch
+    layerbranch = LayerBranch.objects.get(id=layerbranch_id)
 
-    finally:
-        if tinfoil and hasattr(tinfoil, 'shutdown') and (parse_version(bb.__version__) > parse_version("1.27")):
-            tinfoil.shutdown()
-        utils.rmtree_force(tempdir)
+    if options.apply:
+        # Recipes have already been parsed (see rrs_upgrade_history.py -j)
+        with open(options.apply, 'r') as f:
+            data = json.load(f)
+        # We still need bitbake for version comparison
+        sys.path.insert(0, os.path.join(get_bitbake_path(settings.LAYER_FETCH_DIR), 'lib'))
+    else:
+        data = collect_history_data(options, layerbranch, commit, logger)
+        if options.output:
+            if data:
+                with open(options.output, 'w') as f:
+                    json.dump(data, f)
+            return
+    if data:
+        apply_history_data(options, layerbranch, data, logger)
 
 
 if __name__=="__main__":
@@ -603,6 +704,22 @@ if __name__=="__main__":
                 help="Only operate on a specified subset of files (wildcards allowed)",
                 action="store", dest="filter_files", default='')
 
+        parser.add_option("--changes-file",
+                help="Read the files changed by the commit from the specified JSON file instead of diffing",
+                action="store", dest="changes_file", default='')
+
+        parser.add_option("--fetchdir",
+                help="Use layer repositories in the specified directory instead of LAYER_FETCH_DIR",
+                action="store", dest="fetchdir", default='')
+
+        parser.add_option("--output",
+                help="Parse recipes and write the data to the specified file instead of recording upgrades",
+                action="store", dest="output", default='')
+
+        parser.add_option("--apply",
+                help="Record upgrades from data previously written using --output",
+                action="store", dest="apply", default='')
+
         options, args = parser.parse_args(sys.argv)
 
         logger.setLevel(options.loglevel)
@@ -615,6 +732,13 @@ if __name__=="__main__":
             logger.error('Please specify commit')
             sys.exit(1)
 
+        if options.output and options.apply:
+            logger.error('--output and --apply cannot be used together')
+            sys.exit(1)
+
+        if options.fetchdir:
+            settings.LAYER_FETCH_DIR = options.fetchdir
+
         generate_history(options, int(args[1]), args[2], logger)
     except KeyboardInterrupt:
         if logger:
@@ -11,18 +11,20 @@ import urllib
 import csv
 from django.http import HttpResponse
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView, ListView, DetailView, RedirectView
 from django.urls import resolve, reverse, reverse_lazy
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
 from django.contrib import messages
 
 from layerindex.models import Recipe, StaticBuildDep, Patch
 from rrs.models import Release, Milestone, Maintainer, RecipeMaintainerHistory, \
         RecipeMaintainer, RecipeUpstreamHistory, RecipeUpstream, \
-        RecipeDistro, RecipeUpgrade, MaintenancePlan, RecipeSymbol
+        RecipeDistro, RecipeUpgrade, MaintenancePlan, RecipeSymbol, \
+        MilestoneStatistics, MilestoneIntervalStatistics
 
 
 
@@ -95,7 +97,13 @@ class Raw():
                         FROM rrs_recipemaintainer AS rema
                         INNER JOIN rrs_maintainer AS ma
                         ON rema.maintainer_id = ma.id
-                        WHERE rema.history_id = %s 
+                        INNER JOIN rrs_recipemaintainerhistory AS remahi
+                        ON rema.history_id = remahi.id
+                        INNER JOIN rrs_recipemaintainerhistory AS asof
+                        ON asof.id = %s
+                        WHERE remahi.layerbranch_id = asof.layerbranch_id
+                        AND remahi.date <= asof.date
+                        AND (rema.end_date IS NULL OR rema.end_date > asof.date)
                         AND ma.name = %s;
                     """, [date_id, maintainer])
 
@@ -113,7 +121,13 @@ class Raw():
                     FROM rrs_recipemaintainer AS rema
                     INNER JOIN rrs_maintainer AS ma
                     ON rema.maintainer_id = ma.id
-                    WHERE rema.history_id = %s
+                    INNER JOIN rrs_recipemaintainerhistory AS remahi
+                    ON rema.history_id = remahi.id
+                    INNER JOIN rrs_recipemaintainerhistory AS asof
+                    ON asof.id = %s
+                    WHERE remahi.layerbranch_id = asof.layerbranch_id
+                    AND remahi.date <= asof.date
+                    AND (rema.end_date IS NULL OR rema.end_date > asof.date)
                     AND rema.recipesymbol_id IN %s;"""
             cur = connection.cursor()
             cur.execute(qry, [str(date_id), tuple(recipes_id)])
@@ -267,18 +281,32 @@ class Raw():
         ]
 
 
-def _get_milestone_statistics(milestone, maintainer_name=None):
-    milestone_statistics = {}
-
-    milestone_statistics['all'] = 0
-    milestone_statistics['up_to_date'] = 0
-    milestone_statistics['not_updated'] = 0
-    milestone_statistics['cant_be_updated'] = 0
-    milestone_statistics['unknown'] = 0
+# Statistics for milestones that ended more than this many days ago are
+# assumed not to change when the history is updated
+STATISTICS_REFRESH_DAYS = 30
 
-    if maintainer_name is None:
-        milestone_statistics['all_upgraded'] = 0
-        milestone_statistics['all_not_upgraded'] = 0
+def _get_milestone_intervals(milestone):
+    """
+    Get the intervals (sorted list of (key, start date, end date)) that a
+    milestone is divided into for the maintainer statistics
+    """
+    if "All" in milestone.name:
+        intervals = milestone.get_milestone_intervals(milestone.release)
+    else:
+        intervals = milestone.get_week_intervals()
+    return [(key, intervals[key]['start_date'], intervals[key]['end_date']) for key in sorted(intervals.keys())]
+
+def _compute_milestone_statistics(milestone):
+    """ Calculate the overall statistics for a milestone """
+    milestone_statistics = {
+        'all': 0,
+        'up_to_date': 0,
+        'not_updated': 0,
+        'cant_be_updated': 0,
+        'unknown': 0,
+        'all_upgraded': 0,
+        'all_not_upgraded': 0,
+    }
 
     for maintplanlayer in milestone.release.plan.maintenanceplanlayerbranch_set.all():
         layerbranch = maintplanlayer.layerbranch
@@ -295,80 +323,231 @@ def _get_milestone_statistics(milestone, maintainer_name=None):
                 milestone.end_date,
         )
 
-        if maintainer_name is None:
-            t_updated, t_not_updated, t_cant, t_unknown = \
-                Raw.get_reup_statistics(milestone.release.plan, milestone.end_date, recipe_upstream_history)
-            milestone_statistics['all'] += \
-                t_updated + t_not_updated + t_cant + t_unknown
-            milestone_statistics['up_to_date'] = +t_updated
-            milestone_statistics['not_updated'] = +t_not_updated
-            milestone_statistics['cant_be_updated'] += t_cant
-            milestone_statistics['unknown'] += t_unknown
-
-            if recipe_upstream_history_first:
-                recipes_not_upgraded = \
-                    Raw.get_reup_by_date(recipe_upstream_history_first.id)
-                if recipes_not_upgraded:
-                    recipes_upgraded = \
-                        Raw.get_reupg_by_dates_and_recipes(
-                            milestone.start_date, milestone.end_date, recipes_not_upgraded)
-                    milestone_statistics['all_upgraded'] += len(recipes_upgraded)
-                    milestone_statistics['all_not_upgraded'] += len(recipes_not_upgraded)
+        t_updated, t_not_updated, t_cant, t_unknown = \
+            Raw.get_reup_statistics(milestone.release.plan, milestone.end_date, recipe_upstream_history)
+        milestone_statistics['all'] += \
+            t_updated + t_not_updated + t_cant + t_unknown
+        milestone_statistics['up_to_date'] += t_updated
+        milestone_statistics['not_updated'] += t_not_updated
+        milestone_statistics['cant_be_updated'] += t_cant
+        milestone_statistics['unknown'] += t_unknown
+
+        if recipe_upstream_history_first:
+            recipes_not_upgraded = \
+                Raw.get_reup_by_date(recipe_upstream_history_first.id)
+            if recipes_not_upgraded:
+                recipes_upgraded = \
+                    Raw.get_reupg_by_dates_and_recipes(
+                        milestone.start_date, milestone.end_date, recipes_not_upgraded)
+                milestone_statistics['all_upgraded'] += len(recipes_upgraded)
+                milestone_statistics['all_not_upgraded'] += len(recipes_not_upgraded)
 
-        else:
-            recipe_maintainer_history = Raw.get_remahi_by_end_date(
-                    layerbranch.id, milestone.end_date)
-            recipe_maintainer_all = Raw.get_re_by_mantainer_and_date(
-                    maintainer_name, recipe_maintainer_history[0])
-            milestone_statistics['all'] += len(recipe_maintainer_all)
-            if recipe_upstream_history:
-                recipe_upstream_all = Raw.get_reup_by_recipes_and_date(
-                        recipe_maintainer_all, recipe_upstream_history.id)
-            else:
-                recipe_upstream_all = Raw.get_reup_by_recipes_and_date(
-                        recipe_maintainer_all)
-
-            for ru in recipe_upstream_all:
-                if ru['status'] == 'Y':
-                    milestone_statistics['up_to_date'] += 1
-                elif ru['status'] == 'N':
-                    if ru['no_update_reason'] == '':
-                        milestone_statistics['not_updated'] += 1
+    return milestone_statistics
+
+def _compute_maintainer_statistics(milestone):
+    """
+    Calculate the statistics for each maintainer of recipes in a milestone,
+    returning a dict of maintainer name -> statistics
+    """
+    maintainer_statistics = {}
+
+    for maintplanlayer in milestone.release.plan.maintenanceplanlayerbranch_set.all():
+        layerbranch = maintplanlayer.layerbranch
+
+        recipe_maintainer_history = RecipeMaintainerHistory.get_by_end_date(
+            layerbranch, milestone.end_date)
+        if not recipe_maintainer_history:
+            continue
+
+        maintainer_recipes = {}
+        for name, recipesymbol_id in RecipeMaintainer.get_by_history(
+                recipe_maintainer_history).values_list(
+                'maintainer__name', 'recipesymbol_id').distinct():
+            maintainer_recipes.setdefault(name, set()).add(recipesymbol_id)
+
+        recipe_upstream_history = RecipeUpstreamHistory.get_last_by_date_range(
+            layerbranch,
+            milestone.start_date,
+            milestone.end_date
+        )
+        recipe_upstream = {}
+        all_recipes = set()
+        for recipes in maintainer_recipes.values():
+            all_recipes.update(recipes)
+        if recipe_upstream_history and all_recipes:
+            for ru in Raw.get_reup_by_recipes_and_date(list(all_recipes), recipe_upstream_history.id):
+                recipe_upstream.setdefault(ru['recipesymbol_id'], []).append(ru)
+
+        for name, recipes in maintainer_recipes.items():
+            milestone_statistics = maintainer_statistics.setdefault(name, {
+                'all': 0,
+                'up_to_date': 0,
+                'not_updated': 0,
+                'cant_be_updated': 0,
+                'unknown': 0,
+            })
+            milestone_statistics['all'] += len(recipes)
+            for recipesymbol_id in recipes:
+                for ru in recipe_upstream.get(recipesymbol_id, []):
+                    if ru['status'] == 'Y':
+                        milestone_statistics['up_to_date'] += 1
+                    elif ru['status'] == 'N':
+                        if ru['no_update_reason'] == '':
+                            milestone_statistics['not_updated'] += 1
+                        else:
+                            milestone_statistics['cant_be_updated'] += 1
                     else:
-                        milestone_statistics['cant_be_updated'] += 1
-                else:
-                    milestone_statistics['unknown'] += 1
+                        milestone_statistics['unknown'] += 1
+
+    return maintainer_statistics
 
+def _calculate_milestone_statistics(milestone, intervals=True):
+    """
+    Calculate (without saving) the statistics records for a milestone, with
+    the overall record first and the maintainer records sorted by name.
+    If intervals is True, each maintainer record is given an
+    interval_upgrades dict of interval position -> number of upgrades.
+    """
+    overall = _compute_milestone_statistics(milestone)
+    maintainer_statistics = _compute_maintainer_statistics(milestone)
+    maintainers = {maintainer.name: maintainer for maintainer in
+            Maintainer.objects.filter(name__in=maintainer_statistics.keys())}
+
+    records = [MilestoneStatistics(
+        milestone=milestone,
+        recipes_all=overall['all'],
+        up_to_date=overall['up_to_date'],
+        not_updated=overall['not_updated'],
+        cant_be_updated=overall['cant_be_updated'],
+        unknown=overall['unknown'],
+        all_upgraded=overall['all_upgraded'],
+        all_not_upgraded=overall['all_not_upgraded'])]
+    for name in sorted(maintainer_statistics.keys()):
+        stats = maintainer_statistics[name]
+        record = MilestoneStatistics(
+            milestone=milestone,
+            maintainer=maintainers[name],
+            recipes_all=stats['all'],
+            up_to_date=stats['up_to_date'],
+            not_updated=stats['not_updated'],
+            cant_be_updated=stats['cant_be_updated'],
+            unknown=stats['unknown'])
+        record.interval_upgrades = {}
+        records.append(record)
+
+    if intervals:
+        for idx, (_, start_date, end_date) in enumerate(_get_milestone_intervals(milestone)):
+            upgrades = dict(RecipeUpgrade.objects.filter(
+                    maintainer__name__in=maintainer_statistics.keys(),
+                    commit_date__gte = start_date,
+                    commit_date__lte = end_date).values_list(
+                    'maintainer__name').annotate(Count('id')).order_by())
+            for record in records[1:]:
+                if upgrades.get(record.maintainer.name):
+                    record.interval_upgrades[idx] = upgrades[record.maintainer.name]
+
+    return records
+
+def update_milestone_statistics(milestone):
+    """ Recalculate and store the statistics for a milestone """
+
+    records = _calculate_milestone_statistics(milestone)
+
+    with transaction.atomic():
+        MilestoneStatistics.objects.filter(milestone=milestone).delete()
+        records[0].save()
+        maintainer_records = records[1:]
+        MilestoneStatistics.objects.bulk_create(maintainer_records)
+        if any(record.pk is None for record in maintainer_records):
+            # The database backend can't tell us the ids of the rows just
+            # inserted, so look them up
+            ids = dict(MilestoneStatistics.objects.filter(milestone=milestone, maintainer__isnull=False).values_list('maintainer_id', 'id'))
+            for record in maintainer_records:
+                record.pk = ids[record.maintainer_id]
+        interval_records = []
+        for record in maintainer_records:
+            for idx, upgrades in sorted(record.interval_upgrades.items()):
+                interval_records.append(MilestoneIntervalStatistics(
+                    statistics_id=record.pk,
+                    interval=idx,
+                    upgrades=upgrades))
+        MilestoneIntervalStatistics.objects.bulk_create(interval_records)
+
+def update_plan_statistics(maintplan, full=False, logger=None):
+    """
+    Recalculate the statistics for milestones in a maintenance plan that
+    may be affected by recent history updates (or all milestones if full
+    is True)
+    """
+    milestones = Milestone.objects.filter(release__plan=maintplan)
+    if not full:
+        milestones = milestones.filter(end_date__gte=date.today() - timedelta(days=STATISTICS_REFRESH_DAYS))
+    for milestone in milestones.select_related('release__plan'):
+        if logger:
+            logger.debug('Updating statistics for %s' % milestone)
+        update_milestone_statistics(milestone)
+
+def _get_statistics_records(milestone, intervals=False):
+    """
+    Get the statistics records for a milestone, with the overall record
+    first. If intervals is True, each maintainer record is given an
+    interval_upgrades dict of interval position -> number of upgrades.
+
+    If the statistics haven't been stored yet (or have been invalidated)
+    they are calculated without saving them, so that a GET request never
+    writes to the database; rrs_statistics.py / the history update tools
+    take care of storing them.
+    """
+    qs = MilestoneStatistics.objects.filter(milestone=milestone).select_related('maintainer').order_by(F('maintainer__name').asc(nulls_first=True))
+    records = list(qs)
+    if not records or records[0].maintainer_id is not None:
+        return _calculate_milestone_statistics(milestone, intervals)
+    if intervals:
+        for record in records[1:]:
+            record.interval_upgrades = {}
+        record_map = {record.pk: record for record in records[1:]}
+        for statistics_id, interval, upgrades in MilestoneIntervalStatistics.objects.filter(
+                statistics__in=record_map.keys()).values_list('statistics_id', 'interval', 'upgrades'):
+            record_map[statistics_id].interval_upgrades[interval] = upgrades
+    return records
+
+def _get_milestone_statistics(milestone, records=None):
+    if records is None:
+        records = _get_statistics_records(milestone)
+    stats = records[0]
+
+    milestone_statistics = {}
+    milestone_statistics['all'] = stats.recipes_all
+    milestone_statistics['up_to_date'] = stats.up_to_date
+    milestone_statistics['not_updated'] = stats.not_updated
+    milestone_statistics['cant_be_updated'] = stats.cant_be_updated
+    milestone_statistics['unknown'] = stats.unknown
+    milestone_statistics['all_upgraded'] = stats.all_upgraded
+    milestone_statistics['all_not_upgraded'] = stats.all_not_upgraded
 
     milestone_statistics['percentage'] = '0'
-    if maintainer_name is None:
-        if milestone_statistics['all'] > 0:
-            milestone_statistics['percentage_up_to_date'] = "%.0f" % \
-                (float(milestone_statistics['up_to_date']) * 100.0 \
-                /float(milestone_statistics['all']))
-            milestone_statistics['percentage_not_updated'] = "%.0f" % \
-                (float(milestone_statistics['not_updated']) * 100.0 \
-                /float(milestone_statistics['all']))
-            milestone_statistics['percentage_cant_be_updated'] = "%.0f" % \
-                (float(milestone_statistics['cant_be_updated']) * 100.0 \
-                /float(milestone_statistics['all']))
-            milestone_statistics['percentage_unknown'] = "%.0f" % \
-                (float(milestone_statistics['unknown']) * 100.0
-                /float(milestone_statistics['all']))
-            if milestone_statistics['all_not_upgraded'] > 0:
-                milestone_statistics['percentage'] = "%.0f" % \
-                    ((float(milestone_statistics['all_upgraded']) * 100.0)
-                    /float(milestone_statistics['all_not_upgraded']))
-        else:
-            milestone_statistics['percentage_up_to_date'] = "0"
-            milestone_statistics['percentage_not_updated'] = "0"
-            milestone_statistics['percentage_cant_be_updated'] = "0"
-            milestone_statistics['percentage_unknown'] = "0"
-    else:
-        if milestone_statistics['all'] > 0:
+    if milestone_statistics['all'] > 0:
+        milestone_statistics['percentage_up_to_date'] = "%.0f" % \
+            (float(milestone_statistics['up_to_date']) * 100.0 \
+            /float(milestone_statistics['all']))
+        milestone_statistics['percentage_not_updated'] = "%.0f" % \
+            (float(milestone_statistics['not_updated']) * 100.0 \
+            /float(milestone_statistics['all']))
+        milestone_statistics['percentage_cant_be_updated'] = "%.0f" % \
+            (float(milestone_statistics['cant_be_updated']) * 100.0 \
+            /float(milestone_statistics['all']))
+        milestone_statistics['percentage_unknown'] = "%.0f" % \
+            (float(milestone_statistics['unknown']) * 100.0
+            /float(milestone_statistics['all']))
+        if milestone_statistics['all_not_upgraded'] > 0:
             milestone_statistics['percentage'] = "%.0f" % \
-                ((float(milestone_statistics['up_to_date']) /
-                    float(milestone_statistics['all'])) * 100)
+                ((float(milestone_statistics['all_upgraded']) * 100.0)
+                /float(milestone_statistics['all_not_upgraded']))
+    else:
+        milestone_statistics['percentage_up_to_date'] = "0"
+        milestone_statistics['percentage_not_updated'] = "0"
+        milestone_statistics['percentage_cant_be_updated'] = "0"
+        milestone_statistics['percentage_unknown'] = "0"
 
     return milestone_statistics
 
@@ -388,6 +567,24 @@ class RecipeList():
         self.name = name
         self.summary = summary
 
+def _get_recipe_patch_counts(layerbranch, pns):
+    """
+    Get the total and pending patch counts for the recipe (the first one, if
+    there are several) with each of the specified PNs in a layer branch,
+    returning a dict of pn -> (total, pending)
+    """
+    recipe_ids = {}
+    for recipe_id, pn in Recipe.objects.filter(layerbranch=layerbranch).order_by('pk').values_list('id', 'pn'):
+        if pn in pns:
+            recipe_ids.setdefault(pn, recipe_id)
+
+    patch_counts = {}
+    for row in Patch.objects.filter(recipe__layerbranch=layerbranch).values('recipe').annotate(
+            total=Count('id'), pending=Count('id', filter=Q(status='P'))).order_by():
+        patch_counts[row['recipe']] = (row['total'], row['pending'])
+
+    return {pn: patch_counts.get(recipe_id, (0, 0)) for pn, recipe_id in recipe_ids.items()}
+
 def _get_recipe_list(milestone):
     recipe_list = []
     recipes_ids = []
@@ -396,7 +593,7 @@ def _get_recipe_list(milestone):
     maintainers_dict_all = {}
     current_date = date.today()
 
-    for maintplanlayer in milestone.release.plan.maintenanceplanlayerbranch_set.all():
+    for maintplanlayer in milestone.release.plan.maintenanceplanlayerbranch_set.select_related('layerbranch'):
         layerbranch = maintplanlayer.layerbranch
 
         recipe_maintainer_history = Raw.get_remahi_by_end_date(layerbranch.id,
@@ -414,6 +611,7 @@ def _get_recipe_list(milestone):
                 recipes[i]['version'] = re['pv']
             recipes_ids.append(re['id'])
 
+        patch_counts = {}
         if recipes:
             recipe_last_updated = Raw.get_reup_by_last_updated(
                     layerbranch.id, milestone.end_date)
@@ -432,25 +630,19 @@ def _get_recipe_list(milestone):
                 for ma in maintainers_all:
                     maintainers_dict_all[ma['recipesymbol_id']] = ma['name']
 
+            patch_counts = _get_recipe_patch_counts(layerbranch, set(recipe['pn'] for recipe in recipes))
+
         for recipe in recipes:
             upstream_version = ''
             upstream_status = ''
             no_update_reason = ''
             outdated = ''
-            recipesymbol = RecipeSymbol.objects.filter(id=recipe['id']).first()
 
             if recipe_upstream_history:
                 recipe_upstream = recipe_upstream_dict_all.get(recipe['id'])
                 if not recipe_upstream:
-                    recipe_upstream_add = RecipeUpstream()
-                    recipe_upstream_add.history = recipe_upstream_history
-                    recipe_upstream_add.recipesymbol = recipesymbol
-                    recipe_upstream_add.version = ''
-                    recipe_upstream_add.type = 'M' # Manual
-                    recipe_upstream_add.status = 'U' # Unknown
-                    recipe_upstream_add.no_update_reason = ''
-                    recipe_upstream_add.date = recipe_upstream_history.end_date
-                    recipe_upstream_add.save()
+                    # rrs_upstream_history.py records these as unknown, but
+                    # older history may not include them
                     recipe_upstream = {'version': '', 'status': 'U', 'type': 'M',
                             'no_update_reason': ''}
 
@@ -479,14 +671,8 @@ def _get_recipe_list(milestone):
             recipe_list_item.upstream_status = upstream_status
             recipe_list_item.upstream_version = upstream_version
             recipe_list_item.outdated = outdated
-            recipeobj = recipesymbol.layerbranch.recipe_set.filter(pn=recipesymbol.pn, layerbranch=recipesymbol.layerbranch).first()
-            if recipeobj:
-                patches = recipeobj.patch_set
-                recipe_list_item.patches_total = patches.count()
-                recipe_list_item.patches_pending = patches.filter(status='P').count()
-            else:
-                recipe_list_item.patches_total = 0
-                recipe_list_item.patches_pending = 0
+            recipe_list_item.patches_total, recipe_list_item.patches_pending = \
+                    patch_counts.get(recipe['pn'], (0, 0))
             recipe_list_item.maintainer_name = maintainer_name
             recipe_list_item.no_update_reason = no_update_reason
             recipe_list.append(recipe_list_item)
@@ -589,7 +775,7 @@ class RecipeListView(ListView):
         context['set_maintainers'] =  ['All', 'No maintainer']
         all_maintainers = []
         for layerbranch_id, rmh in self.recipe_maintainer_history.items():
-            for rm in RecipeMaintainer.objects.filter(history=rmh).values(
+            for rm in RecipeMaintainer.get_by_history(rmh).values(
                     'maintainer__name').distinct().order_by('maintainer__name'):
                 if rm['maintainer__name'] in context['set_maintainers']:
                     continue
@@ -702,8 +888,8 @@ def _get_recipe_upgrade_detail(maintplan, recipe_upgrade):
         maintainer_name = recipe_upgrade.maintainer.name
 
         if not recipe_maintainer_history is None and \
-            RecipeMaintainer.objects.filter(maintainer__name
-            = maintainer_name, history = recipe_maintainer_history) \
+            RecipeMaintainer.get_by_history(recipe_maintainer_history).filter(
+            maintainer__name = maintainer_name) \
             .count() > 0:
             is_recipe_maintainer = True
 
@@ -764,8 +950,8 @@ class RecipeDetailView(DetailView):
                 context['upstream_no_update_reason'] = recipe_upstream.no_update_reason
 
         self.recipe_maintainer_history = RecipeMaintainerHistory.get_last(recipesymbol.layerbranch)
-        recipe_maintainer = RecipeMaintainer.objects.filter(recipesymbol=recipesymbol,
-                history=self.recipe_maintainer_history)
+        recipe_maintainer = RecipeMaintainer.get_by_history(
+                self.recipe_maintainer_history).filter(recipesymbol=recipesymbol)
         if recipe_maintainer:
             maintainer = recipe_maintainer[0].maintainer
             context['maintainer_name'] = maintainer.name
@@ -842,57 +1028,43 @@ class MaintainerListView(ListView):
                 name=self.milestone_name)
 
         if "All" in milestone.name:
-            intervals = milestone.get_milestone_intervals(release)
             interval_type = 'Milestone'
         else:
-            intervals = milestone.get_week_intervals()
             interval_type = 'Week'
+        intervals = _get_milestone_intervals(milestone)
 
-        self.milestone_statistics = _get_milestone_statistics(milestone)
-
-        self.maintainer_count = 0
-        for maintplanlayer in maintplan.maintenanceplanlayerbranch_set.all():
-            layerbranch = maintplanlayer.layerbranch
-
-            recipe_maintainer_history = RecipeMaintainerHistory.get_by_end_date(
-                layerbranch, milestone.end_date)
-
-            if recipe_maintainer_history:
-                for rm in RecipeMaintainer.objects.filter(history =
-                        recipe_maintainer_history).values(
-                        'maintainer__name').distinct().order_by('maintainer__name'):
-                    maintainer_list.append(MaintainerList(rm['maintainer__name']))
-
-                self.maintainer_count += len(maintainer_list)
+        records = _get_statistics_records(milestone, intervals=True)
+        self.milestone_statistics = _get_milestone_statistics(milestone, records)
 
-        self.intervals = sorted(intervals.keys())
+        self.intervals = [key for key, _, _ in intervals]
         current_date = date.today()
-        for ml in maintainer_list:
-            milestone_statistics = _get_milestone_statistics(milestone, ml.name)
-            ml.recipes_all = milestone_statistics['all']
-            ml.recipes_up_to_date = ('' if milestone_statistics['up_to_date'] == 0
-                    else milestone_statistics['up_to_date'])
-            ml.recipes_not_updated = ('' if milestone_statistics['not_updated'] == 0
-                    else milestone_statistics['not_updated'])
-            ml.recipes_cant_be_updated = ('' if milestone_statistics['cant_be_updated'] == 0
-                    else milestone_statistics['cant_be_updated'])
-            ml.recipes_unknown = ('' if milestone_statistics['unknown'] == 0
-                    else milestone_statistics['unknown'])
-            ml.percentage_done = milestone_statistics['percentage'] + '%'
-
-            ml.interval_statistics = []
-            self.current_interval = -1
-            for idx, i in enumerate(sorted(intervals.keys())):
-                start_date = intervals[i]['start_date']
-                end_date = intervals[i]['end_date']
-
-                if current_date >= start_date and current_date <= end_date:
-                    self.current_interval = idx
-
-                number = RecipeUpgrade.objects.filter(maintainer__name = ml.name,
-                        commit_date__gte = start_date,
-                        commit_date__lte = end_date).count()
-                ml.interval_statistics.append('' if number == 0 else number)
+        self.current_interval = -1
+        for idx, (_, start_date, end_date) in enumerate(intervals):
+            if current_date >= start_date and current_date <= end_date:
+                self.current_interval = idx
+
+        for stats in records[1:]:
+            ml = MaintainerList(stats.maintainer.name)
+            ml.recipes_all = stats.recipes_all
+            ml.recipes_up_to_date = ('' if stats.up_to_date == 0
+                    else stats.up_to_date)
+            ml.recipes_not_updated = ('' if stats.not_updated == 0
+                    else stats.not_updated)
+            ml.recipes_cant_be_updated = ('' if stats.cant_be_updated == 0
+                    else stats.cant_be_updated)
+            ml.recipes_unknown = ('' if stats.unknown == 0
+                    else stats.unknown)
+            ml.percentage_done = '0%'
+            if stats.recipes_all > 0:
+                ml.percentage_done = "%.0f%%" % \
+                    ((float(stats.up_to_date) / float(stats.recipes_all)) * 100)
+
+            ml.interval_statistics = [''] * len(intervals)
+            for interval, upgrades in stats.interval_upgrades.items():
+                if interval < len(intervals):
+                    ml.interval_statistics[interval] = upgrades
+            maintainer_list.append(ml)
+        self.maintainer_count = len(maintainer_list)
 
         # To add Wk prefix after get statics to avoid sorting problems
         if interval_type == 'Week':
@@ -0,0 +1,43 @@
+# layerindex-web - shared test fixtures
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+# NOTE: requires pytest-django. Run using "pytest" from the root
+# of the repository.
+
+import pytest
+
+@pytest.fixture
+def master_branch(db):
+    from layerindex.models import Branch
+    return Branch.objects.get_or_create(name='master', defaults={'bitbake_branch': 'master'})[0]
+
+@pytest.fixture
+def make_layer(db):
+    """
+    Factory creating a published software layer; any of the defaults can be
+    overridden through keyword arguments
+    """
+    from layerindex.models import LayerItem
+
+    def make_layer(name, **kwargs):
+        values = {'status': 'P', 'layer_type': 'S', 'summary': name, 'description': name,
+                  'vcs_url': 'git://example.com/%s' % name}
+        values.update(kwargs)
+        return LayerItem.objects.create(name=name, **values)
+    return make_layer
+
+@pytest.fixture
+def make_layerbranch(master_branch, make_layer):
+    """
+    Factory creating a layer (as for make_layer) along with its layer
+    branch, on master unless another branch is given
+    """
+    from layerindex.models import LayerBranch
+
+    def make_layerbranch(name, branch=None, **kwargs):
+        layer = make_layer(name, **kwargs)
+        return LayerBranch.objects.create(layer=layer, branch=branch or master_branch)
+    return make_layerbranch
@@ -0,0 +1,113 @@
+# layerindex-web - tests for the branch snapshot export/import tool
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+# NOTE: requires pytest-django. Run using "pytest" from the root
+# of the repository.
+
+import sys
+import os
+import json
+import logging
+import pytest
+
+basepath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(basepath, 'layerindex', 'tools'))
+import branch_snapshot
+
+def dump(branch, since=None):
+    records = list(branch_snapshot.export_snapshot(branch, since))
+    # The update id in the header is expected to differ
+    records[0].pop('update')
+    return json.loads(json.dumps(records, default=str))
+
+@pytest.fixture
+def branch(master_branch, make_layerbranch):
+    from layerindex.models import LayerMaintainer, LayerNote, LayerDependency, \
+        Recipe, Patch, Machine, Distro, BBClass, BBAppend, IncFile, Update
+    import recipeparse
+
+    branch = master_branch
+    layerbranches = []
+    for i in range(3):
+        layerbranch = make_layerbranch('layer%d' % i, summary='Layer %d' % i, description='Test layer')
+        layerbranch.vcs_last_rev = '%040d' % i
+        layerbranch.save()
+        LayerMaintainer.objects.create(layerbranch=layerbranch, name='Maintainer %d' % i, email='m%d@example.com' % i)
+        layerbranches.append(layerbranch)
+    LayerNote.objects.create(layer=layerbranches[0].layer, text='A note')
+    LayerDependency.objects.create(layerbranch=layerbranches[1], dependency=layerbranches[0].layer)
+    LayerDependency.objects.create(layerbranch=layerbranches[2], dependency=layerbranches[1].layer, required=False)
+
+    writebuffer = recipeparse.RecipeWriteBuffer(logging.getLogger(), 100)
+    for layerbranch in layerbranches:
+        for j in range(4):
+            recipe = Recipe.objects.create(layerbranch=layerbranch, filename='r%d_1.0.bb' % j, filepath='recipes-test/r%d' % j,
+                                           pn='r%d' % j, pv='1.0', summary='Recipe %d' % j, provides='p%d' % j,
+                                           bbclassextend='native', inherits='autotools pkgconfig')
+            writebuffer.add(recipe,
+                            ['http://example.com/r%d-1.0.tar.gz' % j],
+                            'zlib dep%d' % j,
+                            recipe.inherits,
+                            {'foo': '--with-foo,--without-foo,libfoo'},
+                            [Patch(recipe=recipe, path='recipes-test/r%d/files/fix.patch' % j, src_path='fix.patch', status='A')],
+                            ['recipes-test/r%d/files/fix.patch' % j])
+        Machine.objects.create(layerbranch=layerbranch, name='machine%d' % layerbranch.id, description='Test machine')
+        Distro.objects.create(layerbranch=layerbranch, name='distro%d' % layerbranch.id, description='Test distro')
+        BBClass.objects.create(layerbranch=layerbranch, name='testclass')
+        BBAppend.objects.create(layerbranch=layerbranch, filename='r0_%.bbappend', filepath='recipes-test/r0')
+        IncFile.objects.create(layerbranch=layerbranch, path='conf/test.inc')
+    writebuffer.flush()
+    Update.objects.create(started='2024-01-01 00:00')
+    return branch
+
+def test_round_trip(branch, make_layerbranch, tmpdir):
+    from layerindex.models import LayerItem, LayerBranch, LayerDependency, Recipe, StaticBuildDep, InheritedClass, Machine
+
+    before = dump(branch)
+    snapshotfile = str(tmpdir.join('snapshot.jsonl.gz'))
+    assert branch_snapshot.write_snapshot(branch, snapshotfile) == len(before)
+
+    # Change things the import should put back
+    Recipe.objects.filter(layerbranch__layer__name='layer0', pn='r1').delete()
+    Recipe.objects.filter(layerbranch__layer__name='layer1', pn='r2').update(pv='2.0')
+    Recipe.objects.create(layerbranch=LayerBranch.objects.get(layer__name='layer1'), filename='extra.bb', pn='extra')
+    StaticBuildDep.objects.get(name='zlib').recipes.clear()
+    InheritedClass.objects.get(name='pkgconfig').recipes.clear()
+    LayerDependency.objects.filter(layerbranch__layer__name='layer1').delete()
+    Machine.objects.create(layerbranch=LayerBranch.objects.get(layer__name='layer2'), name='bogus')
+    LayerItem.objects.filter(name='layer2').update(summary='Changed')
+    make_layerbranch('extra', status='N')
+    assert dump(branch) != before
+
+    branch_snapshot.import_snapshot(branch_snapshot.read_snapshot(snapshotfile))
+    assert dump(branch) == before
+    assert not LayerBranch.objects.filter(layer__name='extra').exists()
+
+    # Importing again shouldn't change anything
+    branch_snapshot.import_snapshot(branch_snapshot.read_snapshot(snapshotfile))
+    assert dump(branch) == before
+
+def test_since(branch):
+    from layerindex.models import LayerUpdate, Update
+
+    update = Update.objects.create(started='2024-01-02 00:00')
+    layerupdate = LayerUpdate(layer=branch.layerbranch_set.get(layer__name='layer1').layer, branch=branch,
+                              update=update, started='2024-01-02 00:00')
+    layerupdate.save()
+    records = dump(branch, since=update.id - 1)
+    assert [record['layer'] for record in records if record['type'] == 'content'] == ['layer1']
+    # Layer and layer branch records are always included in full
+    assert [record['layer'] for record in records if record['type'] == 'layerbranch'] == ['layer0', 'layer1', 'layer2']
+
+def test_bad_snapshot(branch):
+    with pytest.raises(branch_snapshot.SnapshotError):
+        branch_snapshot.import_snapshot(iter([{'type': 'layer', 'name': 'layer0'}]))
+    records = dump(branch)
+    records[0]['update'] = None
+    # Cut off part way through the content of a layer
+    end = [i for i, record in enumerate(records) if record['type'] == 'end'][0]
+    with pytest.raises(branch_snapshot.SnapshotError):
+        branch_snapshot.import_snapshot(iter(records[:end]))
@@ -0,0 +1,118 @@
+# layerindex-web - tests for the RRS concurrent upstream checker
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+# NOTE: these tests do not need the database; they run the checker against
+# a local HTTP server. Run using "pytest" from the root of the repository.
+
+import sys
+import os
+import threading
+import time
+import urllib.request
+import urllib.error
+import http.server
+import pytest
+
+basepath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(basepath, 'rrs', 'tools'))
+from common import ConcurrentChecker
+
+
+class CheckHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        host = self.headers['Host'].split(':')[0]
+        with server.lock:
+            server.running[host] = server.running.get(host, 0) + 1
+            server.total += 1
+            server.max_running[host] = max(server.max_running.get(host, 0), server.running[host])
+            server.max_total = max(server.max_total, server.total)
+        try:
+            if self.path.startswith('/missing'):
+                self.send_error(404)
+                return
+            time.sleep(3 if self.path.startswith('/slow') else 0.2)
+            body = self.path.encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.running[host] -= 1
+                server.total -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CheckHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.running = {}
+    httpd.max_running = {}
+    httpd.total = 0
+    httpd.max_total = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=10) as f:
+        return f.read().decode()
+
+
+def urls(server, host, paths):
+    port = server.server_address[1]
+    return [(host, 'http://%s:%d%s' % (host, port, path)) for path in paths]
+
+
+def test_host_limit(server):
+    items = urls(server, '127.0.0.1', ['/a%d' % i for i in range(6)])
+    items += urls(server, 'localhost', ['/b%d' % i for i in range(6)])
+    checker = ConcurrentChecker(fetch, jobs=4, host_jobs=2, timeout=30)
+    results = {url: (result, error) for url, result, error in checker.run(items)}
+
+    assert len(results) == len(items)
+    for url, (result, error) in results.items():
+        assert error is None
+        assert url.endswith(result)
+    assert server.max_running['127.0.0.1'] == 2
+    assert server.max_running['localhost'] == 2
+    # A busy host must not hold up checks against the other one
+    assert server.max_total == 4
+
+
+def test_timeout(server):
+    items = urls(server, '127.0.0.1', ['/slow', '/fast'])
+    checker = ConcurrentChecker(fetch, jobs=2, host_jobs=2, timeout=1)
+    results = {url: (result, error) for url, result, error in checker.run(items)}
+
+    result, error = results[items[0][1]]
+    assert result is None
+    assert isinstance(error, TimeoutError)
+    result, error = results[items[1][1]]
+    assert result == '/fast'
+    assert error is None
+
+
+def test_error(server):
+    items = urls(server, '127.0.0.1', ['/missing', '/ok'])
+    checker = ConcurrentChecker(fetch, jobs=1, host_jobs=1, timeout=30)
+    results = {url: (result, error) for url, result, error in checker.run(items)}
+
+    result, error = results[items[0][1]]
+    assert result is None
+    assert isinstance(error, urllib.error.HTTPError)
+    assert error.code == 404
+    result, error = results[items[1][1]]
+    assert result == '/ok'
+    assert error is None
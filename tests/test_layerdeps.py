@@ -0,0 +1,157 @@
+# layerindex-web - tests for the layer dependency graph
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+# NOTE: requires pytest-django. Run using "pytest" from the root
+# of the repository.
+
+import pytest
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Branch ids (and thus cache keys) get reused between tests
+    from django.core.cache import cache
+    cache.clear()
+    yield
+    cache.clear()
+
+@pytest.fixture
+def layers(make_layerbranch, make_layer):
+    from layerindex.models import LayerDependency
+
+    layerbranches = {}
+    for name in ['core', 'meta-a', 'meta-b', 'meta-c', 'meta-d', 'meta-x', 'meta-y']:
+        layerbranches[name] = make_layerbranch(name)
+    # Only exists on another branch
+    external = make_layer('meta-external')
+    def add_dep(name, depname, required=True):
+        if depname == 'meta-external':
+            dependency = external
+        else:
+            dependency = layerbranches[depname].layer
+        LayerDependency.objects.create(layerbranch=layerbranches[name], dependency=dependency, required=required)
+    add_dep('meta-a', 'core')
+    add_dep('meta-b', 'meta-a')
+    add_dep('meta-b', 'meta-c', required=False)
+    add_dep('meta-c', 'core')
+    add_dep('meta-d', 'meta-external')
+    add_dep('meta-d', 'meta-b')
+    # A dependency loop
+    add_dep('meta-x', 'meta-y')
+    add_dep('meta-y', 'meta-x')
+    return layerbranches
+
+def names(layerbranches, ids):
+    id_names = {layerbranch.id: name for name, layerbranch in layerbranches.items()}
+    return [id_names[layerbranch_id] for layerbranch_id in ids]
+
+def test_dependencies(layers):
+    from layerindex.layerdeps import LayerDependencyGraph
+
+    graph = LayerDependencyGraph.get(layers['core'].branch_id)
+    edges = graph.dependencies(layers['meta-b'].id)
+    assert [(edge.name, edge.required) for edge in edges] == [('meta-a', True), ('meta-c', False)]
+    assert [edge.name for edge in graph.dependencies(layers['meta-b'].id, required=False)] == ['meta-c']
+    # Dependencies on layers not on the branch have no layer branch
+    edges = graph.dependencies(layers['meta-d'].id)
+    assert [(edge.name, edge.layerbranch_id) for edge in edges] == [('meta-external', None), ('meta-b', layers['meta-b'].id)]
+
+def test_recursive_dependencies(layers):
+    from layerindex.layerdeps import LayerDependencyGraph
+
+    graph = LayerDependencyGraph.get(layers['core'].branch_id)
+    assert names(layers, graph.recursive_dependencies(layers['meta-d'].id)) == ['meta-b', 'meta-a', 'core']
+    assert names(layers, graph.recursive_dependencies(layers['meta-d'].id, required=False)) == ['meta-b', 'meta-a', 'core', 'meta-c']
+    assert names(layers, graph.recursive_dependencies(layers['meta-a'].id, include_self=True)) == ['meta-a', 'core']
+    assert names(layers, graph.recursive_dependencies(layers['meta-x'].id)) == ['meta-y']
+    # The model methods return layer branches in the same order
+    assert [lb.layer.name for lb in layers['meta-d'].get_recursive_dependencies()] == ['meta-b', 'meta-a', 'core']
+
+def test_dependents(layers):
+    from layerindex.layerdeps import LayerDependencyGraph
+
+    graph = LayerDependencyGraph.get(layers['core'].branch_id)
+    assert names(layers, graph.dependents(layers['core'].id)) == ['meta-a', 'meta-c']
+    assert names(layers, graph.dependents(layers['core'].id, recursive=True)) == ['meta-a', 'meta-b', 'meta-c', 'meta-d']
+    assert names(layers, graph.dependents(layers['meta-c'].id)) == []
+    assert names(layers, graph.dependents(layers['meta-c'].id, required=False)) == ['meta-b']
+    assert names(layers, graph.dependents(layers['meta-x'].id, recursive=True)) == ['meta-y']
+    assert [lb.layer.name for lb in layers['meta-a'].get_dependents(recursive=True)] == ['meta-b', 'meta-d']
+
+def test_topological_order(layers):
+    from layerindex.layerdeps import LayerDependencyGraph
+
+    graph = LayerDependencyGraph.get(layers['core'].branch_id)
+    # Layers caught in the loop come last
+    assert names(layers, graph.topological_order()) == ['core', 'meta-a', 'meta-b', 'meta-c', 'meta-d', 'meta-x', 'meta-y']
+    assert names(layers, graph.topological_order(required=False)) == ['core', 'meta-a', 'meta-c', 'meta-b', 'meta-d', 'meta-x', 'meta-y']
+    subset = [layers[name].id for name in ('meta-d', 'meta-b', 'meta-c')]
+    assert names(layers, graph.topological_order(subset)) == ['meta-b', 'meta-c', 'meta-d']
+    assert names(layers, graph.topological_order(subset, required=False)) == ['meta-c', 'meta-b', 'meta-d']
+
+def test_invalidation(layers):
+    from layerindex.layerdeps import LayerDependencyGraph
+    from layerindex.models import LayerDependency
+
+    branch_id = layers['core'].branch_id
+    graph = LayerDependencyGraph.get(branch_id)
+    assert LayerDependencyGraph.get(branch_id).version == graph.version
+
+    # Adding a dependency
+    LayerDependency.objects.create(layerbranch=layers['meta-c'], dependency=layers['meta-x'].layer)
+    graph = LayerDependencyGraph.get(branch_id)
+    assert names(layers, graph.recursive_dependencies(layers['meta-c'].id)) == ['core', 'meta-x', 'meta-y']
+
+    # Removing one
+    LayerDependency.objects.filter(layerbranch=layers['meta-b'], dependency=layers['meta-a'].layer).delete()
+    graph = LayerDependencyGraph.get(branch_id)
+    assert names(layers, graph.dependents(layers['meta-a'].id)) == []
+
+    # Renaming a layer
+    layer = layers['meta-x'].layer
+    layer.name = 'meta-renamed'
+    layer.save()
+    graph = LayerDependencyGraph.get(branch_id)
+    assert graph.nodes[layers['meta-x'].id].name == 'meta-renamed'
+
+    # Deleting a layer branch
+    layers['meta-y'].delete()
+    graph = LayerDependencyGraph.get(branch_id)
+    assert layers['meta-y'].id not in graph.nodes
+    assert [edge.layerbranch_id for edge in graph.dependencies(layers['meta-x'].id)] == [None]
+
+def test_rollback(layers, transactional_db):
+    from django.core.cache import cache
+    from django.db import transaction
+    from layerindex.layerdeps import LayerDependencyGraph, CACHE_KEY
+    from layerindex.models import LayerDependency
+
+    branch_id = layers['core'].branch_id
+    graph = LayerDependencyGraph.get(branch_id)
+    # Outside of a transaction the graph is cached straight away
+    assert cache.get(CACHE_KEY % (branch_id, graph.version)) is not None
+
+    class Rollback(Exception):
+        pass
+    with pytest.raises(Rollback):
+        with transaction.atomic():
+            LayerDependency.objects.create(layerbranch=layers['meta-c'], dependency=layers['meta-x'].layer)
+            graph = LayerDependencyGraph.get(branch_id)
+            assert names(layers, graph.recursive_dependencies(layers['meta-c'].id)) == ['core', 'meta-x', 'meta-y']
+            raise Rollback()
+    assert cache.get(CACHE_KEY % (branch_id, graph.version)) is None
+
+    # The rolled back version gets reused by the next change
+    LayerDependency.objects.create(layerbranch=layers['meta-c'], dependency=layers['meta-d'].layer)
+    new_graph = LayerDependencyGraph.get(branch_id)
+    assert new_graph.version == graph.version
+    assert names(layers, new_graph.recursive_dependencies(layers['meta-c'].id)) == ['core', 'meta-d', 'meta-b', 'meta-a']
+
+    # Committed changes are cached
+    with transaction.atomic():
+        LayerDependency.objects.filter(layerbranch=layers['meta-c'], dependency=layers['meta-d'].layer).delete()
+        graph = LayerDependencyGraph.get(branch_id)
+        assert cache.get(CACHE_KEY % (branch_id, graph.version)) is None
+    assert cache.get(CACHE_KEY % (branch_id, graph.version)) is not None
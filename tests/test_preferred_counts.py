@@ -0,0 +1,79 @@
+# layerindex-web - tests for recipe preferred_count maintenance
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+# NOTE: requires pytest-django. Run using "pytest" from the root
+# of the repository.
+
+import pytest
+
+@pytest.fixture
+def layerbranches(make_layerbranch):
+    from layerindex.models import Branch, LayerBranch
+
+    otherbranch = Branch.objects.create(name='other', bitbake_branch='other')
+    layerbranches = {}
+    for name, layer_type, preference in [('low', 'S', 0), ('mid', 'S', 5), ('base', 'A', 5), ('misc', 'M', 10)]:
+        layerbranches[name] = make_layerbranch(name, layer_type=layer_type, index_preference=preference)
+        layerbranches['%s-other' % name] = LayerBranch.objects.create(layer=layerbranches[name].layer, branch=otherbranch)
+    return layerbranches
+
+def add_recipe(layerbranch, pn, version='1.0'):
+    from layerindex.models import Recipe
+    return Recipe.objects.create(layerbranch=layerbranch, pn=pn, pv=version, filename='%s_%s.bb' % (pn, version))
+
+def counts(layerbranches, pn):
+    from layerindex.models import Recipe
+    id_names = {layerbranch.id: name for name, layerbranch in layerbranches.items()}
+    return sorted((id_names[layerbranch_id], count) for layerbranch_id, count in
+                  Recipe.objects.filter(pn=pn).values_list('layerbranch_id', 'preferred_count'))
+
+def test_update_preferred_counts(layerbranches):
+    from layerindex.models import Recipe
+
+    for name in ('low', 'mid', 'base', 'misc'):
+        add_recipe(layerbranches[name], 'foo')
+    # A second version in the same layer doesn't count against itself
+    add_recipe(layerbranches['low'], 'foo', '2.0')
+    add_recipe(layerbranches['low'], 'bar')
+    add_recipe(layerbranches['low-other'], 'foo')
+    branch_id = layerbranches['low'].branch_id
+
+    Recipe.update_preferred_counts(branch_id)
+    # Only software and base layers with a higher preference count, and
+    # only on the same branch
+    assert counts(layerbranches, 'foo') == [('base', 0), ('low', 2), ('low', 2), ('low-other', 0), ('mid', 0), ('misc', 0)]
+    assert counts(layerbranches, 'bar') == [('low', 0)]
+
+    Recipe.objects.filter(layerbranch=layerbranches['mid'], pn='foo').delete()
+    # Restricted to other names, so nothing changes
+    Recipe.update_preferred_counts(branch_id, ['bar'])
+    assert counts(layerbranches, 'foo') == [('base', 0), ('low', 2), ('low', 2), ('low-other', 0), ('misc', 0)]
+    Recipe.update_preferred_counts(branch_id, ['foo', 'bar'])
+    assert counts(layerbranches, 'foo') == [('base', 0), ('low', 1), ('low', 1), ('low-other', 0), ('misc', 0)]
+    # Nothing to do for an empty list
+    Recipe.update_preferred_counts(branch_id, [])
+
+def test_layer_changes(layerbranches):
+    from layerindex.models import Recipe
+
+    for name in ('low', 'mid', 'misc'):
+        add_recipe(layerbranches[name], 'foo')
+    Recipe.update_preferred_counts(layerbranches['low'].branch_id)
+    assert counts(layerbranches, 'foo') == [('low', 1), ('mid', 0), ('misc', 0)]
+
+    # Changing the preference or type of a layer updates the counts
+    layer = layerbranches['misc'].layer
+    layer.layer_type = 'S'
+    layer.save()
+    assert counts(layerbranches, 'foo') == [('low', 2), ('mid', 1), ('misc', 0)]
+    layer = layerbranches['low'].layer
+    layer.index_preference = 20
+    layer.save()
+    assert counts(layerbranches, 'foo') == [('low', 0), ('mid', 2), ('misc', 1)]
+
+    # As does deleting a layer branch
+    layerbranches['low'].delete()
+    assert counts(layerbranches, 'foo') == [('mid', 1), ('misc', 0)]
@@ -0,0 +1,133 @@
+# layerindex-web - tests for the full-text search
+#
+# Licensed under the MIT license, see COPYING.MIT for details
+#
+# SPDX-License-Identifier: MIT
+
+# NOTE: requires pytest-django. Run using "pytest" from the root
+# of the repository.
+
+import pytest
+
+@pytest.fixture
+def layerbranch(make_layerbranch):
+    from layerindex.models import Recipe, Machine, BBClass
+    from layerindex import search
+
+    layerbranch = make_layerbranch('meta-test', summary='Test layer', description='Test layer')
+    for pn, summary, description in [
+            ('openssl', 'Secure Socket Layer', 'Toolkit implementing the SSL and TLS protocols'),
+            ('ssl-utils', 'Certificate utilities', 'Tools for managing certificates'),
+            ('libtls', 'TLS library', 'Library implementing Transport Layer Security'),
+            ('gnutls', 'GNU Transport Layer Security library', 'Secure communications library supporting SSL'),
+            ('zlib', 'Compression library', 'General purpose lossless data-compression library')]:
+        Recipe.objects.create(layerbranch=layerbranch, pn=pn, filename='%s_1.0.bb' % pn, summary=summary, description=description)
+    Machine.objects.create(layerbranch=layerbranch, name='qemux86', description='QEMU x86 emulated machine')
+    Machine.objects.create(layerbranch=layerbranch, name='beaglebone', description='BeagleBone board')
+    BBClass.objects.create(layerbranch=layerbranch, name='cmake')
+    search.get_backend().update_layerbranch(layerbranch)
+    return layerbranch
+
+def pns(results):
+    return [recipe.pn for recipe in results]
+
+def test_tokenize():
+    from layerindex import search
+    assert search.tokenize('GNU Transport-Layer_Security, v3.0') == ['gnu', 'transport', 'layer', 'security', 'v3', '0']
+    assert search.tokenize(None) == []
+
+def test_search_order(layerbranch):
+    from layerindex import search
+    from layerindex.models import Recipe
+
+    qs = Recipe.objects.filter(layerbranch=layerbranch)
+    # Name matches come first, exact match before substring, then text
+    # matches in the summary ahead of those only in the description
+    results = search.search(qs, 'ssl', ['pn'])
+    assert pns(results) == ['openssl', 'ssl-utils', 'gnutls']
+    results = search.search(qs, 'tls', ['pn'])
+    assert pns(results) == ['gnutls', 'libtls', 'openssl']
+    results = search.search(qs, 'openssl', ['pn'])
+    assert pns(results) == ['openssl']
+
+def test_search_keywords(layerbranch):
+    from layerindex import search
+    from layerindex.models import Recipe
+
+    qs = Recipe.objects.filter(layerbranch=layerbranch)
+    # All keywords must match, as prefixes of words
+    assert pns(search.search(qs, 'transport secur', ['pn'])) == ['gnutls', 'libtls']
+    assert pns(search.search(qs, 'compress', ['pn'])) == ['zlib']
+    assert pns(search.search(qs, 'transport compression', ['pn'])) == []
+    # Only objects within the queryset are returned
+    assert pns(search.search(qs.exclude(pn='libtls'), 'transport', ['pn'])) == ['gnutls']
+
+def test_search_other_models(layerbranch):
+    from layerindex import search
+    from layerindex.models import Machine, BBClass
+
+    machines = Machine.objects.filter(layerbranch=layerbranch)
+    assert [machine.name for machine in search.search(machines, 'emulated', ['name'])] == ['qemux86']
+    assert [machine.name for machine in search.search(machines, 'beagle', ['name'])] == ['beaglebone']
+    classes = BBClass.objects.filter(layerbranch=layerbranch)
+    assert [bbclass.name for bbclass in search.search(classes, 'make', ['name'])] == ['cmake']
+
+def test_update_layerbranch(layerbranch):
+    from layerindex import search
+    from layerindex.models import Recipe
+
+    qs = Recipe.objects.filter(layerbranch=layerbranch)
+    Recipe.objects.filter(pn='zlib').update(description='Deflate library')
+    Recipe.objects.filter(pn='libtls').delete()
+    search.get_backend().update_layerbranch(layerbranch)
+    assert pns(search.search(qs, 'deflate', ['pn'])) == ['zlib']
+    assert pns(search.search(qs, 'lossless', ['pn'])) == []
+    assert pns(search.search(qs, 'transport', ['pn'])) == ['gnutls']
+
+def test_filter_text_fields(layerbranch):
+    from layerindex import search
+    from layerindex.models import Recipe
+
+    qs = Recipe.objects.filter(layerbranch=layerbranch)
+    assert sorted(qs.filter(search.filter_text_fields(qs, 'certificates')).values_list('pn', flat=True)) == ['ssl-utils']
+    assert sorted(qs.filter(search.filter_text_fields(qs, 'library')).values_list('pn', flat=True)) == ['gnutls', 'libtls', 'zlib']
+    assert not qs.filter(search.filter_text_fields(qs, '--')).exists()
+
+def test_search_api(layerbranch):
+    from rest_framework.test import APIRequestFactory
+    from layerindex.restviews import RecipeViewSet
+
+    view = RecipeViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+    response = view(factory.get('/layerindex/api/recipes/', {'search': 'certificates'}))
+    assert [recipe['pn'] for recipe in response.data] == ['ssl-utils']
+    # Each term can match any field, but all terms must match
+    response = view(factory.get('/layerindex/api/recipes/', {'search': 'gnutls library'}))
+    assert [recipe['pn'] for recipe in response.data] == ['gnutls']
+
+@pytest.mark.parametrize('backend, condition', [
+    ('PostgreSQLSearchBackend', "(setweight(to_tsvector('simple', coalesce(%(table)s.\"pn\", '')), 'A') || "
+                                "setweight(to_tsvector('simple', coalesce(%(table)s.\"summary\", '')), 'B') || "
+                                "setweight(to_tsvector('simple', coalesce(%(table)s.\"description\", '')), 'C')) "
+                                "@@ to_tsquery('simple', %%s)"),
+    ('MySQLSearchBackend', 'MATCH (%(table)s.\"pn\", %(table)s.\"summary\", %(table)s.\"description\") '
+                           'AGAINST (%%s IN BOOLEAN MODE)'),
+])
+def test_search_sql(layerbranch, monkeypatch, backend, condition):
+    from layerindex import search, querysethelper
+    from layerindex.models import Recipe
+
+    # Only the SQL is checked, since it can't run on the test database
+    monkeypatch.setattr(search, '_backend', getattr(search, backend)())
+    qs = querysethelper._get_search_results('ssl', Recipe.objects.filter(layerbranch=layerbranch), Recipe)
+    sql, params = qs.query.sql_with_params()
+    # The condition applies to the outer query (so the index can be used),
+    # and is not compared against anything
+    assert (' OR %s)' % (condition % {'table': '"layerindex_recipe"'})) in sql
+    assert 'SELECT' not in sql[1:]
+    assert params[-1] in ['ssl:*', '+ssl*']
+
+    # Within a subquery the columns follow the table alias
+    sql, _ = Recipe.objects.filter(pk__in=qs.values('pk')).query.sql_with_params()
+    assert condition % {'table': 'U0'} in sql
+    assert condition % {'table': '"layerindex_recipe"'} not in sql